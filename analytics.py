@@ -0,0 +1,176 @@
+# analytics.py
+"""Vectorized order-book analytics over a symbol's stored snapshots (served by /analytics).
+
+Snapshots are taken as flat columns, the same layout as wire.py's columnar
+format: per snapshot a timestamp and a slice of levels, each level a price in
+ticks and a signed quantity (asks negative). Every metric is computed with
+NumPy over the whole window at once; there is no per-snapshot Python loop.
+"""
+import numpy as np
+
+from storage import PRICE_SCALE
+
+
+def _rounded(values, digits=4):
+    """A float array as a JSON-ready list, NaN as None."""
+    return [None if v != v else round(v, digits) for v in values.tolist()]
+
+
+class BookColumns:
+    """A window of snapshots as flat arrays; snapshot i owns levels offsets[i]:offsets[i+1].
+
+    Empty levels are dropped and each snapshot's levels are ordered best
+    first: bids by descending price, then asks by ascending price.
+    """
+
+    def __init__(self, timestamps, offsets, ticks, quantities):
+        n = len(timestamps)
+        rows = np.repeat(np.arange(n), np.diff(offsets))
+        keep = quantities != 0
+        if not keep.all():
+            rows, ticks, quantities = rows[keep], ticks[keep], quantities[keep]
+            offsets = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n))))
+
+        # Sort key: snapshot, then side (bids first), then distance from the touch
+        ask = np.signbit(quantities)
+        ticks64 = ticks.astype(np.int64)
+        key = (rows.astype(np.int64) << 33) | (ask.astype(np.int64) << 32) | np.where(ask, ticks64, 0x7FFFFFFF - ticks64)
+        if len(key) > 1 and not (key[1:] >= key[:-1]).all():
+            order = np.argsort(key, kind="stable")
+            ticks, quantities, ask = ticks[order], quantities[order], ask[order]
+
+        self.timestamps = timestamps
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.rows = rows
+        self.ticks = ticks64 if ticks is ticks64 else ticks.astype(np.int64)
+        self.sizes = np.abs(quantities).astype(np.float64)
+        self.ask = ask
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_chunks(cls, chunks, start=None, end=None):
+        """Join wire.ColumnChunks (oldest first), keeping snapshots within [start, end] ms."""
+        timestamps, offsets, ticks, quantities = [], [np.zeros(1, np.int64)], [], []
+        base = 0
+        for chunk in chunks:
+            if not len(chunk):
+                continue
+            if start is not None and chunk.timestamps[-1] < start:
+                continue
+            if end is not None and chunk.timestamps[0] > end:
+                break
+            ts = np.frombuffer(chunk.timestamps, dtype=np.float64)
+            lo = 0 if start is None else int(np.searchsorted(ts, start, "left"))
+            hi = len(ts) if end is None else int(np.searchsorted(ts, end, "right"))
+            if lo >= hi:
+                continue
+            chunk_offsets = np.frombuffer(chunk.offsets, dtype=np.uint32).astype(np.int64)
+            first, last = chunk_offsets[lo], chunk_offsets[hi]
+            timestamps.append(ts[lo:hi])
+            offsets.append(chunk_offsets[lo + 1:hi + 1] - first + base)
+            ticks.append(np.frombuffer(chunk.prices, dtype=np.int32)[first:last])
+            quantities.append(np.frombuffer(chunk.quantities, dtype=np.float32)[first:last])
+            base += last - first
+        if not timestamps:
+            return cls(np.zeros(0), np.zeros(1, np.int64), np.zeros(0, np.int32), np.zeros(0, np.float32))
+        return cls(np.concatenate(timestamps), np.concatenate(offsets), np.concatenate(ticks), np.concatenate(quantities))
+
+    def touch(self):
+        """(best bid tick, best ask tick, bid level count) per snapshot; -1 where a side is empty."""
+        starts = self.offsets[:-1]
+        counts = np.diff(self.offsets)
+        bid_before = np.concatenate(([0], np.cumsum(~self.ask)))
+        bid_counts = bid_before[self.offsets[1:]] - bid_before[starts]
+        last = max(len(self.ticks) - 1, 0)
+        ticks = self.ticks if len(self.ticks) else np.zeros(1, np.int64)
+        best_bid = np.where(bid_counts > 0, ticks[np.minimum(starts, last)], -1)
+        best_ask = np.where(counts > bid_counts, ticks[np.minimum(starts + bid_counts, last)], -1)
+        return best_bid, best_ask, bid_counts
+
+
+def downsample(timestamps, series, points):
+    """Average each series into at most `points` equal time buckets; empty buckets are left out."""
+    t0, t1 = timestamps[0], timestamps[-1]
+    width = max((t1 - t0) / points, 1.0)
+    bucket = np.minimum(((timestamps - t0) / width).astype(np.int64), points - 1)
+    filled = np.bincount(bucket, minlength=points) > 0
+    out = {"timestamp": (t0 + np.arange(points)[filled] * width).astype(np.int64).tolist()}
+    for name, values in series.items():
+        finite = np.isfinite(values)
+        total = np.bincount(bucket[finite], weights=values[finite], minlength=points)
+        count = np.bincount(bucket[finite], minlength=points)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[name] = _rounded((total / count)[filled])
+    return out
+
+
+def summarize(book, levels=5, points=500, depth_ticks=20, wall_multiple=5.0, min_persistence=0.5, max_walls=20):
+    """Imbalance, spread and mid series, cumulative depth curves and persistent large levels."""
+    n = len(book)
+    if n == 0:
+        return {"snapshots": 0, "series": None, "depth": None, "walls": []}
+
+    best_bid, best_ask, bid_counts = book.touch()
+    both = (best_bid >= 0) & (best_ask >= 0)
+    with np.errstate(invalid="ignore"):
+        spread = np.where(both, (best_ask - best_bid) / PRICE_SCALE, np.nan)
+        mid = np.where(both, (best_ask + best_bid) / (2 * PRICE_SCALE), np.nan)
+
+    # Rank of each level from the touch on its own side
+    rows, ask, sizes = book.rows, book.ask, book.sizes
+    rank = np.arange(len(rows)) - book.offsets[:-1][rows] - np.where(ask, bid_counts[rows], 0)
+    top = rank < levels
+    bid_volume = np.bincount(rows[top & ~ask], weights=sizes[top & ~ask], minlength=n)
+    ask_volume = np.bincount(rows[top & ask], weights=sizes[top & ask], minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        imbalance = (bid_volume - ask_volume) / (bid_volume + ask_volume)
+
+    # Quantity resting within k ticks of the touch, averaged over the window and for the latest book
+    distance = np.where(ask, book.ticks - best_ask[rows], best_bid[rows] - book.ticks)
+    near = (distance >= 0) & (distance <= depth_ticks)
+    latest = rows == n - 1
+    depth = {"distance": _rounded(np.arange(depth_ticks + 1) / PRICE_SCALE)}
+    for name, side in (("bid", ~ask), ("ask", ask)):
+        mask = near & side
+        average = np.bincount(distance[mask], weights=sizes[mask], minlength=depth_ticks + 1) / n
+        now = np.bincount(distance[mask & latest], weights=sizes[mask & latest], minlength=depth_ticks + 1)
+        depth[f"{name}_average"] = _rounded(np.cumsum(average), 2)
+        depth[f"{name}_latest"] = _rounded(np.cumsum(now), 2)
+
+    # Levels much larger than the typical one that stay on the book for much of the window
+    threshold = wall_multiple * float(np.median(sizes)) if len(sizes) else 0.0
+    large = sizes >= threshold
+    keys = (book.ticks[large] << 1) | ask[large]
+    walls = []
+    if len(keys):
+        unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        persistence = counts / n
+        mean_size = np.bincount(inverse, weights=sizes[large]) / counts
+        seen = book.timestamps[rows[large]]
+        first_seen = np.full(len(unique), np.inf)
+        last_seen = np.full(len(unique), -np.inf)
+        np.minimum.at(first_seen, inverse, seen)
+        np.maximum.at(last_seen, inverse, seen)
+        chosen = np.flatnonzero(persistence >= min_persistence)
+        chosen = chosen[np.argsort(-persistence[chosen], kind="stable")][:max_walls]
+        walls = [{
+            "price": round(int(unique[i] >> 1) / PRICE_SCALE, 4),
+            "side": "ASK" if unique[i] & 1 else "BID",
+            "persistence": round(float(persistence[i]), 4),
+            "mean_quantity": round(float(mean_size[i]), 2),
+            "first_seen": int(first_seen[i]),
+            "last_seen": int(last_seen[i]),
+        } for i in chosen]
+
+    series = downsample(book.timestamps, {"imbalance": imbalance, "spread": spread, "mid": mid}, points)
+    return {
+        "snapshots": n,
+        "start": int(book.timestamps[0]),
+        "end": int(book.timestamps[-1]),
+        "series": series,
+        "depth": depth,
+        "walls": walls,
+        "wall_threshold": round(threshold, 2),
+    }
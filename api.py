@@ -1,19 +1,83 @@
 # api.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
+from fastapi.responses import JSONResponse, StreamingResponse
 import sqlite3
 import os
 import json
 import traceback
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 import threading
 import time
 import multiprocessing
-from stream import main as stream_main
+import queue
+import asyncio
+import itertools
+import hashlib
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import dotenv
+# .env settings (READ_WORKERS, STREAM_SHARDS, ...) are read by the modules below at import
+dotenv.load_dotenv()
+from livebook import BookCache
+from push import DepthHub, Subscriber
+from reader import READ_WORKERS, ReadEngine
+from rollup import RESOLUTIONS
+from subscriptions import SubscriptionManager
+from wire import COLUMNAR_MEDIA_TYPE, ColumnChunk, encode_columnar, join_columnar, wants_columnar
+from histcache import CHUNK_MS, ChunkBuilder, HistoryCache, JsonChunk
+from manifest import DayManifest
+from logs import get_logger
+from metrics import Registry, merge as merge_metrics
+from shards import SHARD_QUEUE_SIZE, STREAM_SHARDS, shard_dirs, shard_of
+from tape import summarize_profile
+import storage
 
-app = FastAPI(title="Market Depth API")
+log = get_logger("api")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Requests are served straight away; the caches fill in the background
+    warming = asyncio.create_task(prewarm())
+    yield
+    warming.cancel()
+
+app = FastAPI(title="Market Depth API", lifespan=lifespan)
+
+# This process's metrics, served on /metrics with the stream's
+metrics = Registry()
+request_seconds = metrics.histogram("api_request_seconds", "Time to serve a request, body included",
+                                    ("method", "route", "status"))
+# Latest rendered metrics from each stream process (and shard worker), by source name
+stream_metrics = {}
+
+class RequestMetrics:
+    """ASGI middleware timing every HTTP request by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            request_seconds.observe(time.perf_counter() - started, scope["method"],
+                                    getattr(route, "path", "unmatched"), str(status))
 
 # Enable CORS
 app.add_middleware(
@@ -22,12 +86,82 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the frontend read the history ETag for conditional requests
+    expose_headers=["ETag"],
 )
+app.add_middleware(RequestMetrics)
+
+# Symbols being streamed, refcounted by the sockets viewing them and expired when idle
+subscriptions = SubscriptionManager()
+# Queue of ("subscribe" | "unsubscribe", [symbols]) commands read by the stream process
+stream_commands = None
+# Set by --read-only: existing day files are served and no symbol is asked for
+read_only = False
+
+# Live order books fed by the stream process; /depth answers from here when warm
+book_cache = BookCache()
+# Only trust the cache while a stream feed is attached, otherwise it could go stale
+book_feed_active = False
+# WebSocket clients receiving live depth pushes
+depth_hub = DepthHub()
+
+def consume_book_events(book_events):
+    """Apply live book events from the stream process to the in-memory cache."""
+    while True:
+        try:
+            event = book_events.get(timeout=1)
+        except queue.Empty:
+            continue
+        except (EOFError, OSError):
+            break
+        if event[0] == "metrics":
+            _, source, text = event
+            stream_metrics[source] = text
+            continue
+        try:
+            update = book_cache.apply_event(event)
+            if update is not None:
+                depth_hub.publish(update)
+        except Exception as e:
+            log.error("Error applying book event: %s", e)
 
-# Store current symbols being streamed
-active_symbols = set()
-# Create a lock for thread-safe operations on active_symbols
-symbols_lock = threading.Lock()
+def forward_subscriptions(added, removed):
+    """Send subscription changes to the stream process."""
+    if removed:
+        log.info("Dropping idle symbols from stream: %s", removed)
+    if stream_commands is None:
+        return
+    if added:
+        stream_commands.put_nowait(("subscribe", added))
+    if removed:
+        stream_commands.put_nowait(("unsubscribe", removed))
+
+def request_symbol(symbol, source, holder=None):
+    """Keep symbol streaming: held by holder until released, or refreshed by a polling request."""
+    if read_only:
+        return
+    if holder is None:
+        added, removed = subscriptions.touch(symbol)
+    else:
+        added, removed = subscriptions.acquire(symbol, holder)
+    if added:
+        log.info("Added symbol to stream from %s: %s", source, symbol)
+    forward_subscriptions(added, removed)
+
+def expire_subscriptions(interval=10):
+    """Unsubscribe symbols nobody has viewed within the TTL, checking every interval seconds."""
+    while True:
+        time.sleep(interval)
+        try:
+            forward_subscriptions(*subscriptions.expire())
+        except Exception as e:
+            log.error("Error expiring subscriptions: %s", e)
+
+def start_book_feed(book_events):
+    """Start draining book_events into book_cache on a background thread."""
+    global book_feed_active
+    threading.Thread(target=consume_book_events, args=(book_events,), name="book-feed", daemon=True).start()
+    book_feed_active = True
 
 class PriceLevel(BaseModel):
     price: float
@@ -45,268 +179,820 @@ class DepthResponse(BaseModel):
 class SymbolRequest(BaseModel):
     symbol: str
 
+class HistoryBatchRequest(BaseModel):
+    symbols: List[str]
+    since: Dict[str, int] = {}    # per-symbol cursor from a previous response
+    limit: Optional[int] = None
+    resolution: Optional[str] = None
+    agg: str = "max"
+
 # Define base and data directories
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, 'data'))
 os.makedirs(DATA_DIR, exist_ok=True)
+# Symbols one /depth_batch or /historical_batch request may ask for
+MAX_BATCH_SYMBOLS = int(os.getenv("MAX_BATCH_SYMBOLS", "100"))
 
-def get_db_connection():
-    """Get a connection to today's database or the most recent one."""
-    try:
-        data_dir = DATA_DIR
-        # Data directory already ensured at import
+# Per shard (just DATA_DIR unless STREAM_SHARDS > 1): the index of day files
+# (maintained by the stream) for queries spanning several days, and pooled
+# read-only connections. Every shard's queries run in one thread pool, off the event loop
+for path in shard_dirs(DATA_DIR):
+    os.makedirs(path, exist_ok=True)
+day_manifests = [DayManifest(path) for path in shard_dirs(DATA_DIR)]
+read_pool = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="db-read")
+read_engines = [ReadEngine(path, manifest=manifest, executor=read_pool)
+                for path, manifest in zip(shard_dirs(DATA_DIR), day_manifests)]
+# Encoded history chunks shared by every client of /historical_full
+history_cache = HistoryCache()
+# Most recently recorded symbols whose history is read into the cache at startup (0 = none)
+PREWARM_SYMBOLS = int(os.getenv("PREWARM_SYMBOLS", "10"))
 
-        today_date = datetime.now().strftime('%y%m%d')
-        #today_date = 250423  # For testing purposes, set a fixed date
-        db_filename = os.path.join(data_dir, f'options_data_{today_date}.db')
-        
-        # Check if today's DB exists
-        if os.path.exists(db_filename):
-            print(f"Using today's database: {db_filename}")
-            return sqlite3.connect(db_filename)
-        
-        # If not, find the most recent DB file
-        print(f"Today's database not found, searching for most recent in {data_dir}")
-        if not os.path.exists(data_dir):
-            raise FileNotFoundError(f"Data directory {data_dir} does not exist")
-            
-        db_files = [f for f in os.listdir(data_dir) if f.startswith('options_data_') and f.endswith('.db')]
-        if not db_files:
-            raise FileNotFoundError(f"No database files found in {data_dir}")
-        
-        # Sort by date (files are named options_data_YYMMDD.db)
-        db_files.sort(reverse=True)
-        db_filename = os.path.join(data_dir, db_files[0])
-        print(f"Using most recent database: {db_filename}")
-        return sqlite3.connect(db_filename)
-    except Exception as e:
-        print(f"Error connecting to database: {str(e)}")
-        print(traceback.format_exc())
-        raise
+def shard_engine(symbol):
+    """Read pool of the shard recording symbol."""
+    return read_engines[shard_of(symbol)]
+
+def by_shard(symbols):
+    """[(read pool, symbols)] for the shards the symbols are recorded in."""
+    groups = {}
+    for symbol in symbols:
+        groups.setdefault(shard_of(symbol), []).append(symbol)
+    return [(read_engines[shard], names) for shard, names in sorted(groups.items())]
+
+def day_file_bytes():
+    """{(file,): size with WAL} of the day files the API reads, for /metrics."""
+    sizes = {}
+    for engine in read_engines:
+        try:
+            path = engine.day_file()
+        except FileNotFoundError:
+            continue
+        size = sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+        sizes[(os.path.relpath(path, DATA_DIR),)] = size
+    return sizes or None
+
+metrics.gauge("sqlite_read_file_bytes", "Size of the day files the API reads, WAL included", ("file",),
+              collect=day_file_bytes)
+metrics.gauge("history_cache_bytes", "Encoded history held by the chunk cache",
+              collect=lambda: history_cache.get_stats()["bytes"])
+metrics.counter("history_cache_requests_total", "History cache lookups", ("result",),
+                collect=lambda: {("hit",): history_cache.stats["hits"], ("miss",): history_cache.stats["misses"]})
+metrics.gauge("active_symbols", "Symbols being streamed", collect=lambda: len(subscriptions.symbols()))
 
 @app.get("/")
 async def root():
     return {"message": "Market Depth API is running"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text format: this API's metrics and the stream processes'."""
+    body = merge_metrics([metrics.render(), *stream_metrics.values()])
+    return Response(body, media_type="text/plain; version=0.0.4")
+
 @app.get("/active_symbols")
 async def get_active_symbols():
     """Get the list of symbols currently being streamed."""
-    with symbols_lock:
-        return {"symbols": list(active_symbols)}
+    return {"symbols": subscriptions.symbols()}
+
+@app.get("/history_cache")
+async def get_history_cache_stats():
+    """Hit ratios and memory use of the /historical_full chunk cache."""
+    return history_cache.get_stats()
 
 @app.get("/symbols")
-async def get_symbols():
-    """Get all available symbols in the database."""
+async def get_symbols(start: Optional[int] = None, end: Optional[int] = None):
+    """Get all available symbols in the database.
+
+    With start and/or end (ms), symbols recorded in that range across every
+    day file are listed from the manifest.
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT DISTINCT symbol FROM options_book_data")
-        symbols = [row[0] for row in cursor.fetchall()]
-        
-        conn.close()
-        print(f"Found {len(symbols)} symbols in the database")
+        if (start is not None or end is not None) and all(manifest.load() for manifest in day_manifests):
+            found = [manifest.symbols(start, end) for manifest in day_manifests]
+        else:
+            found = await asyncio.gather(*(engine.run(storage.list_symbols) for engine in read_engines))
+        symbols = sorted(set().union(*found)) if len(found) > 1 else found[0]
+        log.debug("Found %d symbols in the database", len(symbols))
         return {"symbols": symbols}
     except Exception as e:
         error_details = f"Database error: {str(e)}\n{traceback.format_exc()}"
-        print(error_details)
+        log.error(error_details)
         raise HTTPException(status_code=500, detail=error_details)
 
+def depth_result(symbol, latest, level_one):
+    """A depth response from a stored (timestamp, levels) book and level-one row, either of them None."""
+    if latest is None:
+        # If no data found, we're streaming it now, but return empty result
+        return {
+            "symbol": symbol,
+            "timestamp": int(time.time() * 1000),
+            "levels": [],
+            "last_price": None,
+            "last_size": None,
+            "underlying_price": None
+        }
+    
+    latest_timestamp, levels = latest
+    result = {
+        "symbol": symbol,
+        "timestamp": latest_timestamp,
+        "levels": levels,
+        "last_price": level_one[1] if level_one else None,
+        "last_size": level_one[2] if level_one else None,
+        "underlying_price": level_one[3] if level_one else None
+    }
+
+    # Warm the cache so later reads skip SQLite until the stream takes over
+    if book_feed_active:
+        book_cache.load(result)
+
+    return result
+
+def read_depth_snapshot(conn, symbol):
+    """Build the latest depth snapshot for symbol from SQLite (the cold path)."""
+    # Get the latest stored book for the symbol
+    latest = storage.latest_book(conn, symbol)
+    # Get the latest level one data
+    level_one = storage.latest_level_one(conn, symbol) if latest is not None else None
+    return depth_result(symbol, latest, level_one)
+
+def read_depth_snapshots(conn, symbols):
+    """Latest depth snapshots of several symbols from SQLite, one query per table for all of them."""
+    books = storage.latest_books(conn, symbols)
+    level_ones = storage.latest_level_ones(conn, symbols) if books else {}
+    return {symbol: depth_result(symbol, books.get(symbol), level_ones.get(symbol)) for symbol in symbols}
+
+async def get_depth_snapshot(symbol):
+    """Latest depth for symbol: the live book when warm, SQLite (in the read pool) otherwise."""
+    if book_feed_active:
+        cached = book_cache.get(symbol)
+        if cached is not None:
+            return cached
+    return await shard_engine(symbol).run(read_depth_snapshot, symbol)
+
+async def get_depth_snapshots(symbols):
+    """Latest depth of several symbols: live books where warm, the rest in one read-pool task."""
+    found = {}
+    if book_feed_active:
+        for symbol in symbols:
+            cached = book_cache.get(symbol)
+            if cached is not None:
+                found[symbol] = cached
+    missing = [symbol for symbol in symbols if symbol not in found]
+    if missing:
+        for books in await asyncio.gather(*(engine.run(read_depth_snapshots, names) for engine, names in by_shard(missing))):
+            found.update(books)
+    return {symbol: found[symbol] for symbol in symbols}
+
+def batch_symbols(symbols):
+    """Normalized, de-duplicated symbols of a batch request."""
+    names = list(dict.fromkeys(s.replace("%20", " ").strip() for s in symbols if s.strip()))
+    if not names or len(names) > MAX_BATCH_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"Give 1 to {MAX_BATCH_SYMBOLS} symbols")
+    return names
+
 @app.get("/depth/{symbol}", response_model=DepthResponse)
-async def get_depth(symbol: str, limit: int = 10):
-    """Get market depth data for a specific symbol."""
+async def get_depth(request: Request, symbol: str, limit: int = 10):
+    """Get market depth data for a specific symbol.
+
+    Sent in the binary columnar format (see wire.py) when Accept asks for it.
+    """
     try:
         # Normalize symbol (replace %20 with space)
         symbol = symbol.replace("%20", " ").strip()
         
         # Add symbol to active streams
-        with symbols_lock:
-            if symbol not in active_symbols:
-                active_symbols.add(symbol)
-                print(f"Added symbol to stream from depth request: {symbol}")
-                
-        conn = get_db_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Get the latest timestamp for the symbol
-        cursor.execute(
-            "SELECT MAX(timestamp) as latest_ts FROM options_book_data WHERE symbol = ?", 
-            (symbol,)
-        )
-        result = cursor.fetchone()
-        
-        if not result or not result['latest_ts']:
-            # If no data found, we're streaming it now, but return empty result
-            conn.close()
-            return {
-                "symbol": symbol,
-                "timestamp": int(time.time() * 1000),
-                "levels": [],
-                "last_price": None,
-                "last_size": None,
-                "underlying_price": None
-            }
-        
-        latest_timestamp = result['latest_ts']
-        
-        # Get the price levels for the latest timestamp
-        cursor.execute(
-            """
-            SELECT price, quantity, side 
-            FROM options_book_data 
-            WHERE symbol = ? AND timestamp = ?
-            ORDER BY 
-                CASE WHEN side = 'ASK' THEN price ELSE -price END
-            """, 
-            (symbol, latest_timestamp)
-        )
-        
-        levels = [
-            {"price": row['price'], "quantity": row['quantity'], "side": row['side']} 
-            for row in cursor.fetchall()
-        ]
-        
-        # Get the latest level one data
-        cursor.execute(
-            """
-            SELECT last_price, last_size, underlying_price, timestamp
-            FROM level_one_data
-            WHERE symbol = ?
-            ORDER BY timestamp DESC
-            LIMIT 1
-            """,
-            (symbol,)
-        )
-        level_one = cursor.fetchone()
-        
-        conn.close()
-        
-        return {
-            "symbol": symbol,
-            "timestamp": latest_timestamp,
-            "levels": levels,
-            "last_price": level_one['last_price'] if level_one else None,
-            "last_size": level_one['last_size'] if level_one else None,
-            "underlying_price": level_one['underlying_price'] if level_one else None
-        }
+        request_symbol(symbol, "depth request")
+
+        snapshot = await get_depth_snapshot(symbol)
+        if wants_columnar(request.headers.get("accept")):
+            return Response(encode_columnar(symbol, [snapshot]), media_type=COLUMNAR_MEDIA_TYPE,
+                            headers={"Vary": "Accept"})
+        return snapshot
+    except sqlite3.Error as e:
+        error_details = f"Database error: {str(e)}\n{traceback.format_exc()}"
+        log.error(error_details)
+        raise HTTPException(status_code=500, detail=error_details)
+
+@app.get("/depth_batch")
+async def get_depth_batch(symbols: str):
+    """Latest market depth for several comma-separated symbols in one response.
+
+    {"books": {symbol: depth}}, each depth as /depth returns it. Symbols the
+    live book doesn't cover are read from SQLite together, one query per table.
+    """
+    try:
+        names = batch_symbols(symbols.split(","))
+        for symbol in names:
+            request_symbol(symbol, "depth batch request")
+        return {"books": await get_depth_snapshots(names)}
     except sqlite3.Error as e:
         error_details = f"Database error: {str(e)}\n{traceback.format_exc()}"
-        print(error_details)
+        log.error(error_details)
         raise HTTPException(status_code=500, detail=error_details)
 
+@app.websocket("/ws/depth")
+async def depth_socket(websocket: WebSocket):
+    """Push live depth: a snapshot per subscribed symbol, then changed levels only.
+
+    Client messages: {"action": "subscribe" | "unsubscribe", "symbols": [...]}
+    Server messages: {"type": "snapshot", ...depth} and
+                     {"type": "delta", "symbol", "timestamp", "levels", "seq", [level-one fields]}
+    A delta level with quantity 0 means the price level was removed.
+    Everything is sent from one task, through the subscriber's queue, so a
+    snapshot is never followed by a delta it already holds.
+    """
+    await websocket.accept()
+    subscriber = Subscriber(asyncio.get_running_loop())
+    depth_hub.add(subscriber)
+
+    async def send_snapshot(symbol):
+        # The live book's seq tells which queued deltas the snapshot already holds
+        versioned = book_cache.versioned(symbol) if book_feed_active else None
+        try:
+            snapshot, seq = versioned or (await get_depth_snapshot(symbol), None)
+        except sqlite3.Error as e:
+            await websocket.send_json({"type": "error", "symbol": symbol, "detail": str(e)})
+            return
+        subscriber.snapshot_sent(symbol, seq)
+        await websocket.send_json({"type": "snapshot", **snapshot})
+
+    async def receive_commands():
+        while True:
+            command = await websocket.receive_json()
+            action = command.get("action")
+            symbols = [s.replace("%20", " ").strip() for s in command.get("symbols", [])]
+            if action == "subscribe":
+                for symbol in symbols:
+                    request_symbol(symbol, "websocket", holder=subscriber)
+                    # Register before snapshotting so no update falls in between
+                    subscriber.symbols.add(symbol)
+                    subscriber.request_snapshot(symbol)
+            elif action == "unsubscribe":
+                for symbol in symbols:
+                    subscriptions.release(symbol, subscriber)
+                subscriber.symbols.difference_update(symbols)
+
+    async def send_updates():
+        while True:
+            message = await subscriber.queue.get()
+            stale = subscriber.take_resync()
+            for symbol in stale:
+                if symbol in subscriber.symbols:
+                    await send_snapshot(symbol)
+            if message.get("symbol") not in stale and subscriber.wanted(message):
+                await websocket.send_json(message)
+
+    receiver = asyncio.create_task(receive_commands())
+    sender = asyncio.create_task(send_updates())
+    try:
+        await asyncio.wait({receiver, sender}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        receiver.cancel()
+        sender.cancel()
+        depth_hub.remove(subscriber)
+        # The symbols stay streamed until they idle out, so a quick reconnect is seamless
+        for symbol in subscriber.symbols:
+            subscriptions.release(symbol, subscriber)
+
+def sample_snapshots(snapshots, step):
+    """Keep every step-th snapshot plus the latest one."""
+    latest = None
+    for index, snapshot in enumerate(snapshots):
+        if latest is not None and (index - 1) % step == 0:
+            yield latest
+        latest = snapshot
+
+    # The final snapshot is the latest one, which is always included
+    if latest is not None:
+        yield latest
+
+def iter_history_snapshots(conn, symbol, limit=None, resolution=None, agg="max", since=None):
+    """Yield history snapshots for symbol from one ordered scan of each table.
+
+    Books come from storage.iter_book_snapshots, and level-one data is
+    attached with a merge-style as-of join (latest row at or before each snapshot).
+    With resolution (seconds), one snapshot per rollup bucket is served instead.
+    With since (ms), only newer snapshots are returned.
+    With limit, every k-th snapshot is kept plus the latest, as before.
+    """
+    if resolution:
+        snapshots = storage.iter_rollup_snapshots(conn, symbol, resolution, agg, since)
+        if limit:
+            # Rollups are already small, so count them by materializing
+            snapshots = list(snapshots)
+            step = len(snapshots) // limit if len(snapshots) > limit else 1
+            yield from sample_snapshots(snapshots, step)
+        else:
+            yield from snapshots
+        return
+
+    step = 1
+    if limit:
+        total = storage.count_snapshots(conn, symbol, since)
+        if total > limit:
+            step = total // limit
+
+    level_one_rows = storage.iter_level_one(conn, symbol, since)
+    next_level_one = next(level_one_rows, None)
+    current_level_one = None
+
+    def build(ts, levels):
+        nonlocal next_level_one, current_level_one
+        # Advance the level-one cursor up to this snapshot's timestamp
+        while next_level_one is not None and next_level_one[0] <= ts:
+            current_level_one = next_level_one
+            next_level_one = next(level_one_rows, None)
+        return {
+            "timestamp": ts,
+            "levels": levels,
+            "last_price": current_level_one[1] if current_level_one else None,
+            "last_size": current_level_one[2] if current_level_one else None,
+            "underlying_price": current_level_one[3] if current_level_one else None
+        }
+
+    for ts, levels in sample_snapshots(storage.iter_book_snapshots(conn, symbol, since), step):
+        yield build(ts, levels)
+
+class HistoryRead:
+    """What open_history found: cached chunks to send, then snapshots still to read from conn."""
+
+    def __init__(self, headers, conn=None, cached=(), snapshots=None, builder=None, cache_key=None, resume=None,
+                 engine=None):
+        self.headers = headers
+        self.conn = conn
+        self.engine = engine          # the read pool conn came from
+        self.cached = cached          # chunk tails newer than since, oldest first
+        self.snapshots = snapshots    # iterator over conn, or None
+        self.builder = builder        # collects what is read into chunks to seal
+        self.cache_key = cache_key    # set when the read continues exactly where the cache ends
+        self.resume = resume
+        self.empty = False            # nothing at all to send
+
+    def finish(self, complete):
+        """Seal fully read chunks into the cache and release the connection."""
+        builder, self.builder = self.builder, None
+        if complete and builder is not None:
+            queried = sum(len(chunk) for _, chunk in builder.chunks)
+            history_cache.count(sum(len(chunk) for chunk in self.cached), queried)
+            if self.cache_key is not None:
+                history_cache.seal(self.cache_key, builder.sealable(), self.resume)
+        if self.conn is not None:
+            # A client that disconnected mid-body leaves a statement open; don't pool that connection
+            self.engine.release(self.conn, reuse=complete)
+            self.conn = None
+
+def stream_history_json(symbol, history, cursor=None, chunk_size=200):
+    """Encode {"symbol", "snapshots": [...], "cursor"} incrementally, releasing the connection when done.
+
+    Cached chunks are sent as stored; newly read snapshots are encoded as they go.
+    cursor is the newest snapshot timestamp, to be passed back as since= for the next fetch.
+    """
+    complete = False
+    try:
+        yield '{"symbol":' + json.dumps(symbol, ensure_ascii=False) + ',"snapshots":['
+        first = True
+        for chunk in history.cached:
+            yield ("" if first else ",") + ",".join(chunk.parts)
+            first = False
+            cursor = chunk.timestamps[-1]
+        pending = []
+        for snapshot in history.snapshots or ():
+            cursor = snapshot["timestamp"]
+            pending.append(history.builder.append(snapshot))
+            if len(pending) >= chunk_size:
+                yield ("" if first else ",") + ",".join(pending)
+                first = False
+                pending = []
+        if pending:
+            yield ("" if first else ",") + ",".join(pending)
+        yield '],"cursor":' + json.dumps(cursor) + '}'
+        complete = True
+    finally:
+        history.finish(complete)
+
+def collect_history_chunks(history):
+    """Runs in the read pool. Cached chunks plus chunks built from what is left to read, oldest first."""
+    complete = False
+    try:
+        fresh = []
+        if history.builder is not None:
+            for snapshot in history.snapshots or ():
+                history.builder.append(snapshot)
+            fresh = [chunk for _, chunk in history.builder.chunks]
+        complete = True
+        return list(history.cached) + fresh
+    finally:
+        history.finish(complete)
+
+def encode_history_columnar(symbol, history, cursor):
+    """Runs in the read pool. Build one columnar body from cached and newly read chunks."""
+    return join_columnar(symbol, collect_history_chunks(history), cursor)
+
+def history_cache_key(conn, version, symbol, resolution, agg, columnar):
+    """Cache key for a symbol's history; a day file replaced in place (compact.py) gets a new key."""
+    path = version[0]
+    try:
+        inode = os.stat(path).st_ino
+    except OSError:
+        inode = None
+    return (path, inode, version[1], symbol, resolution, agg if resolution else None, columnar)
+
+def open_history(symbol, limit, resolution, agg, since, if_none_match, columnar=False):
+    """Runs in the read pool. Returns a HistoryRead; its snapshots is None for a 304.
+
+    Unsampled requests reuse sealed chunks from history_cache and only read
+    what follows them. With limit the whole history is read and sampled.
+    """
+    engine = shard_engine(symbol)
+    conn = engine.acquire()
+    try:
+        # since is left out: a client holding this version has every snapshot up to its cursor
+        version = storage.history_version(conn, symbol, resolution)
+        etag = '"' + hashlib.sha1(repr((version, limit, resolution, agg, columnar)).encode()).hexdigest()[:20] + '"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+        if etag in if_none_match:
+            engine.release(conn)
+            return HistoryRead(headers)
+
+        make_chunk = ColumnChunk if columnar else JsonChunk
+        if limit:
+            builder = ChunkBuilder(make_chunk, CHUNK_MS)
+            snapshots = iter_history_snapshots(conn, symbol, limit, resolution, agg, since)
+            history = HistoryRead(headers, conn, (), snapshots, builder, engine=engine)
+        else:
+            key = history_cache_key(conn, version, symbol, resolution, agg, columnar)
+            sealed = history_cache.get(key)
+            resume = sealed[-1][1].timestamps[-1] if sealed else None
+            cached = []
+            for _, chunk in sealed:
+                if since is None or chunk.timestamps[-1] > since:
+                    cached.append(chunk if since is None else chunk.tail(bisect.bisect_right(chunk.timestamps, since)))
+            # Read on from where the cache ends, unless the client is already past it
+            if since is not None and (resume is None or since > resume):
+                read_from, key = since, None
+            else:
+                read_from = resume
+            snapshots = iter_history_snapshots(conn, symbol, None, resolution, agg, read_from)
+            builder = ChunkBuilder(make_chunk, CHUNK_MS * (resolution or 1))
+            history = HistoryRead(headers, conn, cached, snapshots, builder, key, resume, engine)
+
+        # Run the queries now so database errors still surface as a 500
+        first = next(history.snapshots, None)
+    except BaseException:
+        engine.release(conn, reuse=False)
+        raise
+
+    if first is None:
+        history.snapshots = iter(())
+        history.empty = not history.cached
+        history.finish(True)
+    else:
+        history.snapshots = itertools.chain([first], history.snapshots)
+    return history
+
+def read_day_history(path, symbol, resolution, agg, since, end):
+    """Runs in the read pool. (version, snapshots) of one day file, newer than since and up to end."""
+    engine = shard_engine(symbol)
+    conn = engine.acquire(path)
+    complete = False
+    try:
+        version = storage.history_version(conn, symbol, resolution)
+        snapshots = []
+        for snapshot in iter_history_snapshots(conn, symbol, None, resolution, agg, since):
+            if end is not None and snapshot["timestamp"] > end:
+                break
+            snapshots.append(snapshot)
+        else:
+            complete = True
+        return version, snapshots
+    finally:
+        engine.release(conn, reuse=complete)
+
+async def open_history_range(symbol, limit, resolution, agg, since, start, end, if_none_match, columnar=False):
+    """Like open_history for the [start, end] ms range, which may span several day files.
+
+    The manifest picks the files holding symbol in the range; each is read on
+    its own connection in the read pool, concurrently, and the parts joined
+    oldest first. Without a manifest only the current day file is read.
+    """
+    engine, manifest = shard_engine(symbol), day_manifests[shard_of(symbol)]
+    if manifest.load():
+        paths = manifest.files_for(symbol, start, end)
+    else:
+        paths = [engine.day_file()]
+    # since is exclusive, start inclusive
+    if start is not None and (since is None or since < start - 1):
+        since = start - 1
+    parts = await asyncio.gather(*(
+        engine.call(read_day_history, path, symbol, resolution, agg, since, end) for path in paths
+    ))
+
+    versions = [version for version, _ in parts]
+    etag = '"' + hashlib.sha1(repr((versions, limit, resolution, agg, columnar, start, end)).encode()).hexdigest()[:20] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if etag in if_none_match:
+        return HistoryRead(headers)
+
+    snapshots = [snapshot for _, part in parts for snapshot in part]
+    if limit and len(snapshots) > limit:
+        snapshots = list(sample_snapshots(snapshots, len(snapshots) // limit))
+    history = HistoryRead(headers, None, (), iter(snapshots), ChunkBuilder(ColumnChunk if columnar else JsonChunk, CHUNK_MS))
+    history.empty = not snapshots
+    return history
+
 @app.get("/historical_full/{symbol}")
-async def get_historical_full(symbol: str, limit: Optional[int] = None):
-    """Get ALL historical market depth snapshots for a specific symbol without sampling."""
+async def get_historical_full(request: Request, symbol: str, limit: Optional[int] = None,
+                              resolution: Optional[str] = None, agg: str = "max",
+                              since: Optional[int] = None, start: Optional[int] = None,
+                              end: Optional[int] = None):
+    """Get ALL historical market depth snapshots for a specific symbol without sampling.
+
+    resolution=1s|5s|1m|5m serves one snapshot per time bucket from the rollup
+    tables, with level quantities aggregated by agg=max|avg|last.
+    since=<ms> returns only snapshots newer than a previous response's cursor.
+    The ETag changes only when the symbol's stored history does, so
+    If-None-Match gets a 304 while nothing new was written.
+    With Accept: application/vnd.depth.columnar the body is the binary
+    columnar format from wire.py instead of JSON.
+    start and end (ms) select a time range, read from every day file it spans.
+    """
+    if resolution is not None and resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(RESOLUTIONS)}")
+    if agg not in ("max", "avg", "last"):
+        raise HTTPException(status_code=400, detail="agg must be one of max, avg, last")
+
     try:
         # Normalize symbol (replace %20 with space)
         symbol = symbol.replace("%20", " ").strip()
         
         # Add symbol to active streams
-        with symbols_lock:
-            if symbol not in active_symbols:
-                active_symbols.add(symbol)
-                print(f"Added symbol to stream from historical_full request: {symbol}")
-                
-        conn = get_db_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Get all snapshot timestamps for this symbol
-        cursor.execute(
-            """
-            SELECT DISTINCT timestamp 
-            FROM options_book_data 
-            WHERE symbol = ?
-            ORDER BY timestamp
-            """,
-            (symbol,)
-        )
-        
-        all_timestamps = [row['timestamp'] for row in cursor.fetchall()]
-        
-        if not all_timestamps:
-            # Return empty result if no data found
-            return {"symbol": symbol, "snapshots": []}
-        
-        # Apply limit if specified
-        if limit and len(all_timestamps) > limit:
-            # Take evenly distributed samples if we need to limit
-            step = len(all_timestamps) // limit
-            sampled_timestamps = all_timestamps[::step]
-            # Always include the latest timestamp
-            if all_timestamps[-1] not in sampled_timestamps:
-                sampled_timestamps.append(all_timestamps[-1])
+        request_symbol(symbol, "historical_full request")
+
+        columnar = wants_columnar(request.headers.get("accept"))
+        seconds = RESOLUTIONS[resolution] if resolution else None
+        if_none_match = request.headers.get("if-none-match", "")
+        if start is not None or end is not None:
+            history = await open_history_range(symbol, limit, seconds, agg, since, start, end, if_none_match, columnar)
         else:
-            sampled_timestamps = all_timestamps
-            
-        print(f"Found {len(all_timestamps)} timestamps for {symbol}, using {len(sampled_timestamps)} samples")
-        
-        # Fetch data for each timestamp
-        result = []
-        for ts in sampled_timestamps:
-            cursor.execute(
-                """
-                SELECT price, quantity, side 
-                FROM options_book_data 
-                WHERE symbol = ? AND timestamp = ?
-                """,
-                (symbol, ts)
-            )
-            
-            levels = [
-                {"price": row['price'], "quantity": row['quantity'], "side": row['side']} 
-                for row in cursor.fetchall()
-            ]
-            
-            if not levels:
-                # Skip timestamps with no levels data
-                continue
-            
-            # Get the nearest level one data
-            cursor.execute(
-                """
-                SELECT last_price, last_size, underlying_price
-                FROM level_one_data
-                WHERE symbol = ? AND timestamp <= ?
-                ORDER BY timestamp DESC
-                LIMIT 1
-                """,
-                (symbol, ts)
-            )
-            level_one = cursor.fetchone()
-            
-            snapshot = {
-                "timestamp": ts,
-                "levels": levels,
-                "last_price": level_one['last_price'] if level_one else None,
-                "last_size": level_one['last_size'] if level_one else None,
-                "underlying_price": level_one['underlying_price'] if level_one else None
-            }
-            
-            result.append(snapshot)
-        
-        conn.close()
-        return {"symbol": symbol, "snapshots": result}
+            history = await shard_engine(symbol).call(open_history, symbol, limit, seconds, agg, since, if_none_match, columnar)
+        if history.snapshots is None:
+            return Response(status_code=304, headers=history.headers)
+        if columnar:
+            # Column lengths go in the header, so the body is built whole, off the event loop
+            body = await shard_engine(symbol).call(encode_history_columnar, symbol, history, since)
+            return Response(body, media_type=COLUMNAR_MEDIA_TYPE, headers=history.headers)
+        if history.empty:
+            return JSONResponse({"symbol": symbol, "snapshots": [], "cursor": since}, headers=history.headers)
+
+        # Starlette iterates the body in its own worker threads; pooled connections allow that
+        body = stream_history_json(symbol, history, since)
+        return StreamingResponse(body, media_type="application/json", headers=history.headers)
     
     except sqlite3.Error as e:
         error_details = f"Database error: {str(e)}\n{traceback.format_exc()}"
-        print(error_details)
+        log.error(error_details)
+        raise HTTPException(status_code=500, detail=error_details)
+
+def read_history_batch(symbols, since, limit, resolution, agg, columnar=False):
+    """Runs in the read pool. {symbol: history} of one shard's symbols, as /historical_full sends it.
+
+    Symbols are read one after another on the pool's connections, so a batch
+    holds one connection at a time; cached chunks are copied in as stored.
+    """
+    parts = {}
+    for symbol in symbols:
+        cursor = since.get(symbol)
+        history = open_history(symbol, limit, resolution, agg, cursor, "", columnar)
+        if columnar:
+            parts[symbol] = encode_history_columnar(symbol, history, cursor)
+        else:
+            parts[symbol] = "".join(stream_history_json(symbol, history, cursor))
+    return parts
+
+@app.post("/historical_batch")
+async def get_historical_batch(request: HistoryBatchRequest, http_request: Request):
+    """Historical snapshots of several symbols in one response: {"histories": {symbol: history}}.
+
+    Each history is what /historical_full returns for the symbol, with
+    since[symbol] as its cursor and the same limit, resolution and agg.
+    With Accept: application/vnd.depth.columnar the body is instead each
+    symbol's columnar body, back to back in request order.
+    """
+    if request.resolution is not None and request.resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(RESOLUTIONS)}")
+    if request.agg not in ("max", "avg", "last"):
+        raise HTTPException(status_code=400, detail="agg must be one of max, avg, last")
+
+    try:
+        names = batch_symbols(request.symbols)
+        since = {symbol.replace("%20", " ").strip(): cursor for symbol, cursor in request.since.items()}
+        for symbol in names:
+            request_symbol(symbol, "historical batch request")
+        seconds = RESOLUTIONS[request.resolution] if request.resolution else None
+        columnar = wants_columnar(http_request.headers.get("accept"))
+        parts = {}
+        for found in await asyncio.gather(*(
+            engine.call(read_history_batch, symbols, since, request.limit, seconds, request.agg, columnar)
+            for engine, symbols in by_shard(names)
+        )):
+            parts.update(found)
+        if columnar:
+            # Every body is padded to 8 bytes, so each one's header starts aligned
+            return Response(b"".join(parts[symbol] for symbol in names), media_type=COLUMNAR_MEDIA_TYPE,
+                            headers={"Vary": "Accept"})
+        body = ",".join(json.dumps(symbol, ensure_ascii=False) + ":" + parts[symbol] for symbol in names)
+        return Response('{"histories":{' + body + '}}', media_type="application/json")
+    except sqlite3.Error as e:
+        error_details = f"Database error: {str(e)}\n{traceback.format_exc()}"
+        log.error(error_details)
+        raise HTTPException(status_code=500, detail=error_details)
+
+def compute_analytics(symbol, start, end, params):
+    """Runs in the read pool. analytics.summarize over the symbol's full-resolution history in [start, end]."""
+    # NumPy is loaded on the first /analytics request rather than at startup
+    import analytics
+    history = open_history(symbol, None, None, "max", None, "", columnar=True)
+    book = analytics.BookColumns.from_chunks(collect_history_chunks(history), start, end)
+    return analytics.summarize(book, **params)
+
+@app.get("/analytics/{symbol}")
+async def get_analytics(symbol: str, start: Optional[int] = None, end: Optional[int] = None,
+                        levels: int = 5, points: int = 500, depth_ticks: int = 20,
+                        wall_multiple: float = 5.0, min_persistence: float = 0.5):
+    """Order-book analytics for a symbol over [start, end] ms (the whole day file by default).
+
+    series: top-`levels` imbalance, spread and mid, averaged into at most
+    `points` time buckets. depth: cumulative bid/ask quantity within each
+    tick distance of the touch, up to depth_ticks, averaged and latest.
+    walls: levels at least wall_multiple times the median level size that are
+    on the book in at least min_persistence of the snapshots.
+    """
+    if levels < 1 or not 1 <= points <= 10000 or not 0 <= depth_ticks <= 10000:
+        raise HTTPException(status_code=400, detail="levels >= 1, points 1-10000 and depth_ticks 0-10000")
+    if wall_multiple <= 0 or not 0 <= min_persistence <= 1:
+        raise HTTPException(status_code=400, detail="wall_multiple > 0 and min_persistence 0-1")
+
+    try:
+        symbol = symbol.replace("%20", " ").strip()
+        request_symbol(symbol, "analytics request")
+        params = {"levels": levels, "points": points, "depth_ticks": depth_ticks,
+                  "wall_multiple": wall_multiple, "min_persistence": min_persistence}
+        result = await shard_engine(symbol).call(compute_analytics, symbol, start, end, params)
+        return {"symbol": symbol, **result}
+    except sqlite3.Error as e:
+        error_details = f"Database error: {str(e)}\n{traceback.format_exc()}"
+        log.error(error_details)
+        raise HTTPException(status_code=500, detail=error_details)
+
+def read_volume_profile(conn, symbol, start, end):
+    """Volume at price, VWAP and point of control of symbol's prints in [start, end] ms."""
+    return {"symbol": symbol, "start": start, "end": end,
+            **summarize_profile(storage.volume_profile(conn, symbol, start, end))}
+
+@app.get("/volume_profile/{symbol}")
+async def get_volume_profile(symbol: str, start: Optional[int] = None, end: Optional[int] = None):
+    """Traded volume per price for a symbol over [start, end] ms (the whole day file by default).
+
+    levels: per price the volume, the part traded at the bid and at the ask,
+    and the number of prints. Also the window's volume, trades, vwap and poc
+    (the price with the most volume). The stream keeps these per minute as
+    prints arrive, so a window costs the same however busy it was.
+    """
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+
+    try:
+        symbol = symbol.replace("%20", " ").strip()
+        request_symbol(symbol, "volume profile request")
+        return await shard_engine(symbol).run(read_volume_profile, symbol, start, end)
+    except sqlite3.Error as e:
+        error_details = f"Database error: {str(e)}\n{traceback.format_exc()}"
+        log.error(error_details)
         raise HTTPException(status_code=500, detail=error_details)
 
+def read_tape(conn, symbol, start, end, limit, since):
+    """Newest-first prints of symbol in [start, end] ms as a /tape response."""
+    trades = storage.recent_trades(conn, symbol, start, end, limit)
+    return {
+        "symbol": symbol,
+        "trades": [{"timestamp": ts, "price": price, "size": size, "side": side} for ts, price, size, side in trades],
+        "cursor": trades[0][0] if trades else since,
+    }
+
+@app.get("/tape/{symbol}")
+async def get_tape(symbol: str, start: Optional[int] = None, end: Optional[int] = None,
+                   since: Optional[int] = None, limit: int = 500):
+    """Time and sales: a symbol's prints within [start, end] ms, newest first, at most limit of them.
+
+    side is the book side a print traded against: ASK at or above the offer
+    (a buyer), BID at or below the bid (a seller), null inside the spread.
+    since=<ms> returns only prints newer than a previous response's cursor.
+    """
+    if not 1 <= limit <= 10000:
+        raise HTTPException(status_code=400, detail="limit must be 1-10000")
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if since is not None and (start is None or start <= since):
+        start = since + 1
+
+    try:
+        symbol = symbol.replace("%20", " ").strip()
+        request_symbol(symbol, "tape request")
+        return await shard_engine(symbol).run(read_tape, symbol, start, end, limit, since)
+    except sqlite3.Error as e:
+        error_details = f"Database error: {str(e)}\n{traceback.format_exc()}"
+        log.error(error_details)
+        raise HTTPException(status_code=500, detail=error_details)
+
+def prewarm_history(symbols):
+    """Runs in the read pool. Seal the symbols' columnar history into history_cache until it is full."""
+    warmed = []
+    for symbol in symbols:
+        if history_cache.get_stats()["bytes"] >= history_cache.max_bytes:
+            break
+        collect_history_chunks(open_history(symbol, None, None, "max", None, "", columnar=True))
+        warmed.append(symbol)
+    return warmed
+
+async def prewarm():
+    """Read the history of the PREWARM_SYMBOLS most recently recorded symbols into history_cache.
+
+    Their full columnar history (what the dashboard asks for first) is sealed into
+    chunks, which opens the pooled connections and pages in the day file on
+    the way. Later requests only read what follows the cached chunks.
+    """
+    if PREWARM_SYMBOLS <= 0 or history_cache.max_bytes <= 0:
+        return
+    started = time.perf_counter()
+    try:
+        ranges = {}
+        for found in await asyncio.gather(*(engine.run(storage.symbol_time_ranges) for engine in read_engines)):
+            ranges.update(found)
+        recent = sorted(ranges, key=lambda symbol: ranges[symbol][1], reverse=True)[:PREWARM_SYMBOLS]
+        warmed = await asyncio.gather(*(engine.call(prewarm_history, names) for engine, names in by_shard(recent)))
+    except (FileNotFoundError, sqlite3.Error) as e:
+        log.info("Nothing pre-warmed: %s", e)
+        return
+    warmed = [symbol for names in warmed for symbol in names]
+    log.info("Pre-warmed the history of %d symbols in %.2fs (%s)", len(warmed), time.perf_counter() - started,
+             ", ".join(warmed))
+
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    
-    # Start the stream process
-    stream_process = multiprocessing.Process(target=stream_main)
-    stream_process.start()
-    print("Stream process started")
+
+    parser = argparse.ArgumentParser(description="Serve the market depth API, recording with the stream process")
+    parser.add_argument("--read-only", action="store_true",
+                        help="serve the existing day files in DATA_DIR without starting the stream")
+    args = parser.parse_args()
+    read_only = args.read_only
+
+    stream_process, shard_queues, shard_processes = None, None, []
+    if read_only:
+        log.info("Read-only: serving %s without a stream", DATA_DIR)
+    else:
+        # Imported here, so the API on its own never creates the Schwab client or opens a day file to write
+        from stream import main as stream_main, record_shard
+
+        # Start the stream process: subscription commands go to it, live book updates come back
+        book_events = multiprocessing.Queue(maxsize=10000)
+        stream_commands = multiprocessing.Queue()
+        # With shards, the stream process routes updates to one recording worker per shard
+        if STREAM_SHARDS > 1:
+            shard_queues = [multiprocessing.Queue(maxsize=SHARD_QUEUE_SIZE) for _ in range(STREAM_SHARDS)]
+            shard_processes = [
+                multiprocessing.Process(target=record_shard, args=(shard, STREAM_SHARDS, messages, book_events),
+                                        name=f"stream-shard-{shard}")
+                for shard, messages in enumerate(shard_queues)
+            ]
+            for process in shard_processes:
+                process.start()
+            log.info("Started %d shard workers", STREAM_SHARDS)
+        stream_process = multiprocessing.Process(target=stream_main, args=(book_events, stream_commands, shard_queues))
+        stream_process.start()
+        start_book_feed(book_events)
+        threading.Thread(target=expire_subscriptions, name="subscription-expiry", daemon=True).start()
+        log.info("Stream process started")
     
     try:
         # Start the API server
         uvicorn.run(app, host="0.0.0.0", port=8080)
     finally:
-        # Ensure we clean up the stream process
-        stream_process.terminate()
-        stream_process.join()
-        print("Stream process stopped")
+        # Ask the stream to stop so its writer, rollups and manifest entry are written out
+        if stream_process is not None:
+            stream_commands.put(("stop", None))
+            stream_process.join(timeout=30)
+            if stream_process.is_alive():
+                stream_process.terminate()
+                stream_process.join()
+        # Shard workers write out what they were sent before stopping
+        for messages in shard_queues or ():
+            messages.put(None)
+        for process in shard_processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        for engine in read_engines:
+            engine.close()
+        if stream_process is not None:
+            log.info("Stream process stopped")
@@ -0,0 +1,344 @@
+# bench.py
+"""Benchmark the API read endpoints over synthetic day files.
+
+    python bench.py [--scales 5x1000x10,20x5000x20] [--save benchmarks/baseline.json]
+    python bench.py --compare benchmarks/baseline.json
+
+For every scale (symbols x snapshots per symbol x levels per side) a day file
+is generated through storage.BookRecorder, so it has the same schema, storage
+mode and rollups as a recorded one (kept in bench_data/ for the next run).
+The API is started on it with uvicorn and each case is measured twice:
+sequentially for p50/p99 latency, then with --clients concurrent clients for
+throughput. Peak RSS of the API process is reported per scale.
+
+Results are written as JSON; --compare exits non-zero when a case's p50 or
+throughput is more than --tolerance worse than the baseline.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+import storage
+from manifest import day_file_name, session_date
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SCALES = "5x1000x10,20x5000x20"
+# Case name -> path template ({symbol} is filled in per request)
+CASES = {
+    "depth": "/depth/{symbol}",
+    "symbols": "/symbols",
+    "historical_full": "/historical_full/{symbol}",
+    "historical_full_limit": "/historical_full/{symbol}?limit=500",
+}
+
+
+def parse_scale(text):
+    symbols, snapshots, levels = (int(part) for part in text.lower().split("x"))
+    return symbols, snapshots, levels
+
+
+def generate_day_file(path, symbols, snapshots, levels, schema_version=storage.SCHEMA_VERSION,
+                      mode=storage.BOOK_STORAGE, seed=1, batch_rows=100_000):
+    """Write a day file with symbols x snapshots books of levels per side, updates interleaved in time.
+
+    Each update changes a few levels; one in five comes with a trade. Returns the book row count.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    if schema_version == storage.LEGACY_SCHEMA:
+        # ensure_schema only keeps the legacy layout for files that already have its tables
+        storage.LegacySchema().create(conn.cursor())
+    else:
+        conn.execute(f"PRAGMA user_version = {schema_version}")
+    schema = storage.ensure_schema(conn)
+    recorder = storage.BookRecorder(schema, mode=mode)
+
+    names = [f"SPY   250423C00{500 + i:03d}000" for i in range(symbols)]
+    books = []
+    for i in range(symbols):
+        mid = 1.0 + i * 0.05
+        books.append((
+            {round(mid - k * 0.01, 2): rng.randint(1, 100) for k in range(levels)},
+            {round(mid + 0.01 + k * 0.01, 2): rng.randint(1, 100) for k in range(levels)},
+        ))
+
+    pending = {}
+    pending_rows = 0
+    book_rows = 0
+
+    def queue(batches):
+        nonlocal pending_rows
+        for sql, rows in batches:
+            pending.setdefault(sql, []).extend(rows)
+            pending_rows += len(rows)
+
+    def flush():
+        nonlocal pending, pending_rows
+        for sql, rows in pending.items():
+            conn.executemany(sql, rows)
+        conn.commit()
+        pending, pending_rows = {}, 0
+
+    # A session starting at 09:30 today, one update per symbol roughly every 500 ms
+    ts = int(datetime.now().replace(hour=9, minute=30, second=0, microsecond=0).timestamp() * 1000)
+    for _ in range(snapshots):
+        for i, name in enumerate(names):
+            ts += max(1, rng.randint(100, 900) // symbols)
+            bids, asks = books[i]
+            for _ in range(rng.randint(1, 3)):
+                side = bids if rng.random() < 0.5 else asks
+                side[rng.choice(list(side))] = rng.randint(1, 100)
+            bid_levels = sorted(bids.items(), reverse=True)
+            ask_levels = sorted(asks.items())
+            book_rows += len(bid_levels) + len(ask_levels)
+            queue(recorder.book(name, ts, bid_levels, ask_levels))
+            if rng.random() < 0.2:
+                queue(recorder.level_one(name, ts, bid_levels[0][0], rng.randint(1, 10), 500.0))
+        if pending_rows >= batch_rows:
+            flush()
+    queue(recorder.flush_rollups())
+    flush()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return book_rows
+
+
+def prepare_data_dir(root, scale, schema_version, mode):
+    """A data directory holding only a day file for scale, named for today so the API reads it."""
+    symbols, snapshots, levels = scale
+    data_dir = os.path.join(root, f"{symbols}x{snapshots}x{levels}-v{schema_version}-{mode}")
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, day_file_name(session_date()))
+    existing = [name for name in os.listdir(data_dir) if name.startswith("options_data_") and name.endswith(".db")]
+    info_path = os.path.join(data_dir, "bench.json")
+    if existing and os.path.exists(info_path):
+        if existing[0] != os.path.basename(path):
+            os.replace(os.path.join(data_dir, existing[0]), path)
+        with open(info_path) as f:
+            return data_dir, json.load(f)
+
+    for name in os.listdir(data_dir):
+        os.remove(os.path.join(data_dir, name))
+    print(f"Generating {symbols} symbols x {snapshots:,} snapshots x {levels} levels ({mode}, schema v{schema_version})")
+    start = time.perf_counter()
+    rows = generate_day_file(path, symbols, snapshots, levels, schema_version, mode)
+    info = {
+        "book_rows": rows,
+        "file_bytes": os.path.getsize(path),
+        "generate_seconds": round(time.perf_counter() - start, 2),
+    }
+    with open(info_path, "w") as f:
+        json.dump(info, f)
+    return data_dir, info
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(data_dir, port, history_cache_mb):
+    """Run the API under uvicorn on data_dir, without a Schwab connection."""
+    env = dict(os.environ, DATA_DIR=data_dir, STREAM_OFFLINE="1", HISTORY_CACHE_MB=str(history_cache_mb))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            status, _ = fetch(http.client.HTTPConnection("127.0.0.1", port, timeout=5), "/active_symbols")
+            if status == 200:
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("API did not start")
+
+
+def peak_rss_mb(pid):
+    """Peak resident set size of a process (Linux), or None."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def fetch(conn, path):
+    conn.request("GET", path)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_case(port, template, symbols, requests, clients, seconds):
+    """Sequential latency, then concurrent throughput, for one endpoint."""
+    paths = [template.format(symbol=quote(symbol)) for symbol in symbols]
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+    latencies = []
+    size = 0
+    for n in range(requests):
+        start = time.perf_counter()
+        status, body = fetch(conn, paths[n % len(paths)])
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            raise RuntimeError(f"{paths[n % len(paths)]} returned {status}")
+        size = len(body)
+    conn.close()
+
+    done = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+
+    def client(index):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        mine = []
+        n = index
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            fetch(conn, paths[n % len(paths)])
+            mine.append(time.perf_counter() - start)
+            n += 1
+        conn.close()
+        with lock:
+            done.extend(mine)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "response_bytes": size,
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "clients": clients,
+        "throughput_rps": round(len(done) / elapsed, 1),
+        "concurrent_p99_ms": round(percentile(done, 0.99) * 1000, 3) if done else None,
+    }
+
+
+def run(args):
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "cpus": os.cpu_count(),
+        },
+        "settings": {
+            "schema": args.schema, "storage": args.storage, "clients": args.clients,
+            "seconds": args.seconds, "history_cache_mb": args.history_cache_mb,
+        },
+        "scales": {},
+    }
+    for text in args.scales.split(","):
+        scale = parse_scale(text)
+        data_dir, info = prepare_data_dir(args.data_dir, scale, args.schema, args.storage)
+        symbols = [f"SPY   250423C00{500 + i:03d}000" for i in range(scale[0])]
+        port = free_port()
+        process = start_api(data_dir, port, args.history_cache_mb)
+        try:
+            cases = {}
+            for name, template in CASES.items():
+                history = name.startswith("historical_full")
+                requests = args.history_requests if history else args.requests
+                cases[name] = run_case(port, template, symbols, requests, args.clients, args.seconds)
+                print(f"  {text:>14} {name:<22} p50 {cases[name]['p50_ms']:>9.2f}ms  p99 {cases[name]['p99_ms']:>9.2f}ms  "
+                      f"{cases[name]['throughput_rps']:>8.1f} req/s x{args.clients}")
+            rss = peak_rss_mb(process.pid)
+        finally:
+            process.terminate()
+            process.wait(10)
+        print(f"  {text:>14} peak RSS {rss} MB, {info['book_rows']:,} book rows, {info['file_bytes'] / 1e6:.1f} MB")
+        results["scales"][text] = {**info, "peak_rss_mb": rss, "cases": cases}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print each case against the baseline; returns the regressions found."""
+    regressions = []
+    for scale, current in results["scales"].items():
+        base = baseline.get("scales", {}).get(scale)
+        if base is None:
+            continue
+        for name, case in current["cases"].items():
+            before = base["cases"].get(name)
+            if before is None:
+                continue
+            latency = case["p50_ms"] / before["p50_ms"] if before["p50_ms"] else 1.0
+            throughput = before["throughput_rps"] / case["throughput_rps"] if case["throughput_rps"] else float("inf")
+            flag = latency > 1 + tolerance or throughput > 1 + tolerance
+            print(f"  {scale:>14} {name:<22} p50 x{latency:.2f}  throughput x{1 / throughput:.2f}{'  REGRESSION' if flag else ''}")
+            if flag:
+                regressions.append((scale, name))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API read endpoints over synthetic day files")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="comma-separated SYMBOLSxSNAPSHOTSxLEVELS")
+    parser.add_argument("--schema", type=int, default=storage.SCHEMA_VERSION, choices=sorted(storage.SCHEMAS),
+                        help="day file schema version to generate (0 = legacy)")
+    parser.add_argument("--storage", default=storage.BOOK_STORAGE, choices=("full", "delta"))
+    parser.add_argument("--requests", type=int, default=200, help="sequential requests per depth/symbols case")
+    parser.add_argument("--history-requests", type=int, default=10, help="sequential requests per history case")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients for the throughput run")
+    parser.add_argument("--seconds", type=float, default=5, help="length of each throughput run")
+    parser.add_argument("--history-cache-mb", type=int, default=0,
+                        help="HISTORY_CACHE_MB for the API (0 measures the queries, not the cache)")
+    parser.add_argument("--data-dir", default=os.path.join(BASE_DIR, "bench_data"), help="where generated files are kept")
+    parser.add_argument("--save", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a case counts as a regression")
+    parser.add_argument("--clean", action="store_true", help="regenerate the day files")
+    args = parser.parse_args(argv)
+
+    if args.clean and os.path.exists(args.data_dir):
+        shutil.rmtree(args.data_dir)
+    results = run(args)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+# compact.py
+"""Convert options_data_YYMMDD.db day files to the compact, delta-encoded format.
+
+    python compact.py data/options_data_250423.db [more.db ...] [--full] [--dry-run]
+
+Each file is rewritten in the compact schema (symbol dictionary, integer price
+ticks, clustered key) with its book stored as keyframes plus changed levels,
+or every level with --full. Rollup tables for every resolution are built on the
+way. The original is kept next to it as <name>.db.bak.
+A size and read-time comparison is printed for every file.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import storage
+from manifest import DayManifest
+
+
+def file_size(path):
+    """Size in bytes of a day file including any WAL sidecar."""
+    size = os.path.getsize(path)
+    if os.path.exists(path + "-wal"):
+        size += os.path.getsize(path + "-wal")
+    return size
+
+
+def time_reads(path):
+    """Seconds taken to rebuild every stored book in a day file, and how many there were."""
+    conn = sqlite3.connect(path)
+    try:
+        start = time.perf_counter()
+        snapshots = 0
+        for symbol in storage.list_symbols(conn):
+            for _ in storage.iter_book_snapshots(conn, symbol):
+                snapshots += 1
+        return time.perf_counter() - start, snapshots
+    finally:
+        conn.close()
+
+
+def convert(src_path, dst_path, mode, keyframe_every, keyframe_seconds, batch_rows=50000):
+    """Write a compact-schema copy of src_path to dst_path. Returns (book rows in, book rows out)."""
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        schema = storage.ensure_schema(dst)
+        recorder = storage.BookRecorder(schema, mode, keyframe_every, keyframe_seconds)
+        rows_in = 0
+        rows_out = 0
+        pending = {}
+        pending_rows = 0
+
+        def queue(batches):
+            nonlocal pending_rows, rows_out
+            for sql, rows in batches:
+                pending.setdefault(sql, []).extend(rows)
+                pending_rows += len(rows)
+                if sql in (schema.book_insert_sql, schema.delta_insert_sql):
+                    rows_out += len(rows)
+
+        def flush():
+            nonlocal pending, pending_rows
+            for sql, rows in pending.items():
+                dst.executemany(sql, rows)
+            pending = {}
+            pending_rows = 0
+
+        for symbol in storage.list_symbols(src):
+            # Level-one rows are interleaved by timestamp so rollup buckets see them in order
+            level_one = storage.iter_level_one(src, symbol)
+            next_level_one = next(level_one, None)
+            for ts, levels in storage.iter_book_snapshots(src, symbol):
+                while next_level_one is not None and next_level_one[0] <= ts:
+                    queue(recorder.level_one(symbol, *next_level_one))
+                    next_level_one = next(level_one, None)
+                rows_in += len(levels)
+                # A side with no levels at this timestamp was not part of the update
+                bids = [(l["price"], l["quantity"]) for l in levels if l["side"] == "BID"] or None
+                asks = [(l["price"], l["quantity"]) for l in levels if l["side"] == "ASK"] or None
+                queue(recorder.book(symbol, ts, bids, asks))
+                if pending_rows >= batch_rows:
+                    flush()
+
+            while next_level_one is not None:
+                queue(recorder.level_one(symbol, *next_level_one))
+                next_level_one = next(level_one, None)
+            if pending_rows >= batch_rows:
+                flush()
+
+        queue(recorder.flush_rollups())
+        flush()
+        dst.commit()
+        dst.execute("VACUUM")
+        return rows_in, rows_out
+    finally:
+        src.close()
+        dst.close()
+
+
+def compact_file(path, mode, keyframe_every, keyframe_seconds, dry_run=False):
+    src = sqlite3.connect(path)
+    try:
+        schema = storage.schema_for(src)
+        if schema.version == storage.SCHEMA_VERSION and storage.uses_delta(src, schema) == (mode == "delta"):
+            print(f"{path}: already in the current format, skipping")
+            return None
+        # Fold any WAL content into the main file so the size comparison is fair
+        src.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        src.close()
+
+    tmp_path = path + ".compact"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    start = time.perf_counter()
+    rows_in, rows_out = convert(path, tmp_path, mode, keyframe_every, keyframe_seconds)
+    elapsed = time.perf_counter() - start
+
+    before_size = file_size(path)
+    after_size = file_size(tmp_path)
+    before_read, snapshots_before = time_reads(path)
+    after_read, snapshots_after = time_reads(tmp_path)
+
+    report = {
+        "file": path,
+        "book_rows_before": rows_in,
+        "book_rows_after": rows_out,
+        "bytes_before": before_size,
+        "bytes_after": after_size,
+        "read_seconds_before": round(before_read, 3),
+        "read_seconds_after": round(after_read, 3),
+        "snapshots_before": snapshots_before,
+        "snapshots_after": snapshots_after,
+        "convert_seconds": round(elapsed, 3),
+    }
+    print(f"{path}:")
+    print(f"  book rows  {rows_in:>12,} -> {rows_out:>12,}")
+    print(f"  file size  {before_size / 1e6:>10.1f}MB -> {after_size / 1e6:>10.1f}MB "
+          f"({after_size / max(before_size, 1):.1%})")
+    print(f"  full read  {before_read:>11.3f}s -> {after_read:>11.3f}s "
+          f"({snapshots_before:,} -> {snapshots_after:,} snapshots; unchanged books are not re-stored)")
+
+    if dry_run:
+        os.remove(tmp_path)
+    else:
+        os.replace(path, path + ".bak")
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.replace(tmp_path, path)
+        print(f"  original kept as {path}.bak")
+        # Keep the day-file index in step with the rewritten file
+        manifest = DayManifest(os.path.dirname(os.path.abspath(path)))
+        if os.path.exists(manifest.path):
+            manifest.index(path)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert day files to the compact, delta-encoded format")
+    parser.add_argument("files", nargs="+", help="options_data_YYMMDD.db files to convert")
+    parser.add_argument("--keyframe-every", type=int, default=storage.KEYFRAME_EVERY,
+                        help="write a full keyframe every N updates per symbol")
+    parser.add_argument("--keyframe-seconds", type=float, default=storage.KEYFRAME_SECONDS,
+                        help="write a full keyframe at least every S seconds per symbol")
+    parser.add_argument("--full", action="store_true", help="store every level instead of deltas")
+    parser.add_argument("--dry-run", action="store_true", help="report the gains without replacing files")
+    parser.add_argument("--force", action="store_true", help="allow converting today's (live) day file")
+    args = parser.parse_args(argv)
+
+    today_name = f"options_data_{datetime.now().strftime('%y%m%d')}.db"
+    for path in args.files:
+        if os.path.basename(path) == today_name and not args.force and not args.dry_run:
+            print(f"{path}: today's file may still be written by the stream, use --force to convert it")
+            continue
+        mode = "full" if args.full else "delta"
+        compact_file(path, mode, args.keyframe_every, args.keyframe_seconds, args.dry_run)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
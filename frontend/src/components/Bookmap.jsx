@@ -8,8 +8,63 @@ import React, {
 import { useParams, useNavigate } from 'react-router-dom';
 import { createChart } from 'lightweight-charts';
 import { HeatMapSeries } from '../heatmap/render';
+import { COLUMNAR_TYPE, decodeColumnar } from '../heatmap/columnar';
+import { BarHistory } from '../heatmap/history';
 import { LockIcon } from './LockIcon';
 
+/** Server history per symbol, kept across chart re-opens so only newer snapshots are fetched */
+const HIST_CACHE_SYMBOLS = 8;
+const histCache = new Map();   // `${apiBaseUrl}|${symbol}` -> { rows, cursor, etag }
+
+/** Bars kept in the chart by default: 6 hours of one-second bars */
+const HISTORY_CAP = 6 * 60 * 60;
+/** How far back each scroll-left fetch reaches */
+const OLDER_PAGE_SECONDS = 30 * 60;
+/** Fetch an older page when the view gets this many bars from the oldest one */
+const OLDER_MARGIN = 50;
+
+/** Depth levels as a heatmap row of typed arrays, like decodeColumnar's rows; empty levels are left out */
+const levelsRow = levels => {
+  const prices = new Float64Array(levels.length);
+  const amounts = new Float32Array(levels.length);
+  let k = 0;
+  for (const l of levels) {
+    if (!(l.quantity > 0)) continue;
+    prices[k] = +l.price;
+    amounts[k] = l.quantity * (l.side === 'BID' ? 1 : -1);
+    k++;
+  }
+  return { prices: prices.subarray(0, k), amounts: amounts.subarray(0, k) };
+};
+
+/** Map /historical_full snapshots to heatmap rows, keeping times strictly ascending after lastTime */
+const toRows = (snapshots, lastTime = 0) => snapshots
+  .filter(s => s.levels?.length)
+  .map(s => {
+    // Ensure each timestamp is at least 1 second after the previous
+    let time = Math.floor(s.timestamp / 1000);
+    if (time <= lastTime) {
+      time = lastTime + 1;
+    }
+    lastTime = time;
+
+    return {
+      time,
+      ...levelsRow(s.levels),
+      lastPrice: s.last_price,  // Move these to the top level
+      lastSize: s.last_size     // to match the renderer's expectations
+    };
+  });
+
+/** Parse a /historical_full response, columnar or JSON, into rows */
+const readHistory = async (r, lastTime = 0) => {
+  if ((r.headers.get('Content-Type') || '').startsWith(COLUMNAR_TYPE)) {
+    return decodeColumnar(await r.arrayBuffer(), lastTime);
+  }
+  const d = await r.json();
+  return { rows: toRows(d.snapshots || [], lastTime), cursor: d.cursor };
+};
+
 /** ±10% helper with minimum value of 0.05 and never below 0 */
 const pctBand = p => ({ minValue: Math.max(0, Math.min(p - 0.05, p * 0.9)), maxValue: Math.max(p + 0.05, p * 1.1) });    
 
@@ -17,6 +72,8 @@ export default function Bookmap({
   apiBaseUrl,
   symbol: propSymbol,
   minimal = false,
+  historyCap = HISTORY_CAP,
+  feed = null,
 }) {
   const { symbol: routeSym = '' } = useParams();
   const symbol = propSymbol || routeSym;
@@ -25,9 +82,13 @@ export default function Bookmap({
   const chartEl = useRef(null);
   const chart    = useRef(null);
   const series   = useRef({});
-  const history  = useRef([]);
+  const history  = useRef(new BarHistory(historyCap));
+  const older    = useRef({ loading: false, done: false });
   const lastPrice = useRef(null);
   const initialDone = useRef(false);
+  const lastBarAt = useRef(0);          // performance.now() when the newest bar was added
+  const wsBook    = useRef(new Map());  // live book kept from /ws/depth pushes
+  const wsInfo    = useRef({});
 
   const [loading, setLoading] = useState(true);
   const [error,   setError]   = useState(null);
@@ -82,144 +143,242 @@ export default function Bookmap({
 
   const fetchHist = useCallback(async enc => {
     if (!chart.current) return;
+    const key = `${apiBaseUrl}|${enc}`;
+    const cached = histCache.get(key) || { rows: [], cursor: null, etag: null };
     try {
-      const r = await fetch(`${apiBaseUrl}/historical_full/${enc}`);
-      if (!r.ok) return;
-      const d = await r.json();
-      
-      // Process historical data ensuring ascending timestamps
-      let lastTime = 0;
-      history.current = (d.snapshots || [])
-        .filter(s => s.levels?.length)
-        .map(s => {
-          // Ensure each timestamp is at least 1 second after the previous
-          let time = Math.floor(s.timestamp / 1000);
-          if (time <= lastTime) {
-            time = lastTime + 1;
-          }
-          lastTime = time;
-          
-          return {
-            time,
-            cells: s.levels.map(l => ({
-              low: +l.price,
-              high: +l.price + 0.01,
-              amount: l.quantity * (l.side === 'BID' ? 1 : -1),
-            })),
-            lastPrice: s.last_price,  // Move these to the top level
-            lastSize: s.last_size     // to match the renderer's expectations
-          };
-        });
-      
-      // Sort to ensure ascending order
-      history.current.sort((a, b) => a.time - b.time);
-      series.current.heatmap.setData(history.current);
+      if (feed) {
+        // The Dashboard fetches every chart's history in one /historical_batch
+        const d = await feed.history(decodeURIComponent(enc), cached.cursor);
+        const lastTime = cached.rows.at(-1)?.time || 0;
+        const { rows, cursor } = d instanceof ArrayBuffer
+          ? decodeColumnar(d, lastTime)
+          : { rows: toRows(d?.snapshots || [], lastTime), cursor: d?.cursor };
+        cached.rows = cached.rows.concat(rows).slice(-historyCap);
+        cached.cursor = cursor ?? cached.cursor;
+        if (!chart.current) return;
+      } else {
+        // Only ask for snapshots newer than what we already hold; 304 means nothing new
+        const url = cached.cursor != null
+          ? `${apiBaseUrl}/historical_full/${enc}?since=${cached.cursor}`
+          : `${apiBaseUrl}/historical_full/${enc}`;
+        // Prefer the binary columnar body: typed-array views, no per-level objects
+        const headers = { Accept: `${COLUMNAR_TYPE}, application/json;q=0.9` };
+        if (cached.etag) headers['If-None-Match'] = cached.etag;
+        const r = await fetch(url, { cache: 'no-store', headers });
+        if (r.status === 200) {
+          const lastTime = cached.rows.at(-1)?.time || 0;
+          const { rows, cursor } = await readHistory(r, lastTime);
+          // Older bars are fetched again on scroll-left, so the cache holds no more than the chart
+          cached.rows = cached.rows.concat(rows).slice(-historyCap);
+          cached.cursor = cursor ?? cached.cursor;
+          cached.etag = r.headers.get('ETag');
+        } else if (r.status !== 304) {
+          return;
+        }
+      }
+
+      // Most recently used last; drop the oldest symbol over the budget
+      histCache.delete(key);
+      histCache.set(key, cached);
+      if (histCache.size > HIST_CACHE_SYMBOLS) histCache.delete(histCache.keys().next().value);
+
+      // Live bars go into the ring buffer, never into the cached rows
+      history.current.reset(cached.rows);
+      series.current.heatmap.setData(history.current.toArray());
       chart.current.timeScale().scrollToRealTime();
     } catch (e) {
       console.error(e);
     }
-  }, [apiBaseUrl]);
+  }, [apiBaseUrl, historyCap, feed]);
 
-  const fetchDepth = useCallback(async enc => {
-    if (!chart.current || !series.current.heatmap) return;
+  /**
+   * Re-send the whole history, which drops what the ring buffer evicted from the
+   * chart's own copy, keeping the same bars on screen. Older pages are let go
+   * once the view is back among the newest bars.
+   */
+  const syncChart = useCallback(() => {
+    const h = history.current;
+    const timeScale = chart.current.timeScale();
+    const range = timeScale.getVisibleLogicalRange();
+    if (h.older.length && range && range.from > h.older.length + h.capacity / 2) {
+      h.dropOlder();
+      older.current.done = false;
+    }
+    const removed = h.evicted;
+    h.evicted = 0;
+    series.current.heatmap.setData(h.toArray());
+    if (range && removed) {
+      timeScale.setVisibleLogicalRange({ from: range.from - removed, to: range.to - removed });
+    }
+  }, []);
+
+  /* scrolled to the left edge: fetch the page of bars before the oldest one held */
+  const fetchOlder = useCallback(async enc => {
+    const h = history.current;
+    const first = h.first();
+    if (!chart.current || !first || older.current.loading || older.current.done || h.olderFull) return;
+    older.current.loading = true;
     try {
-      const r = await fetch(`${apiBaseUrl}/depth/${enc}?_=${Date.now()}`);
+      const end = first.time * 1000 - 1;
+      const start = end - OLDER_PAGE_SECONDS * 1000;
+      const r = await fetch(`${apiBaseUrl}/historical_full/${enc}?start=${start}&end=${end}`, {
+        headers: { Accept: `${COLUMNAR_TYPE}, application/json;q=0.9` },
+      });
       if (!r.ok) return;
-      const d = await r.json();
-      if (!d?.levels) return;
-
-      // Get current timestamp and ensure it's newer than last entry
-      const currentTime = Math.floor(d.timestamp / 1000);
-      const lastTime = history.current.at(-1)?.time || 0;
-      
-      // Skip update if the timestamp is older than our latest data
-      if (currentTime < lastTime) {
+      const rows = (await readHistory(r)).rows.filter(row => row.time < first.time);
+      // The symbol changed or the history was reloaded meanwhile
+      if (!chart.current || h !== history.current || h.first() !== first) return;
+      if (!rows.length) {
+        older.current.done = true;
         return;
       }
+      const timeScale = chart.current.timeScale();
+      const range = timeScale.getVisibleLogicalRange();
+      const added = h.prepend(rows);
+      series.current.heatmap.setData(h.toArray());
+      if (range) timeScale.setVisibleLogicalRange({ from: range.from + added, to: range.to + added });
+    } catch (e) {
+      console.error(e);
+    } finally {
+      older.current.loading = false;
+    }
+  }, [apiBaseUrl]);
+
+  /**
+   * Add a depth snapshot to the chart.
+   * mode 'bump'  - always add a bar, at least 1s after the newest one (polling)
+   * mode 'merge' - replace the newest bar when the update falls in its second (push)
+   */
+  const applyDepth = useCallback((d, mode = 'bump') => {
+    if (!chart.current || !series.current.heatmap) return;
+    if (!d?.levels) return;
+
+    const h = history.current;
+
+    // Get current timestamp and ensure it's newer than last entry
+    const currentTime = Math.floor(d.timestamp / 1000);
+    const lastTime = h.last()?.time || 0;
+    const replaceLast = mode === 'merge' && h.length > 0 && currentTime <= lastTime;
+    
+    // Skip update if the timestamp is older than our latest data
+    if (currentTime < lastTime && !replaceLast) {
+      return;
+    }
+    
+    // Use a timestamp that's definitely newer than our last entry
+    const ts = replaceLast ? lastTime : Math.max(currentTime, lastTime + 1);
+
+    // push latest price info
+    setLatest(prev => ({
+      last_price:      d.last_price ?? prev.last_price,
+      last_size:       d.last_size  ?? prev.last_size,
+      underlying_price:d.underlying_price ?? prev.underlying_price,
+    }));
+    lastPrice.current = d.last_price ?? lastPrice.current;
+
+    // Process new levels
+    const row = levelsRow(d.levels);
+
+    // Only add new data point if we have cells or last trade data
+    if (row.prices.length > 0 || d.last_size) {
+      // Prepare data point with trade information
+      const dataPoint = {
+        time: ts,
+        ...row,
+        // Only include trade data if we have both price and size
+        ...(d.last_price != null && d.last_size != null ? {
+          lastPrice: d.last_price,
+          lastSize: d.last_size
+        } : {})
+      };
+      if (replaceLast) {
+        h.replaceLast(dataPoint);
+      } else {
+        h.push(dataPoint);
+        lastBarAt.current = performance.now();
+      }
+      // ts is never older than the newest bar, so one incremental update does
+      series.current.heatmap.update(dataPoint);
+      // Trim the chart's copy once the ring has dropped a tenth of its bars
+      if (h.evicted >= Math.max(h.capacity / 10, 100)) syncChart();
+    }
+
+    // —— INITIAL ZOOM ONCE —— 
+    if (!initialDone.current && lastPrice.current != null) {
+      const band = pctBand(lastPrice.current);
       
-      // Use a timestamp that's definitely newer than our last entry
-      const ts = Math.max(currentTime, lastTime + 1);
-
-      // push latest price info
-      setLatest(prev => ({
-        last_price:      d.last_price ?? prev.last_price,
-        last_size:       d.last_size  ?? prev.last_size,
-        underlying_price:d.underlying_price ?? prev.underlying_price,
-      }));
-      lastPrice.current = d.last_price ?? lastPrice.current;
-
-      // Process new levels
-      const cells = d.levels
-        .filter(l => l.quantity > 0)
-        .map(l => ({
-          low: l.price,
-          high: l.price + 0.01,
-          amount: l.quantity * (l.side === 'BID' ? 1 : -1),
-        }));
+      // Apply the initial zoom using the pctBand auto mode
+      series.current.heatmap.applyOptions({
+        autoscaleInfoProvider: () => ({ priceRange: band }),
+      });
       
-      // Only add new data point if we have cells or last trade data
-      if (cells.length > 0 || d.last_size) {
-        // Remove any future timestamps (shouldn't happen, but just in case)
-        history.current = history.current.filter(h => h.time <= ts);
-        // Prepare data point with trade information
-        const dataPoint = { 
-          time: ts, 
-          cells,
-          // Only include trade data if we have both price and size
-          ...(d.last_price != null && d.last_size != null ? {
-            lastPrice: d.last_price,
-            lastSize: d.last_size
-          } : {})
-        };
-        history.current.push(dataPoint);
-      }
+      initialDone.current = true;
+    }
+
+    // Calculate the time range to show (only during initial period)
+    if (h.length > 0) {
+      const firstDataTime = h.first()?.time || ts;
+      const totalTimeRange = ts - firstDataTime;
       
-      // Sort to ensure ascending order
-      history.current.sort((a, b) => a.time - b.time);
-      series.current.heatmap.setData(history.current);
-
-      // —— INITIAL ZOOM ONCE —— 
-      if (!initialDone.current && lastPrice.current != null) {
-        const band = pctBand(lastPrice.current);
-        
-        // Apply the initial zoom using the pctBand auto mode
-        series.current.heatmap.applyOptions({
-          autoscaleInfoProvider: () => ({ priceRange: band }),
+      // Only adjust the visible range if we haven't reached 3 minutes yet
+      if (totalTimeRange < 180) {
+        chart.current.timeScale().setVisibleRange({ 
+          from: ts - totalTimeRange, 
+          to: ts 
         });
-        
-        initialDone.current = true;
       }
+    }
 
-      // Calculate the time range to show (only during initial period)
-      if (history.current.length > 0) {
-        const firstDataTime = history.current[0]?.time || ts;
-        const totalTimeRange = ts - firstDataTime;
-        
-        // Only adjust the visible range if we haven't reached 3 minutes yet
-        if (totalTimeRange < 180) {
-          chart.current.timeScale().setVisibleRange({ 
-            from: ts - totalTimeRange, 
-            to: ts 
-          });
-        }
-      }
+    // —— EVERY‐TICK OVERRIDE IF LOCKED (mode 0) —— 
+    if (lockMode === 0 && lastPrice.current != null) {
+      const band = pctBand(lastPrice.current);
+      series.current.heatmap.applyOptions({
+        autoscaleInfoProvider: () => ({ priceRange: band }),
+      });
+    }
 
-      // —— EVERY‐TICK OVERRIDE IF LOCKED (mode 0) —— 
-      if (lockMode === 0 && lastPrice.current != null) {
-        const band = pctBand(lastPrice.current);
-        series.current.heatmap.applyOptions({
-          autoscaleInfoProvider: () => ({ priceRange: band }),
-        });
-      }
+    // No scrollToRealTime here: the user may be looking at older bars, and
+    // shiftVisibleRangeOnNewBar already follows new bars at real time
+    setLoading(false);
+  }, [lockMode, syncChart]);
 
-      chart.current.timeScale().scrollToRealTime();
-      setLoading(false);
+  const fetchDepth = useCallback(async enc => {
+    if (!chart.current || !series.current.heatmap) return;
+    try {
+      const r = await fetch(`${apiBaseUrl}/depth/${enc}?_=${Date.now()}`);
+      if (!r.ok) return;
+      const d = await r.json();
+      applyDepth(d);
     } catch (e) {
       console.error(e);
       setError(e.message);
       setLoading(false);
     }
-  }, [apiBaseUrl, lockMode]);
+  }, [apiBaseUrl, applyDepth]);
+
+  /* fold a /ws/depth snapshot or delta into the local live book */
+  const applyPush = useCallback(m => {
+    const book = wsBook.current;
+    const info = wsInfo.current;
+    if (m.type === 'snapshot') {
+      book.clear();
+      info.last_price = m.last_price;
+      info.last_size = m.last_size;
+      info.underlying_price = m.underlying_price;
+    } else {
+      if (m.last_price != null) info.last_price = m.last_price;
+      if (m.last_size != null) info.last_size = m.last_size;
+      if (m.underlying_price != null) info.underlying_price = m.underlying_price;
+    }
+    for (const l of m.levels || []) {
+      const key = `${l.side}:${l.price}`;
+      if (m.type === 'delta' && !l.quantity) book.delete(key);
+      else book.set(key, l);
+    }
+    info.timestamp = Math.max(info.timestamp || 0, m.timestamp || 0);
+  }, []);
+
+  const pushedDepth = () => ({ ...wsInfo.current, levels: [...wsBook.current.values()] });
 
   /* chart init */
   useEffect(() => {
@@ -257,6 +416,8 @@ export default function Bookmap({
       lastValueVisible: false,
       priceLineVisible: false,
       cellShader: a => `rgba(${a>0?'76,175,80':'244,67,54'},${Math.min(Math.abs(a)/100,1)})`,
+      // Rasterize bars once and redraw from cached pixel columns while panning
+      rasterize: true,
       autoscaleInfoProvider: undefined,
     });
     const resize = () => chart.current.applyOptions({ width: chartEl.current.clientWidth });
@@ -269,7 +430,7 @@ export default function Bookmap({
       chart.current.remove();
       chart.current = null;
       series.current = {};
-      history.current = [];
+      history.current = new BarHistory(historyCap);
     };
   }, []);
 
@@ -281,7 +442,8 @@ export default function Bookmap({
     const enc = encodeURIComponent(fmt);
 
     setLoading(true);
-    history.current = [];
+    history.current = new BarHistory(historyCap);
+    older.current = { loading: false, done: false };
     lastPrice.current = null;
     initialDone.current = false;
 
@@ -290,12 +452,98 @@ export default function Bookmap({
       chart.current.priceScale('right').applyOptions({ autoScale: true });
     }
 
-    fetchHist(enc).then(() => fetchDepth(enc));
-    if (autoRefresh) {
-      const id = setInterval(() => fetchDepth(enc), refreshRate);
-      return () => clearInterval(id);
-    }
-  }, [symbol, autoRefresh, refreshRate, fetchHist, fetchDepth]);
+    wsBook.current = new Map();
+    wsInfo.current = {};
+
+    let closed = false;
+    let ws = null;
+    let pollId = null;
+    let tickId = null;
+    let frame = null;
+
+    // Fallback: poll /depth every refreshRate
+    const startPolling = () => {
+      if (closed || pollId) return;
+      fetchDepth(enc);
+      pollId = setInterval(() => fetchDepth(enc), refreshRate);
+    };
+
+    // Preferred: live pushes from /ws/depth, falling back to polling if unavailable
+    const startPush = () => {
+      const wsUrl = `${apiBaseUrl.replace(/^http/, 'ws')}/ws/depth`;
+      try {
+        ws = new WebSocket(wsUrl);
+      } catch (e) {
+        startPolling();
+        return;
+      }
+      ws.onopen = () => {
+        ws.send(JSON.stringify({ action: 'subscribe', symbols: [fmt] }));
+        // Keep adding a bar every refreshRate while the book is quiet, like polling did
+        tickId = setInterval(() => {
+          if (wsInfo.current.timestamp && performance.now() - lastBarAt.current >= refreshRate) {
+            applyDepth(pushedDepth());
+          }
+        }, refreshRate);
+      };
+      ws.onmessage = ev => {
+        const m = JSON.parse(ev.data);
+        if (m.symbol !== fmt || (m.type !== 'snapshot' && m.type !== 'delta')) return;
+        applyPush(m);
+        // Coalesce bursts of pushes into one redraw per frame
+        if (frame == null) {
+          frame = requestAnimationFrame(() => {
+            frame = null;
+            applyDepth(pushedDepth(), 'merge');
+          });
+        }
+      };
+      ws.onclose = () => {
+        clearInterval(tickId);
+        tickId = null;
+        startPolling();
+      };
+    };
+
+    // Scrolled near the oldest bar: fetch the page before it
+    const onRange = range => {
+      if (range && range.from < OLDER_MARGIN) fetchOlder(enc);
+    };
+
+    let unsubscribe = null;
+
+    fetchHist(enc).then(() => {
+      if (closed) return;
+      chart.current.timeScale().subscribeVisibleLogicalRangeChange(onRange);
+      if (feed && autoRefresh) {
+        // One /ws/depth socket (or poll loop) for all the Dashboard's charts
+        unsubscribe = feed.subscribe(fmt, (d, mode) => {
+          // Pushed books only add a bar of their own while the book is quiet, as in startPush
+          if (mode === 'tick' && performance.now() - lastBarAt.current < refreshRate) return;
+          applyDepth(d, mode === 'merge' ? 'merge' : 'bump');
+        });
+      } else if (!autoRefresh) {
+        fetchDepth(enc);
+      } else if (typeof WebSocket === 'undefined') {
+        startPolling();
+      } else {
+        startPush();
+      }
+    });
+
+    return () => {
+      closed = true;
+      chart.current?.timeScale().unsubscribeVisibleLogicalRangeChange(onRange);
+      unsubscribe?.();
+      if (ws) {
+        ws.onclose = null;
+        ws.close();
+      }
+      clearInterval(pollId);
+      clearInterval(tickId);
+      if (frame != null) cancelAnimationFrame(frame);
+    };
+  }, [symbol, autoRefresh, refreshRate, apiBaseUrl, historyCap, feed, fetchHist, fetchOlder, fetchDepth, applyDepth, applyPush]);
 
   /* UI for the 2-state toggle */
   const lockTitle = [ 
@@ -1,6 +1,7 @@
 // frontend/src/components/Dashboard.jsx
-import React, { useState, useEffect, useCallback, memo, useRef } from 'react';
+import React, { useState, useEffect, useCallback, useMemo, memo, useRef } from 'react';
 import Bookmap from './Bookmap';
+import { DepthFeed } from '../heatmap/feed';
 import { format, parse } from 'date-fns';
 import { LockIcon } from './LockIcon';
 
@@ -100,6 +101,9 @@ export default function Dashboard({ apiBaseUrl }) {
   const [autoRefresh] = useState(true);
   const [chartLocks, setChartLocks] = useState({});
   const [formExpanded, setFormExpanded] = useState({ 0: true });
+  // Every chart's depth comes from one /ws/depth socket (polling /depth_batch without it), and their history from one /historical_batch
+  const feed = useMemo(() => new DepthFeed(apiBaseUrl), [apiBaseUrl]);
+  useEffect(() => () => feed.close(), [feed]);
   const toggleLock = useCallback((idx) => {
     setChartLocks(prev => {
       const newLocks = { ...prev, [idx]: !prev[idx] };
@@ -304,6 +308,7 @@ export default function Dashboard({ apiBaseUrl }) {
                         autoRefresh={cell.autoRefresh}
                         isLocked={cell.isLocked}
                         onToggleLock={() => toggleLock(idx)}
+                        feed={feed}
                         minimal
                       />
                     </div>
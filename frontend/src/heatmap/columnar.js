@@ -0,0 +1,77 @@
+// Decoder for the binary columnar depth format (application/vnd.depth.columnar, see wire.py)
+
+export const COLUMNAR_TYPE = 'application/vnd.depth.columnar'
+
+const HEADER_BYTES = 32
+const align8 = n => (n + 7) & ~7
+
+/**
+ * Decode a columnar body into heatmap rows.
+ * Each row holds typed-array views ({ prices, amounts }) instead of per-level cell objects;
+ * times are made strictly ascending after lastTime, as for JSON history.
+ */
+export function decodeColumnar(buffer, lastTime = 0) {
+  const view = new DataView(buffer)
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4))
+  if (magic !== 'DPC1') throw new Error(`Unknown depth format ${magic}`)
+
+  const n          = view.getUint32(4, true)
+  const m          = view.getUint32(8, true)
+  const priceScale = view.getUint32(12, true)
+  const symbolLen  = view.getUint32(16, true)
+  const cursor     = view.getFloat64(24, true)
+  const symbol     = new TextDecoder().decode(new Uint8Array(buffer, HEADER_BYTES, symbolLen))
+
+  let offset = HEADER_BYTES + align8(symbolLen)
+  const column = (Type, length) => {
+    const arr = new Type(buffer, offset, length)
+    offset += align8(length * Type.BYTES_PER_ELEMENT)
+    return arr
+  }
+  const timestamps = column(Float64Array, n)
+  const lastPrices = column(Float64Array, n)
+  const lastSizes  = column(Float64Array, n)
+  column(Float64Array, n)                     // underlying_price, unused by the chart
+  const offsets    = column(Uint32Array, n + 1)
+  const ticks      = column(Int32Array, m)
+  const amounts    = column(Float32Array, m)
+
+  // One conversion for every level; rows get subarray views into it
+  const prices = new Float64Array(m)
+  for (let k = 0; k < m; k++) prices[k] = ticks[k] / priceScale
+
+  const rows = []
+  for (let i = 0; i < n; i++) {
+    const from = offsets[i], to = offsets[i + 1]
+    if (from === to) continue
+    // Ensure each timestamp is at least 1 second after the previous
+    let time = Math.floor(timestamps[i] / 1000)
+    if (time <= lastTime) time = lastTime + 1
+    lastTime = time
+    rows.push({
+      time,
+      prices:  prices.subarray(from, to),
+      amounts: amounts.subarray(from, to),
+      lastPrice: Number.isNaN(lastPrices[i]) ? null : lastPrices[i],
+      lastSize:  Number.isNaN(lastSizes[i])  ? null : lastSizes[i],
+    })
+  }
+  return { symbol, cursor: Number.isNaN(cursor) ? null : cursor, rows }
+}
+
+/** Split back-to-back columnar bodies (as /historical_batch sends them) into symbol -> ArrayBuffer */
+export function splitColumnar(buffer) {
+  const view = new DataView(buffer)
+  const bodies = new Map()
+  let start = 0
+  while (start + HEADER_BYTES <= buffer.byteLength) {
+    const n         = view.getUint32(start + 4, true)
+    const m         = view.getUint32(start + 8, true)
+    const symbolLen = view.getUint32(start + 16, true)
+    const symbol    = new TextDecoder().decode(new Uint8Array(buffer, start + HEADER_BYTES, symbolLen))
+    const length = HEADER_BYTES + align8(symbolLen) + 4 * align8(8 * n) + align8(4 * (n + 1)) + 2 * align8(4 * m)
+    bodies.set(symbol, buffer.slice(start, start + length))
+    start += length
+  }
+  return bodies
+}
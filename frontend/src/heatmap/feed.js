@@ -0,0 +1,208 @@
+// One live depth feed for every chart of a Dashboard, over /ws/depth and the batch endpoints
+
+import { COLUMNAR_TYPE, splitColumnar } from './columnar'
+
+/** Fold a /ws/depth snapshot or delta into a book kept as { info, levels } */
+function foldPush(book, m) {
+  const { info, levels } = book
+  if (m.type === 'snapshot') {
+    levels.clear()
+    info.last_price = m.last_price
+    info.last_size = m.last_size
+    info.underlying_price = m.underlying_price
+  } else {
+    if (m.last_price != null) info.last_price = m.last_price
+    if (m.last_size != null) info.last_size = m.last_size
+    if (m.underlying_price != null) info.underlying_price = m.underlying_price
+  }
+  for (const l of m.levels || []) {
+    const key = `${l.side}:${l.price}`
+    if (m.type === 'delta' && !l.quantity) levels.delete(key)
+    else levels.set(key, l)
+  }
+  info.timestamp = Math.max(info.timestamp || 0, m.timestamp || 0)
+}
+
+/**
+ * Live books for every subscribed symbol over one /ws/depth socket, instead of
+ * a socket or poll loop per chart. Pushes are folded into a book per symbol and
+ * handed out once per frame with mode 'merge'; every interval each pushed book
+ * is also handed out with mode 'tick', so a quiet chart can still add a bar.
+ * Without WebSocket support, or once the socket closes, /depth_batch is polled
+ * for all symbols once per interval instead (no mode).
+ * History requests made in the same tick go out as one /historical_batch.
+ */
+export class DepthFeed {
+  constructor(apiBaseUrl, interval = 1000) {
+    this.apiBaseUrl = apiBaseUrl
+    this.interval = interval
+    this._listeners = new Map()   // symbol -> Set of callbacks
+    this._books = new Map()       // symbol -> { info, levels } folded from pushes
+    this._timer = null
+    this._polling = false
+    this._socket = null
+    this._push = typeof WebSocket !== 'undefined'
+    this._dirty = new Set()       // symbols pushed to since the last frame
+    this._frame = null
+    this._pendingHistory = null   // symbol -> { since, waiters }
+  }
+
+  /** Call onDepth(depth, mode) with every update of symbol; returns the unsubscribe function */
+  subscribe(symbol, onDepth) {
+    if (!this._listeners.has(symbol)) {
+      this._listeners.set(symbol, new Set())
+      this._books.set(symbol, { info: {}, levels: new Map() })
+      this._send('subscribe', [symbol])
+    }
+    this._listeners.get(symbol).add(onDepth)
+    if (!this._timer) {
+      this._timer = setInterval(() => this.tick(), this.interval)
+      if (this._push) this._connect()
+      else this.poll()
+    }
+    return () => {
+      const set = this._listeners.get(symbol)
+      set?.delete(onDepth)
+      if (set && !set.size) {
+        this._listeners.delete(symbol)
+        this._books.delete(symbol)
+        this._dirty.delete(symbol)
+        this._send('unsubscribe', [symbol])
+      }
+      if (!this._listeners.size) this.close()
+    }
+  }
+
+  tick() {
+    if (!this._push) {
+      this.poll()
+    } else if (this._socket?.readyState === WebSocket.OPEN) {
+      for (const symbol of this._books.keys()) this._emit(symbol, 'tick')
+    }
+  }
+
+  async poll() {
+    // A slow response skips a tick rather than stacking requests
+    if (this._polling || !this._listeners.size) return
+    this._polling = true
+    try {
+      const symbols = [...this._listeners.keys()].map(encodeURIComponent).join(',')
+      const r = await fetch(`${this.apiBaseUrl}/depth_batch?symbols=${symbols}&_=${Date.now()}`)
+      if (!r.ok) return
+      const { books } = await r.json()
+      for (const [symbol, depth] of Object.entries(books)) {
+        for (const onDepth of this._listeners.get(symbol) || []) onDepth(depth)
+      }
+    } catch (e) {
+      console.error(e)
+    } finally {
+      this._polling = false
+    }
+  }
+
+  _connect() {
+    let ws
+    try {
+      ws = new WebSocket(`${this.apiBaseUrl.replace(/^http/, 'ws')}/ws/depth`)
+    } catch (e) {
+      this._fallBack()
+      return
+    }
+    this._socket = ws
+    ws.onopen = () => {
+      // Symbols subscribed while connecting go in one request
+      if (this._listeners.size) this._send('subscribe', [...this._listeners.keys()])
+    }
+    ws.onmessage = ev => {
+      const m = JSON.parse(ev.data)
+      const book = this._books.get(m.symbol)
+      if (!book || (m.type !== 'snapshot' && m.type !== 'delta')) return
+      foldPush(book, m)
+      // Coalesce bursts of pushes into one update per symbol per frame
+      this._dirty.add(m.symbol)
+      if (this._frame == null) this._frame = requestAnimationFrame(() => this._flushPushes())
+    }
+    ws.onclose = () => {
+      this._socket = null
+      this._fallBack()
+    }
+  }
+
+  _fallBack() {
+    this._push = false
+    if (this._timer) this.poll()
+  }
+
+  _send(action, symbols) {
+    if (this._socket?.readyState === WebSocket.OPEN) {
+      this._socket.send(JSON.stringify({ action, symbols }))
+    }
+  }
+
+  _flushPushes() {
+    this._frame = null
+    for (const symbol of this._dirty) this._emit(symbol, 'merge')
+    this._dirty.clear()
+  }
+
+  _emit(symbol, mode) {
+    const book = this._books.get(symbol)
+    if (!book?.info.timestamp) return
+    const depth = { ...book.info, symbol, levels: [...book.levels.values()] }
+    for (const onDepth of this._listeners.get(symbol) || []) onDepth(depth, mode)
+  }
+
+  /**
+   * symbol's history newer than since, fetched together with other charts':
+   * a columnar body (ArrayBuffer) for decodeColumnar, or /historical_full's JSON
+   */
+  history(symbol, since = null) {
+    if (!this._pendingHistory) {
+      this._pendingHistory = new Map()
+      setTimeout(() => this._flushHistory(), 0)
+    }
+    return new Promise((resolve, reject) => {
+      const entry = this._pendingHistory.get(symbol) || { since, waiters: [] }
+      entry.waiters.push({ resolve, reject })
+      this._pendingHistory.set(symbol, entry)
+    })
+  }
+
+  async _flushHistory() {
+    const pending = this._pendingHistory
+    this._pendingHistory = null
+    const since = {}
+    for (const [symbol, entry] of pending) if (entry.since != null) since[symbol] = entry.since
+    try {
+      const r = await fetch(`${this.apiBaseUrl}/historical_batch`, {
+        method: 'POST',
+        cache: 'no-store',
+        // Prefer the binary columnar bodies, one per symbol back to back
+        headers: { 'Content-Type': 'application/json', Accept: `${COLUMNAR_TYPE}, application/json;q=0.9` },
+        body: JSON.stringify({ symbols: [...pending.keys()], since }),
+      })
+      if (!r.ok) throw new Error(`historical_batch: HTTP ${r.status}`)
+      const histories = (r.headers.get('Content-Type') || '').startsWith(COLUMNAR_TYPE)
+        ? splitColumnar(await r.arrayBuffer())
+        : new Map(Object.entries((await r.json()).histories))
+      for (const [symbol, entry] of pending) entry.waiters.forEach(w => w.resolve(histories.get(symbol)))
+    } catch (e) {
+      for (const entry of pending.values()) entry.waiters.forEach(w => w.reject(e))
+    }
+  }
+
+  close() {
+    clearInterval(this._timer)
+    this._timer = null
+    if (this._socket) {
+      this._socket.onclose = null
+      this._socket.close()
+      this._socket = null
+    }
+    if (this._frame != null) cancelAnimationFrame(this._frame)
+    this._frame = null
+    this._dirty.clear()
+    // The next subscriber tries the socket again
+    this._push = typeof WebSocket !== 'undefined'
+  }
+}
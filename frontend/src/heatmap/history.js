@@ -0,0 +1,93 @@
+// Bounded bar history for the heatmap chart
+
+/**
+ * Heatmap bars, oldest first, in bounded memory.
+ * The newest `capacity` bars live in a ring buffer, so adding a live bar is O(1).
+ * Pages fetched when the user scrolls left are held in front of it, also up to
+ * `capacity` bars. `evicted` counts bars dropped from the front since the chart
+ * was last given the whole history, so the caller knows when to re-send it.
+ */
+export class BarHistory {
+  constructor(capacity) {
+    this.capacity = capacity
+    this.older = []
+    this.evicted = 0
+    this._ring = new Array(capacity)
+    this._start = 0
+    this._size = 0
+  }
+
+  get length() {
+    return this.older.length + this._size
+  }
+
+  /** No room left for older pages */
+  get olderFull() {
+    return this.older.length >= this.capacity
+  }
+
+  first() {
+    return this.older.length ? this.older[0] : this._size ? this._ring[this._start] : undefined
+  }
+
+  last() {
+    return this._size ? this._ring[(this._start + this._size - 1) % this.capacity] : this.older.at(-1)
+  }
+
+  push(bar) {
+    if (this._size < this.capacity) {
+      this._ring[(this._start + this._size++) % this.capacity] = bar
+      return
+    }
+    const out = this._ring[this._start]
+    this._ring[this._start] = bar
+    this._start = (this._start + 1) % this.capacity
+    if (this.older.length) {
+      // Older pages are on screen: keep the bar so the timeline has no hole
+      this.older.push(out)
+      if (this.older.length > this.capacity * 1.1) {
+        const drop = this.older.length - this.capacity
+        this.older = this.older.slice(drop)
+        this.evicted += drop
+      }
+    } else {
+      this.evicted++
+    }
+  }
+
+  replaceLast(bar) {
+    if (!this._size) this.push(bar)
+    else this._ring[(this._start + this._size - 1) % this.capacity] = bar
+  }
+
+  /** Start over from bars (oldest first), keeping the newest capacity of them */
+  reset(bars = []) {
+    this.older = []
+    this._ring = new Array(this.capacity)
+    this._start = 0
+    this._size = 0
+    for (const bar of bars.length > this.capacity ? bars.slice(-this.capacity) : bars) this.push(bar)
+    this.evicted = 0
+  }
+
+  /** Put an older page (oldest first) in front; returns how many bars fitted */
+  prepend(bars) {
+    const room = this.capacity - this.older.length
+    if (room <= 0 || !bars.length) return 0
+    const kept = bars.length > room ? bars.slice(-room) : bars
+    this.older = kept.concat(this.older)
+    return kept.length
+  }
+
+  /** Forget the older pages, e.g. once the user is back at real time */
+  dropOlder() {
+    this.evicted += this.older.length
+    this.older = []
+  }
+
+  toArray() {
+    const out = this.older.slice()
+    for (let i = 0; i < this._size; i++) out.push(this._ring[(this._start + i) % this.capacity])
+    return out
+  }
+}
@@ -9,42 +9,161 @@ const defaultOptions = {
     const alpha = Math.min(Math.abs(a) / 100, 1)
     return a > 0 ? `rgba(76,175,80,${alpha})` : `rgba(244,67,54,${alpha})`
   },
+  // Raster mode: each bar is rasterized once into a pixel column and reused until the
+  // price scale changes; colors come from a lookup table instead of cellShader
+  rasterize: false,
+  bidColor: [76, 175, 80],
+  askColor: [244, 67, 54],
+  maxAmount: 100,          // quantity drawn fully opaque
+  colorSteps: 64,          // opacity buckets per side
+  rasterCacheColumns: 8192,
+}
+
+/** Number of cells in a row, whether it carries cell objects or columnar views */
+const cellCount = r => (r?.cells ? r.cells.length : r?.amounts?.length) || 0
+
+const LITTLE_ENDIAN = new Uint8Array(new Uint32Array([1]).buffer)[0] === 1
+
+/** A color packed the way a Uint32Array view of ImageData holds it */
+const packRGBA = (r, g, b, a) => (LITTLE_ENDIAN
+  ? (a << 24) | (b << 16) | (g << 8) | r
+  : (r << 24) | (g << 16) | (b << 8) | a) >>> 0
+
+/**
+ * Packed colors for quantity buckets 0..colorSteps: bids first, then asks.
+ * Opacity grows with the quantity up to maxAmount, like the default cellShader.
+ */
+const lutKey = o => `${o.bidColor}|${o.askColor}|${o.maxAmount}|${o.colorSteps}`
+
+export function buildColorLut(options) {
+  const { bidColor, askColor, maxAmount, colorSteps } = options
+  const lut = new Uint32Array(2 * (colorSteps + 1))
+  for (let b = 0; b <= colorSteps; b++) {
+    const alpha = Math.round((b / colorSteps) * 255)
+    lut[b] = packRGBA(...bidColor, alpha)
+    lut[colorSteps + 1 + b] = packRGBA(...askColor, alpha)
+  }
+  const scale = colorSteps / maxAmount
+  return {
+    key: lutKey(options),
+    color: amount => {
+      const bucket = Math.min(Math.round(Math.abs(amount) * scale), colorSteps)
+      return lut[amount > 0 ? bucket : colorSteps + 1 + bucket]
+    },
+  }
+}
+
+/** Rasterized bar columns by row, least recently drawn first, until the price scale changes */
+class ColumnCache {
+  columns = new Map()
+  scale = null
+
+  reset(scale) {
+    if (scale !== this.scale) {
+      this.columns.clear()
+      this.scale = scale
+    }
+  }
+
+  get(row) {
+    const column = this.columns.get(row)
+    if (column) {
+      this.columns.delete(row)
+      this.columns.set(row, column)
+    }
+    return column
+  }
+
+  set(row, column, limit) {
+    this.columns.set(row, column)
+    while (this.columns.size > limit) this.columns.delete(this.columns.keys().next().value)
+  }
+}
+
+/** Price and quantity labels beside a bar; each font is set once for all of them */
+function drawLabels(ctx, labels, px) {
+  if (!labels.length) return
+  ctx.textBaseline = 'middle'
+  ctx.textAlign    = 'left'
+  ctx.font         = `${12 * px}px Arial`
+  ctx.fillStyle    = '#fff'
+  const amountX = labels.map(l => {
+    const priceTxt = l.price.toFixed(2)
+    ctx.fillText(priceTxt, l.x, l.y)
+    return l.x + ctx.measureText(priceTxt).width + 4 * px
+  })
+  ctx.font = `bold ${12 * px}px Arial`
+  labels.forEach((l, k) => {
+    ctx.fillStyle = l.amount > 0 ? 'green' : 'red'
+    ctx.fillText(` ${Math.abs(l.amount)}`, amountX[k], l.y)
+  })
+}
+
+/** Yellow last-trade bubble sized by the trade */
+function drawTrade(ctx, cx, yPx, size, px) {
+  const r = Math.sqrt(size) * px * 3
+
+  ctx.beginPath()
+  ctx.arc(cx, yPx, r, 0, Math.PI * 2)
+  ctx.fillStyle    = 'rgba(239,246,105,0.5)'  // 50% opacity
+  ctx.fill()
+
+  ctx.fillStyle    = '#000'
+  ctx.font         = `bold ${11 * px}px Arial`
+  ctx.textAlign    = 'center'
+  ctx.textBaseline = 'middle'
+  ctx.fillText(size.toString(), cx, yPx)
 }
 
 class HeatMapSeriesRenderer {
   _data = null
   _options = null
+  _lut = null
+  _columns = new ColumnCache()
+  _frame = null
 
   update(data, options) {
     this._data = data
     this._options = { ...defaultOptions, ...options }
+    if (lutKey(this._options) !== this._lut?.key) this._lut = buildColorLut(this._options)
   }
 
   draw(target, priceConverter) {
     if (!this._data || !this._options) return
+    if (this._options.rasterize) {
+      this._drawRaster(target, priceConverter)
+      return
+    }
 
     target.useBitmapCoordinateSpace(({ context: ctx, horizontalPixelRatio: px }) => {
       ctx.save()
       const { bars, visibleRange, barSpacing } = this._data
       if (bars && visibleRange) {
         let lastSizeDrawn = null
+        const labels = []
 
         for (let i = visibleRange.from; i < visibleRange.to; i++) {
           const bar = bars[i]
           const o = bar?.originalData
-          if (!o?.cells) continue
+          const count = cellCount(o)
+          if (!count) continue
 
           const fullWidth = fullBarWidth(bar.x, barSpacing / 2, px)
           const gap = this._options.cellBorderWidth * px
 
           // ----- draw heat-map cells -----
-          for (const c of o.cells) {
-            if (!Number.isFinite(c.low) || !Number.isFinite(c.high)) continue
-            const low = priceConverter(c.low)
-            const high = priceConverter(c.high)
+          for (let k = 0; k < count; k++) {
+            // Rows are either { cells } or columnar { prices, amounts } views
+            const cell   = o.cells?.[k]
+            const cLow   = cell ? cell.low : o.prices[k]
+            const cHigh  = cell ? cell.high : o.prices[k] + 0.01
+            const amount = cell ? cell.amount : o.amounts[k]
+            if (!Number.isFinite(cLow) || !Number.isFinite(cHigh)) continue
+            const low = priceConverter(cLow)
+            const high = priceConverter(cHigh)
             const v = positionsBox(low, high, px)
 
-            ctx.fillStyle = this._options.cellShader(c.amount)
+            ctx.fillStyle = this._options.cellShader(amount)
             ctx.fillRect(
               fullWidth.position + gap,
               v.position + gap,
@@ -54,23 +173,12 @@ class HeatMapSeriesRenderer {
 
             // label on rightmost bar
             if (i === visibleRange.to - 1) {
-              ctx.font           = `${12 * px}px Arial`
-              ctx.textBaseline  = 'middle'
-              ctx.textAlign     = 'left'
-              const labelX      = fullWidth.position + fullWidth.length + 4 * px
-              const labelY      = v.position + v.length / 2
-              const priceTxt    = c.low.toFixed(2)
-
-              ctx.fillStyle     = '#fff'
-              ctx.fillText(priceTxt, labelX, labelY)
-
-              ctx.font           = `bold ${12 * px}px Arial`
-              ctx.fillStyle     = c.amount > 0 ? 'green' : 'red'
-              ctx.fillText(
-                ` ${Math.abs(c.amount)}`,
-                labelX + ctx.measureText(priceTxt).width + 4 * px,
-                labelY,
-              )
+              labels.push({
+                price: cLow,
+                amount,
+                x: fullWidth.position + fullWidth.length + 4 * px,
+                y: v.position + v.length / 2,
+              })
             }
           }
 
@@ -81,28 +189,141 @@ class HeatMapSeriesRenderer {
             o.lastSize !== lastSizeDrawn
           ) {
             lastSizeDrawn = o.lastSize
+            drawTrade(ctx, fullWidth.position + fullWidth.length / 2, priceConverter(o.lastPrice) * px, o.lastSize, px)
+          }
+        }
+        drawLabels(ctx, labels, px)
+      }
+      ctx.restore()
+    })
+  }
 
-            const cx  = fullWidth.position + fullWidth.length / 2
-            const yPx = priceConverter(o.lastPrice) * px
-            const r   = Math.sqrt(o.lastSize) * px * 3
+  /**
+   * Raster mode: visible columns are copied from the column cache into one frame
+   * ImageData and drawn with a single drawImage, so a redraw costs one copy per
+   * covered pixel however many cells there are. Only rows not cached yet (a new
+   * or replaced newest bar) are rasterized.
+   */
+  _drawRaster(target, priceConverter) {
+    target.useBitmapCoordinateSpace(({ context: ctx, bitmapSize, horizontalPixelRatio: px, verticalPixelRatio: vpx }) => {
+      const { bars, visibleRange, barSpacing } = this._data
+      if (!bars || !visibleRange) return
+      const y0 = priceConverter(0)
+      const y1 = priceConverter(1)
+      if (y0 == null || y1 == null) return
 
-            ctx.beginPath()
-            ctx.arc(cx, yPx, r, 0, Math.PI * 2)
-            ctx.fillStyle    = 'rgba(239,246,105,0.5)'  // 50% opacity
-            ctx.fill()
+      const { width, height } = bitmapSize
+      // Any change to the price scale moves where prices 0 and 1 land
+      this._columns.reset(`${y0}|${y1}|${vpx}|${height}|${this._lut.key}|${this._options.cellBorderWidth}`)
+      const frame = this._frameBuffer(width, height)
+      const pixels = frame.pixels
+      pixels.fill(0)
 
-            ctx.fillStyle    = '#000'
-            ctx.font         = `bold ${11 * px}px Arial`
-            ctx.textAlign    = 'center'
-            ctx.textBaseline = 'middle'
-            ctx.fillText(o.lastSize.toString(), cx, yPx)
-          }
+      const gap = Math.round(this._options.cellBorderWidth * px)
+      const limit = this._options.rasterCacheColumns
+      let lastSizeDrawn = null
+      const trades = []
+
+      for (let i = visibleRange.from; i < visibleRange.to; i++) {
+        const bar = bars[i]
+        const o = bar?.originalData
+        if (!cellCount(o)) continue
+
+        let column = this._columns.get(o)
+        if (!column) {
+          column = this._rasterizeColumn(o, priceConverter, vpx, height)
+          this._columns.set(o, column, limit)
+        }
+
+        const fullWidth = fullBarWidth(bar.x, barSpacing / 2, px)
+        // Keep at least a pixel of each bar when the gaps would swallow it
+        const inset = fullWidth.length > gap * 2 ? gap : 0
+        const x0 = Math.max(fullWidth.position + inset, 0)
+        const x1 = Math.min(fullWidth.position + fullWidth.length - inset, width)
+        const colPixels = column.pixels
+        for (let j = 0; j < colPixels.length; j++) {
+          const color = colPixels[j]
+          if (!color) continue
+          const rowStart = (column.top + j) * width
+          for (let x = x0; x < x1; x++) pixels[rowStart + x] = color
+        }
+
+        if (Number.isFinite(o.lastSize) && Number.isFinite(o.lastPrice) && o.lastSize !== lastSizeDrawn) {
+          lastSizeDrawn = o.lastSize
+          trades.push([fullWidth.position + fullWidth.length / 2, priceConverter(o.lastPrice) * vpx, o.lastSize])
         }
       }
+
+      frame.context.putImageData(frame.image, 0, 0)
+      ctx.save()
+      ctx.drawImage(frame.canvas, 0, 0)
+      for (const [cx, yPx, size] of trades) drawTrade(ctx, cx, yPx, size, px)
+      drawLabels(ctx, this._rightmostLabels(bars, visibleRange, barSpacing, priceConverter, px, vpx), px)
       ctx.restore()
     })
   }
 
+  /** One bar's cells as a run of packed pixels from its top cell down, gaps left transparent */
+  _rasterizeColumn(o, priceConverter, vpx, height) {
+    const count = cellCount(o)
+    const gap = this._options.cellBorderWidth * vpx
+    const spans = []
+    let top = height, bottom = 0
+    for (let k = 0; k < count; k++) {
+      const cell   = o.cells?.[k]
+      const cLow   = cell ? cell.low : o.prices[k]
+      const cHigh  = cell ? cell.high : o.prices[k] + 0.01
+      const amount = cell ? cell.amount : o.amounts[k]
+      if (!Number.isFinite(cLow) || !Number.isFinite(cHigh)) continue
+      const v = positionsBox(priceConverter(cLow), priceConverter(cHigh), vpx)
+      const from = Math.max(Math.round(v.position + gap), 0)
+      const to = Math.min(Math.round(v.position + v.length - gap), height)
+      if (to <= from) continue
+      spans.push(from, to, this._lut.color(amount))
+      if (from < top) top = from
+      if (to > bottom) bottom = to
+    }
+    const pixels = new Uint32Array(Math.max(bottom - top, 0))
+    for (let s = 0; s < spans.length; s += 3) pixels.fill(spans[s + 2], spans[s] - top, spans[s + 1] - top)
+    return { top, pixels }
+  }
+
+  /** A frame-sized ImageData and the canvas it is put on, reused while the pane size holds */
+  _frameBuffer(width, height) {
+    const f = this._frame
+    if (f && f.image.width === width && f.image.height === height) return f
+    const canvas = typeof OffscreenCanvas !== 'undefined'
+      ? new OffscreenCanvas(width, height)
+      : Object.assign(document.createElement('canvas'), { width, height })
+    const context = canvas.getContext('2d')
+    const image = context.createImageData(width, height)
+    this._frame = { canvas, context, image, pixels: new Uint32Array(image.data.buffer) }
+    return this._frame
+  }
+
+  _rightmostLabels(bars, visibleRange, barSpacing, priceConverter, px, vpx) {
+    const bar = bars[visibleRange.to - 1]
+    const o = bar?.originalData
+    const count = cellCount(o)
+    if (!count) return []
+    const fullWidth = fullBarWidth(bar.x, barSpacing / 2, px)
+    const labels = []
+    for (let k = 0; k < count; k++) {
+      const cell   = o.cells?.[k]
+      const cLow   = cell ? cell.low : o.prices[k]
+      const cHigh  = cell ? cell.high : o.prices[k] + 0.01
+      if (!Number.isFinite(cLow) || !Number.isFinite(cHigh)) continue
+      const v = positionsBox(priceConverter(cLow), priceConverter(cHigh), vpx)
+      labels.push({
+        price: cLow,
+        amount: cell ? cell.amount : o.amounts[k],
+        x: fullWidth.position + fullWidth.length + 4 * px,
+        y: v.position + v.length / 2,
+      })
+    }
+    return labels
+  }
+
   getZOrder() {
     return 'top'
   }
@@ -112,18 +333,25 @@ export class HeatMapSeries {
   _renderer = new HeatMapSeriesRenderer()
 
   priceValueBuilder(r) {
-    if (!r?.cells?.length) return [NaN]
+    if (!cellCount(r)) return [NaN]
     let low  = Infinity, high = -Infinity
-    for (const c of r.cells) {
-      if (c.low < low)  low  = c.low
-      if (c.high > high) high = c.high
+    if (r.cells) {
+      for (const c of r.cells) {
+        if (c.low < low)  low  = c.low
+        if (c.high > high) high = c.high
+      }
+    } else {
+      for (const p of r.prices) {
+        if (p < low)  low  = p
+        if (p + 0.01 > high) high = p + 0.01
+      }
     }
     const mid = low + (high - high + low) / 2
     return [low, high, mid]
   }
 
   isWhitespace(d) {
-    return !d?.cells?.length
+    return !cellCount(d)
   }
 
   renderer() {
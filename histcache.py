@@ -0,0 +1,147 @@
+# histcache.py
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Memory budget for encoded history held by the API
+HISTORY_CACHE_MB = int(os.getenv("HISTORY_CACHE_MB", "256"))
+# Raw history is cached in one-minute chunks; rollups in chunks of 60 buckets
+CHUNK_MS = 60_000
+# A chunk is sealed once the history reaches this far past its end, so late writes still land in it
+SEAL_GRACE_MS = 5_000
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+class JsonChunk:
+    """Consecutive snapshots, each already encoded as JSON text."""
+
+    __slots__ = ("timestamps", "parts", "_nbytes")
+
+    def __init__(self):
+        self.timestamps = []
+        self.parts = []
+        self._nbytes = 0
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, snapshot):
+        """Add a snapshot dict and return its JSON text."""
+        text = _dumps(snapshot)
+        self.timestamps.append(snapshot["timestamp"])
+        self.parts.append(text)
+        self._nbytes += len(text) + 8
+        return text
+
+    def tail(self, index):
+        """A new chunk holding snapshots index.. of this one."""
+        if index <= 0:
+            return self
+        chunk = JsonChunk()
+        chunk.timestamps = self.timestamps[index:]
+        chunk.parts = self.parts[index:]
+        chunk._nbytes = sum(len(p) + 8 for p in chunk.parts)
+        return chunk
+
+    def nbytes(self):
+        return self._nbytes
+
+
+class ChunkBuilder:
+    """Split freshly read snapshots into time-aligned chunks as they are encoded."""
+
+    def __init__(self, make_chunk, span_ms):
+        self.make_chunk = make_chunk
+        self.span_ms = span_ms
+        self.chunks = []     # [(chunk start ms, chunk)]
+
+    def append(self, snapshot):
+        """Add a snapshot to its chunk; returns whatever the chunk's append returns."""
+        ts = snapshot["timestamp"]
+        start = ts - ts % self.span_ms
+        if not self.chunks or start > self.chunks[-1][0]:
+            self.chunks.append((start, self.make_chunk()))
+        return self.chunks[-1][1].append(snapshot)
+
+    def sealable(self, grace_ms=SEAL_GRACE_MS):
+        """Chunks that ended at least grace_ms before the newest snapshot seen."""
+        if not self.chunks:
+            return []
+        newest = self.chunks[-1][1].timestamps[-1]
+        return [(start, chunk) for start, chunk in self.chunks if start + self.span_ms + grace_ms <= newest]
+
+
+class HistoryCache:
+    """LRU cache of sealed, encoded history chunks per (day file, symbol, resolution, format).
+
+    A request reuses the sealed chunks and only reads what came after them from
+    SQLite; complete chunks from that read are sealed in for the next request.
+    Whole entries are evicted, least recently used first, to stay under max_bytes.
+    """
+
+    def __init__(self, max_bytes=HISTORY_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> [(chunk start, chunk)]
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0, "hits": 0, "misses": 0,
+            "cached_snapshots": 0, "queried_snapshots": 0,
+            "sealed_chunks": 0, "evictions": 0,
+        }
+
+    def get(self, key):
+        """Sealed chunks for key, oldest first (an empty list on a miss)."""
+        with self._lock:
+            self.stats["requests"] += 1
+            chunks = self._entries.get(key)
+            if not chunks:
+                self.stats["misses"] += 1
+                return []
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return list(chunks)
+
+    def seal(self, key, chunks, after):
+        """Append sealed chunks to key's entry if it still ends at timestamp `after`."""
+        if not chunks or self.max_bytes <= 0:
+            # HISTORY_CACHE_MB=0 turns the cache off
+            return
+        with self._lock:
+            entry = self._entries.get(key, [])
+            last = entry[-1][1].timestamps[-1] if entry else None
+            if last != after:
+                # Another request sealed these chunks first
+                return
+            size = sum(chunk.nbytes() for _, chunk in chunks)
+            entry.extend(chunks)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._sizes[key] = self._sizes.get(key, 0) + size
+            self._bytes += size
+            self.stats["sealed_chunks"] += len(chunks)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                evicted, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(evicted)
+                self.stats["evictions"] += 1
+
+    def count(self, cached, queried):
+        """Record how many snapshots a request took from the cache and from SQLite."""
+        with self._lock:
+            self.stats["cached_snapshots"] += cached
+            self.stats["queried_snapshots"] += queried
+
+    def get_stats(self):
+        with self._lock:
+            served = self.stats["cached_snapshots"] + self.stats["queried_snapshots"]
+            return {
+                **self.stats,
+                "hit_ratio": round(self.stats["hits"] / self.stats["requests"], 4) if self.stats["requests"] else None,
+                "snapshot_hit_ratio": round(self.stats["cached_snapshots"] / served, 4) if served else None,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,171 @@
+# livebook.py
+import threading
+
+
+class LiveBook:
+    """Latest bid/ask ladders and level-one fields for one symbol."""
+
+    __slots__ = ("symbol", "timestamp", "bids", "asks", "levels",
+                 "last_price", "last_size", "underlying_price", "live", "seq")
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.timestamp = None
+        self.bids = []      # [(price, quantity)] best (highest) first
+        self.asks = []      # [(price, quantity)] best (lowest) first
+        self.levels = []    # pre-built response levels, bids then asks
+        self.last_price = None
+        self.last_size = None
+        self.underlying_price = None
+        # False while the book only holds what was loaded from SQLite
+        self.live = False
+        # Count of stream updates applied, stamped on push messages to order them against snapshots
+        self.seq = 0
+
+    def _rebuild_levels(self):
+        # Same order as the old SQL: ORDER BY CASE WHEN side = 'ASK' THEN price ELSE -price END
+        self.levels = (
+            [{"price": p, "quantity": q, "side": "BID"} for p, q in self.bids] +
+            [{"price": p, "quantity": q, "side": "ASK"} for p, q in self.asks]
+        )
+
+    def snapshot(self):
+        return {
+            "symbol": self.symbol,
+            "timestamp": self.timestamp,
+            "levels": self.levels,
+            "last_price": self.last_price,
+            "last_size": self.last_size,
+            "underlying_price": self.underlying_price,
+        }
+
+
+def diff_ladder(old, new, side, removed=0):
+    """Levels added or changed between two ladders; removed levels come back with quantity `removed`."""
+    old_map = dict(old)
+    new_map = dict(new)
+    changes = [
+        {"price": p, "quantity": q, "side": side}
+        for p, q in new if old_map.get(p) != q
+    ]
+    changes.extend(
+        {"price": p, "quantity": removed, "side": side}
+        for p, _ in old if p not in new_map
+    )
+    return changes
+
+
+class BookCache:
+    """Thread-safe registry of LiveBooks keyed by symbol."""
+
+    def __init__(self):
+        self._books = {}
+        self._lock = threading.Lock()
+
+    def _book(self, symbol):
+        book = self._books.get(symbol)
+        if book is None:
+            book = self._books[symbol] = LiveBook(symbol)
+        return book
+
+    def apply_book(self, symbol, timestamp, bids=None, asks=None, removed=0):
+        """Replace the sides present in an OPTIONS_BOOK update. Returns the changed levels.
+
+        Removed levels are returned with quantity `removed` (0 for push clients).
+        """
+        with self._lock:
+            book = self._book(symbol)
+            changes = []
+            if bids is not None:
+                bids = sorted(bids, key=lambda level: -level[0])
+                changes.extend(diff_ladder(book.bids, bids, "BID", removed))
+                book.bids = bids
+            if asks is not None:
+                asks = sorted(asks, key=lambda level: level[0])
+                changes.extend(diff_ladder(book.asks, asks, "ASK", removed))
+                book.asks = asks
+            book.timestamp = timestamp
+            book.live = True
+            book.seq += 1
+            book._rebuild_levels()
+            return changes
+
+    def apply_level_one(self, symbol, timestamp, last_price=None, last_size=None, underlying_price=None):
+        """Merge a LEVELONE_OPTIONS update; fields missing from the update keep their last value.
+
+        Returns the book.
+        """
+        with self._lock:
+            book = self._book(symbol)
+            if last_price is not None:
+                book.last_price = last_price
+            if last_size is not None:
+                book.last_size = last_size
+            if underlying_price is not None:
+                book.underlying_price = underlying_price
+            if book.timestamp is None:
+                book.timestamp = timestamp
+            book.seq += 1
+            return book
+
+    def load(self, snapshot):
+        """Seed a cold book from a SQLite snapshot unless the stream already got there first."""
+        with self._lock:
+            book = self._book(snapshot["symbol"])
+            if book.live and book.timestamp is not None and book.timestamp >= snapshot["timestamp"]:
+                return book
+            book.bids = [(l["price"], l["quantity"]) for l in snapshot["levels"] if l["side"] == "BID"]
+            book.asks = [(l["price"], l["quantity"]) for l in snapshot["levels"] if l["side"] == "ASK"]
+            book.timestamp = snapshot["timestamp"]
+            for field in ("last_price", "last_size", "underlying_price"):
+                if getattr(book, field) is None:
+                    setattr(book, field, snapshot.get(field))
+            book._rebuild_levels()
+            return book
+
+    def get(self, symbol):
+        """Return a snapshot dict for symbol, or None if the book is cold."""
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None or book.timestamp is None or not (book.live or book.levels):
+                return None
+            return book.snapshot()
+
+    def versioned(self, symbol):
+        """(snapshot, seq) of symbol read together, or None if the book is cold."""
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None or book.timestamp is None or not (book.live or book.levels):
+                return None
+            return book.snapshot(), book.seq
+
+    def symbols(self):
+        with self._lock:
+            return list(self._books)
+
+    def apply_event(self, event):
+        """Apply an event tuple published by the stream process.
+
+        Returns a compact update message (changed levels only) for push clients,
+        or None if the event was not recognised. Its seq is the book's seq once
+        the update is applied, as versioned() reports it.
+        """
+        kind = event[0]
+        if kind == "book":
+            _, symbol, timestamp, bids, asks = event
+            changes = self.apply_book(symbol, timestamp, bids, asks)
+            return {"type": "delta", "symbol": symbol, "timestamp": timestamp, "levels": changes,
+                    "seq": self._seq(symbol)}
+        if kind == "level_one":
+            _, symbol, timestamp, last_price, last_size, underlying_price = event
+            self.apply_level_one(symbol, timestamp, last_price, last_size, underlying_price)
+            return {
+                "type": "delta", "symbol": symbol, "timestamp": timestamp, "levels": [],
+                "last_price": last_price, "last_size": last_size, "underlying_price": underlying_price,
+                "seq": self._seq(symbol),
+            }
+        return None
+
+    def _seq(self, symbol):
+        with self._lock:
+            return self._books[symbol].seq
@@ -0,0 +1,62 @@
+# logs.py
+import logging
+import os
+import threading
+import time
+
+# DEBUG shows every parsed stream message
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Records one call site may emit per LOG_RATE_SECONDS; the rest are dropped and counted
+LOG_RATE = int(os.getenv("LOG_RATE", "20"))
+LOG_RATE_SECONDS = float(os.getenv("LOG_RATE_SECONDS", "10"))
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most `rate` records per call site every `per` seconds.
+
+    The first record of the next window reports how many were suppressed.
+    """
+
+    def __init__(self, rate=LOG_RATE, per=LOG_RATE_SECONDS):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self._windows = {}   # (pathname, lineno) -> [window start, emitted, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.per:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.rate:
+                window[1] += 1
+                return True
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+        return True
+
+
+def get_logger(name):
+    """A logger under the shared, rate-limited handler configured from LOG_LEVEL."""
+    global _configured
+    with _configure_lock:
+        if not _configured:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)s: %(message)s"))
+            handler.addFilter(RateLimitFilter())
+            root = logging.getLogger("depth")
+            root.addHandler(handler)
+            root.setLevel(LOG_LEVEL)
+            root.propagate = False
+            _configured = True
+    return logging.getLogger(f"depth.{name}")
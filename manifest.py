@@ -0,0 +1,189 @@
+# manifest.py
+"""Index of the day files in the data directory: which symbols each one holds and when.
+
+    python manifest.py [data_dir]     rebuild the index from every day file
+
+The index is a JSON file (data/manifest.json) so the API can pick the files
+a time range needs without listing the directory or opening every file:
+
+    {"files": {"options_data_250423.db": {
+        "date": "250423", "start": ms, "end": ms, "live": false,
+        "symbols": {"SPY   250423C00500000": [first ms, last ms], ...},
+        "size": bytes, "mtime": seconds}}}
+
+The stream keeps the entry of the file it is writing up to date ("live": true)
+and finalizes it at rollover; compact.py re-indexes the files it rewrites.
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+import storage
+from logs import get_logger
+
+log = get_logger("manifest")
+
+MANIFEST_NAME = "manifest.json"
+DAY_FILE_PREFIX = "options_data_"
+
+
+def day_file_name(date):
+    """options_data_YYMMDD.db for a YYMMDD date string."""
+    return f"{DAY_FILE_PREFIX}{date}.db"
+
+
+def is_day_file(name):
+    return name.startswith(DAY_FILE_PREFIX) and name.endswith(".db")
+
+
+def session_date(now=None):
+    """YYMMDD of the recording session a moment belongs to (the local calendar day)."""
+    return (now or datetime.now()).strftime('%y%m%d')
+
+
+def summarize_day_file(path, live=False):
+    """Manifest entry for one day file, read through a read-only connection."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        ranges = storage.symbol_time_ranges(conn)
+    finally:
+        conn.close()
+    return make_entry(path, ranges, live)
+
+
+def make_entry(path, ranges, live=False):
+    """Manifest entry from {symbol: (first, last)} time ranges."""
+    name = os.path.basename(path)
+    stat = os.stat(path)
+    return {
+        "date": name[len(DAY_FILE_PREFIX):-len(".db")],
+        "start": min((r[0] for r in ranges.values()), default=None),
+        "end": max((r[1] for r in ranges.values()), default=None),
+        "live": live,
+        "symbols": {symbol: list(r) for symbol, r in sorted(ranges.items())},
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+    }
+
+
+class DayManifest:
+    """Load, query and update the day-file index of data_dir.
+
+    Readers call files_for()/symbols(); the file is re-read only when its
+    mtime changes. Writers replace it atomically, so a reader never sees a
+    half-written index.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._files = {}
+        self._mtime = None
+
+    def load(self):
+        """{file name: entry}, reloaded if the manifest changed on disk."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime:
+                files = {}
+                if mtime is not None:
+                    try:
+                        with open(self.path) as f:
+                            files = json.load(f).get("files", {})
+                    except (OSError, ValueError) as e:
+                        log.error("Could not read %s: %s", self.path, e)
+                self._files = files
+                self._mtime = mtime
+            return self._files
+
+    def _save(self, files):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"files": files}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def update(self, entries, removed=()):
+        """Add or replace {file name: entry} and drop removed names, then save."""
+        files = dict(self.load())
+        files.update(entries)
+        for name in removed:
+            files.pop(name, None)
+        self._save(files)
+        with self._lock:
+            self._files = files
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+    def index(self, path, live=False):
+        """Re-index one day file."""
+        self.update({os.path.basename(path): summarize_day_file(path, live)})
+
+    def refresh(self, skip=()):
+        """Index day files that are new or changed since they were indexed; forget deleted ones.
+
+        This is the only place the directory is listed. Names in skip (the
+        file being recorded) are left to their owner.
+        """
+        files = self.load()
+        names = [n for n in os.listdir(self.data_dir) if is_day_file(n)] if os.path.isdir(self.data_dir) else []
+        entries = {}
+        for name in names:
+            if name in skip:
+                continue
+            path = os.path.join(self.data_dir, name)
+            entry = files.get(name)
+            stat = os.stat(path)
+            if entry is None or entry.get("live") or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                try:
+                    entries[name] = summarize_day_file(path)
+                except sqlite3.Error as e:
+                    log.error("Could not index %s: %s", path, e)
+        removed = [name for name in files if name not in names]
+        if entries or removed:
+            self.update(entries, removed)
+            log.info("Indexed %d day files, dropped %d", len(entries), len(removed))
+        return self.load()
+
+    def files_for(self, symbol=None, start=None, end=None):
+        """Paths of the day files holding symbol (any symbol if None) within [start, end] ms, oldest first.
+
+        A live file always qualifies: its entry lags what is being written.
+        """
+        paths = []
+        for name, entry in sorted(self.load().items(), key=lambda item: item[1]["date"]):
+            if not entry.get("live"):
+                span = entry["symbols"].get(symbol) if symbol is not None else (entry["start"], entry["end"])
+                if not span or span[0] is None:
+                    continue
+                if (start is not None and span[1] < start) or (end is not None and span[0] > end):
+                    continue
+            paths.append(os.path.join(self.data_dir, name))
+        return paths
+
+    def symbols(self, start=None, end=None):
+        """Sorted symbols recorded within [start, end] ms across all day files."""
+        found = set()
+        for entry in self.load().values():
+            for symbol, (first, last) in entry["symbols"].items():
+                if (start is None or entry.get("live") or last >= start) and (end is None or first <= end):
+                    found.add(symbol)
+        return sorted(found)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    data_dir = argv[0] if argv else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    manifest = DayManifest(data_dir)
+    files = manifest.refresh()
+    for name, entry in sorted(files.items()):
+        print(f"{name}: {len(entry['symbols'])} symbols, {entry['start']} - {entry['end']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
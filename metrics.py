@@ -0,0 +1,175 @@
+# metrics.py
+"""Counters, gauges and histograms rendered in the Prometheus text format.
+
+Each process keeps its own Registry; the stream processes send their
+rendered text to the API, which merges it with its own on /metrics.
+"""
+import bisect
+import threading
+
+# Seconds; suits both the per-message handler (~100 us) and history requests (~1 s)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values.
+
+    collect, if given, is called at render time and returns the current value
+    (or {label values tuple: value}) instead of values being recorded.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        if self.collect is not None:
+            value = self.collect()
+            if value is None:
+                return []
+            values = value if isinstance(value, dict) else {(): value}
+            return [(self.name, key, "", v) for key, v in values.items()]
+        with self._lock:
+            return [(self.name, key, "", value) for key, value in self._values.items()]
+
+    def render(self, const=""):
+        """Text format; const is a rendered label list added to every sample."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self.samples():
+            extra = ",".join(part for part in (const, extra) if part)
+            lines.append(f"{name}{_format_labels(self.labels, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels, collect)
+        if not self.labels:
+            # An unlabelled counter is exported from the start, so rate() sees its first increment
+            self._values[()] = 0
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            states = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, counts, total, count in states:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                samples.append((self.name + "_bucket", key, f'le="{_format_value(float(bound))}"', cumulative))
+            samples.append((self.name + "_sum", key, "", total))
+            samples.append((self.name + "_count", key, "", count))
+        return samples
+
+
+class Registry:
+    """The metrics of one process, rendered together.
+
+    labels ({name: value}) are added to every sample, e.g. to tell apart
+    processes exporting the same metrics.
+    """
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), collect=None):
+        return self.register(Counter(name, help, labels, collect))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        const = _format_labels(self.labels, self.labels.values())[1:-1]
+        return "\n".join(metric.render(const) for metric in metrics) + "\n"
+
+
+def merge(texts):
+    """Join rendered registries into one exposition, each family's samples under one HELP/TYPE header.
+
+    The text format allows a family only once, so processes exporting the
+    same metrics (with different labels) can't simply be concatenated.
+    """
+    families = {}
+    current = None
+    for text in texts:
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split(" ", 3)[2]
+                current = families.setdefault(name, [])
+                if not current:
+                    current.append(line)
+            elif line.startswith("# TYPE "):
+                if len(current) == 1:
+                    current.append(line)
+            elif line and current is not None:
+                current.append(line)
+    return "".join("\n".join(lines) + "\n" for lines in families.values())
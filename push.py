@@ -0,0 +1,101 @@
+# push.py
+import asyncio
+import threading
+
+
+class Subscriber:
+    """One push client: the symbols it watches and its outbound message queue."""
+
+    def __init__(self, loop, max_pending=1000):
+        self.loop = loop
+        self.symbols = set()
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        # Symbols whose deltas were dropped; the client is re-sent a snapshot instead
+        self.resync = set()
+        # symbol -> seq of the last snapshot sent, when it came from the live book
+        self.snapshot_seq = {}
+
+    def offer(self, message):
+        """Runs on the event loop. Drops the delta and flags a resync when the client lags."""
+        symbol = message.get("symbol")
+        if symbol in self.resync:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.resync.add(symbol)
+
+    def request_snapshot(self, symbol):
+        """Runs on the event loop. Have the sender send symbol's snapshot before any more of its deltas."""
+        self.resync.add(symbol)
+        try:
+            # Wakes the sender; when the queue is full it takes the resync with the next message anyway
+            self.queue.put_nowait({"type": "resync"})
+        except asyncio.QueueFull:
+            pass
+
+    def snapshot_sent(self, symbol, seq):
+        """Record the seq of the snapshot just sent (None for one read from SQLite)."""
+        if seq is None:
+            self.snapshot_seq.pop(symbol, None)
+        else:
+            self.snapshot_seq[symbol] = seq
+
+    def wanted(self, message):
+        """False for messages of symbols no longer watched, and deltas the last snapshot already holds."""
+        symbol = message.get("symbol")
+        if symbol not in self.symbols:
+            return False
+        seq = self.snapshot_seq.get(symbol)
+        return seq is None or message.get("seq") is None or message["seq"] > seq
+
+    def take_resync(self):
+        """Return symbols needing a fresh snapshot and purge their queued (now stale) deltas."""
+        symbols, self.resync = self.resync, set()
+        if symbols:
+            kept = []
+            while not self.queue.empty():
+                message = self.queue.get_nowait()
+                if message.get("symbol") not in symbols:
+                    kept.append(message)
+            for message in kept:
+                self.queue.put_nowait(message)
+        return symbols
+
+
+class DepthHub:
+    """Fan live book updates out to WebSocket subscribers.
+
+    publish() may be called from any thread (the book feed thread in practice);
+    delivery is marshalled onto each subscriber's event loop.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.stats = {"published": 0, "delivered": 0}
+
+    def add(self, subscriber):
+        with self._lock:
+            self._subscribers.add(subscriber)
+
+    def remove(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, message):
+        symbol = message.get("symbol")
+        with self._lock:
+            targets = [s for s in self._subscribers if symbol in s.symbols]
+        self.stats["published"] += 1
+        for subscriber in targets:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, message)
+                self.stats["delivered"] += 1
+            except RuntimeError:
+                # Loop already closed; the socket handler will remove it
+                pass
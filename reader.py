@@ -0,0 +1,160 @@
+# reader.py
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from logs import get_logger
+
+log = get_logger("reader")
+
+# Read connections map the file and keep a private page cache
+READ_WORKERS = int(os.getenv("READ_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+READ_MMAP_BYTES = int(os.getenv("READ_MMAP_BYTES", str(256 * 1024 * 1024)))
+READ_CACHE_KIB = int(os.getenv("READ_CACHE_KIB", str(32 * 1024)))
+
+
+class ReadConnection(sqlite3.Connection):
+    """sqlite3 connection that remembers which day file it reads."""
+
+    path = None
+
+
+class ReadEngine:
+    """Pooled read-only connections to the current day file, queried off the event loop.
+
+    The day file is resolved once and kept until the date changes; while today's
+    file does not exist yet, the newest one is used and today's is looked for
+    again every recheck_seconds. Connections are opened read-only, so under WAL
+    they never block the stream's writer. Other day files (for cross-day
+    queries) get a connection per use. Engines of several data directories
+    (shards) can share one executor.
+    """
+
+    def __init__(self, data_dir, workers=READ_WORKERS, mmap_bytes=READ_MMAP_BYTES,
+                 cache_kib=READ_CACHE_KIB, recheck_seconds=5, manifest=None, executor=None):
+        self.data_dir = data_dir
+        # A manifest.DayManifest spares the directory listing when today's file is missing
+        self.manifest = manifest
+        self.workers = workers
+        self.mmap_bytes = mmap_bytes
+        self.cache_kib = cache_kib
+        self.recheck_seconds = recheck_seconds
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-read")
+
+        self._lock = threading.Lock()
+        self._idle = []          # connections to the current day file
+        self._path = None
+        self._date = None
+        self._checked_at = 0.0
+        self.stats = {"opened": 0, "reused": 0, "closed": 0, "day_file_lookups": 0}
+
+    def _resolve(self, today):
+        """Today's file if it exists, otherwise the most recent one."""
+        self.stats["day_file_lookups"] += 1
+        db_filename = os.path.join(self.data_dir, f'options_data_{today}.db')
+        if os.path.exists(db_filename):
+            return db_filename
+
+        if self.manifest is not None:
+            names = sorted(self.manifest.load(), reverse=True)
+            for name in names:
+                path = os.path.join(self.data_dir, name)
+                if os.path.exists(path):
+                    return path
+
+        if not os.path.exists(self.data_dir):
+            raise FileNotFoundError(f"Data directory {self.data_dir} does not exist")
+        db_files = [f for f in os.listdir(self.data_dir) if f.startswith('options_data_') and f.endswith('.db')]
+        if not db_files:
+            raise FileNotFoundError(f"No database files found in {self.data_dir}")
+        # Sort by date (files are named options_data_YYMMDD.db)
+        db_files.sort(reverse=True)
+        return os.path.join(self.data_dir, db_files[0])
+
+    def day_file(self):
+        """Path of the day file to read, re-resolved only on date rollover (or while today's is missing)."""
+        today = datetime.now().strftime('%y%m%d')
+        now = time.monotonic()
+        with self._lock:
+            current = self._path is not None and self._date == today
+            if current and (self._path.endswith(f'_{today}.db') or now - self._checked_at < self.recheck_seconds):
+                return self._path
+
+        path = self._resolve(today)
+        with self._lock:
+            if path != self._path:
+                if self._path is not None:
+                    log.info("Reading from %s", path)
+                stale, self._idle = self._idle, []
+                self._path = path
+            else:
+                stale = []
+            self._date = today
+            self._checked_at = now
+        for conn in stale:
+            self._close(conn)
+        return path
+
+    def _open(self, path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, factory=ReadConnection)
+        conn.path = path
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_bytes}")
+        conn.execute(f"PRAGMA cache_size = -{self.cache_kib}")
+        self.stats["opened"] += 1
+        return conn
+
+    def _close(self, conn):
+        conn.close()
+        self.stats["closed"] += 1
+
+    def acquire(self, path=None):
+        """Check out a read connection to the current day file (or path). Pair with release()."""
+        current = self.day_file()
+        if path is not None and path != current:
+            return self._open(path)
+        with self._lock:
+            if self._idle:
+                self.stats["reused"] += 1
+                return self._idle.pop()
+        return self._open(current)
+
+    def release(self, conn, reuse=True):
+        """Return a connection to the pool.
+
+        Pass reuse=False when a query may have been left half-read: an open
+        statement would pin its WAL snapshot and keep the writer from checkpointing.
+        """
+        with self._lock:
+            if reuse and conn.path == self._path and len(self._idle) < self.workers:
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    def _call(self, fn, args):
+        conn = self.acquire()
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            self.release(conn, reuse=False)
+            raise
+        self.release(conn)
+        return result
+
+    async def run(self, fn, *args):
+        """Run fn(conn, *args) on a pooled connection in the read thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, fn, args)
+
+    async def call(self, fn, *args):
+        """Run fn(*args) in the read thread pool; fn manages its own connection."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
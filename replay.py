@@ -0,0 +1,266 @@
+# replay.py
+"""Capture the raw stream to a compressed log, and replay captured or synthetic feeds offline.
+
+    python replay.py capture.log.gz [--speed 10]
+    python replay.py --synthetic 50 --seconds 60 --rate 200 [--speed 0] [--shards 4]
+
+Messages go through stream.my_handler and the batch writer exactly as a live
+feed would, into a separate data directory (--data-dir, default data_replay).
+--speed 1 is real time, N is N times faster, 0 (the default) is as fast as
+possible. Messages/s and rows/s are reported once everything is committed.
+
+With --shards N the feed goes through stream.route_message to N recording
+processes, as with STREAM_SHARDS=N. The CPU time of every process is
+reported too: the busiest one bounds throughput once each has a core.
+
+Capture a live session by starting the stream with STREAM_CAPTURE=<path>.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import threading
+import time
+
+
+class CaptureLog:
+    """Append raw stream messages, with their receive time, to a gzip log.
+
+    One line per message: "<receive ms>\\t<message>".
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.messages = 0
+
+    def write(self, message):
+        line = f"{int(time.time() * 1000)}\t{message.replace(chr(10), ' ')}\n"
+        with self._lock:
+            self._file.write(line)
+            self.messages += 1
+
+    def wrap(self, handler):
+        """A stream handler that captures each message and then passes it on."""
+        def capture(message, *args, **kwargs):
+            self.write(message)
+            return handler(message, *args, **kwargs)
+        return capture
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """Yield (receive ms, raw message) from a capture log."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            received, _, message = line.rstrip("\n").partition("\t")
+            yield int(received), message
+
+
+def synthetic_messages(symbols, seconds, rate, levels=10, seed=1, start=None):
+    """Yield (ms, raw message) for a made-up OPTIONS_BOOK/LEVELONE_OPTIONS feed.
+
+    rate messages per second are spread over the symbols; every message carries
+    one book update (a few levels changed) and, one time in five, a trade.
+    """
+    rng = random.Random(seed)
+    names = [f"SPY   250423C00{500 + i:03d}000" for i in range(symbols)]
+    books = {}
+    for i, name in enumerate(names):
+        mid = 1.0 + i * 0.05
+        books[name] = (
+            {round(mid - k * 0.01, 2): rng.randint(1, 100) for k in range(levels)},
+            {round(mid + 0.01 + k * 0.01, 2): rng.randint(1, 100) for k in range(levels)},
+        )
+
+    def side(levels_by_price, reverse):
+        return [
+            {"0": price, "1": quantity, "2": 1, "3": [{"0": "NSDQ", "1": quantity, "2": 0}]}
+            for price, quantity in sorted(levels_by_price.items(), reverse=reverse)
+        ]
+
+    now = int(time.time() * 1000) if start is None else start
+    for n in range(int(seconds * rate)):
+        ts = now + int(n * 1000 / rate)
+        symbol = names[n % symbols]
+        bids, asks = books[symbol]
+        for _ in range(rng.randint(1, 3)):
+            levels_by_price = bids if rng.random() < 0.5 else asks
+            levels_by_price[rng.choice(list(levels_by_price))] = rng.randint(0, 100)
+        data = [{
+            "service": "OPTIONS_BOOK", "timestamp": ts, "command": "SUBS",
+            "content": [{"key": symbol, "1": ts, "2": side(bids, True), "3": side(asks, False)}],
+        }]
+        if rng.random() < 0.2:
+            data.append({
+                "service": "LEVELONE_OPTIONS", "timestamp": ts, "command": "SUBS",
+                "content": [{"key": symbol, "4": max(bids), "18": rng.randint(1, 10), "35": 500.0}],
+            })
+        yield ts, json.dumps({"data": data})
+
+
+def timed(messages, totals):
+    """Yield from messages, adding the CPU seconds spent reading or generating them to totals["feed"]."""
+    messages = iter(messages)
+    while True:
+        started = time.thread_time()
+        item = next(messages, None)
+        totals["feed"] += time.thread_time() - started
+        if item is None:
+            return
+        yield item
+
+
+def replay(messages, handler, speed=0, on_tick=None):
+    """Feed (ms, raw message) pairs to handler, paced by their timestamps / speed (0 = no pacing).
+
+    on_tick(ms) is called about once per second of feed time. Returns the
+    message count and the seconds spent inside handler.
+    """
+    count = 0
+    handler_seconds = 0.0
+    first_ts = None
+    started = time.perf_counter()
+    next_tick = None
+    for ts, message in messages:
+        if first_ts is None:
+            first_ts = next_tick = ts
+        if speed > 0:
+            delay = (ts - first_ts) / 1000 / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        t = time.perf_counter()
+        handler(message)
+        handler_seconds += time.perf_counter() - t
+        count += 1
+        if on_tick is not None and ts >= next_tick + 1000:
+            on_tick(ts)
+            next_tick = ts
+    return count, handler_seconds
+
+
+def record_shard(shard, shards, messages, results):
+    """Shard worker process: run stream.record_shard, then report its writer stats and CPU time."""
+    import stream
+    started = time.process_time()
+    stream.record_shard(shard, shards, messages)
+    results.put({**stream.writer.get_stats(), "shard": shard, "cpu_seconds": time.process_time() - started})
+
+
+def replay_sharded(stream, messages, shards, speed):
+    """Replay through stream.route_message to shard worker processes.
+
+    Returns replay()'s counts, the CPU seconds spent routing (reading or
+    generating the feed left out) and each worker's stats.
+    """
+    import multiprocessing
+    from shards import SHARD_QUEUE_SIZE
+
+    queues = [multiprocessing.Queue(maxsize=SHARD_QUEUE_SIZE) for _ in range(shards)]
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=record_shard, args=(shard, shards, q, results))
+               for shard, q in enumerate(queues)]
+    for worker in workers:
+        worker.start()
+    # What main() sets up when given shard queues
+    stream.shard_queues = queues
+    routing_cpu = 0.0
+
+    def route(message):
+        nonlocal routing_cpu
+        started = time.thread_time()
+        stream.route_message(message)
+        routing_cpu += time.thread_time() - started
+
+    count, handler_seconds = replay(messages, route, speed)
+    for q in queues:
+        q.put(None)
+    stats = sorted((results.get() for _ in workers), key=lambda s: s["shard"])
+    for worker in workers:
+        worker.join()
+    return count, handler_seconds, routing_cpu, stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a captured or synthetic feed through stream.my_handler")
+    parser.add_argument("capture", nargs="?", help="capture log written with STREAM_CAPTURE")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="generate a feed for N symbols instead")
+    parser.add_argument("--seconds", type=float, default=60, help="synthetic feed length in feed seconds")
+    parser.add_argument("--rate", type=float, default=200, help="synthetic messages per feed second")
+    parser.add_argument("--levels", type=int, default=10, help="synthetic levels per book side")
+    parser.add_argument("--speed", type=float, default=0, help="1 = real time, N = N times faster, 0 = as fast as possible")
+    parser.add_argument("--data-dir", default="data_replay", help="where the replayed day file is written")
+    parser.add_argument("--shards", type=int, default=1, help="record in N processes, symbols hash-partitioned")
+    parser.add_argument("--verbose", action="store_true", help="log every message (LOG_LEVEL=DEBUG)")
+    args = parser.parse_args(argv)
+    if not args.capture and not args.synthetic:
+        parser.error("give a capture log or --synthetic N")
+
+    # The stream module reads these at import: no Schwab client, and a scratch data directory
+    os.environ["STREAM_OFFLINE"] = "1"
+    os.environ["DATA_DIR"] = os.path.abspath(args.data_dir)
+    if args.verbose:
+        os.environ["LOG_LEVEL"] = "DEBUG"
+    # Replaying as fast as possible should wait for a busy shard, not drop its messages
+    os.environ.setdefault("SHARD_PUT_TIMEOUT", "600")
+    import stream
+
+    if args.capture:
+        messages = read_capture(args.capture)
+        source = args.capture
+    else:
+        messages = synthetic_messages(args.synthetic, args.seconds, args.rate, args.levels)
+        source = f"synthetic feed, {args.synthetic} symbols x {args.rate:g} msg/s for {args.seconds:g}s"
+
+    def flush_rollups(ts):
+        stream.flush_rollups(before=ts - 1000)
+
+    # CPU spent on the feed itself is left out of the recording CPU reported
+    feed_cpu = {"feed": 0.0}
+    messages = timed(messages, feed_cpu)
+
+    if args.shards > 1:
+        print(f"Replaying {source} into {args.shards} shards under {stream.DATA_DIR}")
+        start = time.perf_counter()
+        count, handler_seconds, routing_cpu, shards = replay_sharded(stream, messages, args.shards, args.speed)
+        elapsed = time.perf_counter() - start
+        written = sum(s["written_rows"] for s in shards)
+        busiest = max([routing_cpu] + [s["cpu_seconds"] for s in shards])
+
+        print(f"{count:,} messages in {elapsed:.2f}s ({handler_seconds:.2f}s routing)")
+        print(f"  {count / elapsed:,.0f} messages/s, {written / elapsed:,.0f} rows/s committed end to end")
+        print(f"  CPU seconds: routing {routing_cpu:.2f}, shards " + ", ".join(f"{s['cpu_seconds']:.2f}" for s in shards))
+        print(f"  with a core per process: ~{count / busiest:,.0f} messages/s (busiest process {busiest:.2f} CPU s)")
+        print(f"  writers: {sum(s['commits'] for s in shards):,} commits, "
+              f"{sum(s['dropped_rows'] for s in shards):,} rows dropped, {sum(s['errors'] for s in shards)} errors")
+        return {"messages": count, "seconds": elapsed, "handler_seconds": handler_seconds, "written_rows": written,
+                "routing_cpu_seconds": routing_cpu, "shards": shards}
+
+    stream.use_data_dir(stream.DATA_DIR)
+    print(f"Replaying {source} into {stream.db_filename}")
+    started_cpu = time.process_time()
+    stream.writer.start()
+    start = time.perf_counter()
+    count, handler_seconds = replay(messages, stream.my_handler, args.speed, flush_rollups)
+    fed = time.perf_counter() - start
+    stream.flush_rollups()
+    stream.writer.stop(timeout=600)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - started_cpu - feed_cpu["feed"]
+    stats = stream.writer.get_stats()
+
+    print(f"{count:,} messages in {elapsed:.2f}s ({fed:.2f}s feeding, {handler_seconds:.2f}s in the handler)")
+    print(f"  {count / elapsed:,.0f} messages/s, {stats['written_rows'] / elapsed:,.0f} rows/s committed end to end")
+    print(f"  CPU seconds: {cpu:.2f} recording ({feed_cpu['feed']:.2f} more reading the feed)")
+    print(f"  writer: {stats['commits']:,} commits, max queue depth {stats['max_queue_depth']:,}, "
+          f"{stats['dropped_rows']:,} rows dropped, {stats['errors']} errors")
+    return {"messages": count, "seconds": elapsed, "handler_seconds": handler_seconds, "cpu_seconds": cpu, **stats}
+
+
+if __name__ == "__main__":
+    main()
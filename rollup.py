@@ -0,0 +1,181 @@
+# rollup.py
+import threading
+
+# Rollup resolutions served by /historical_full?resolution=..., in seconds
+RESOLUTIONS = {"1s": 1, "5s": 5, "1m": 60, "5m": 300}
+
+
+class _LevelStats:
+    __slots__ = ("quantity", "since", "weighted", "max")
+
+    def __init__(self, quantity, since):
+        self.quantity = quantity
+        self.since = since
+        self.weighted = 0.0
+        self.max = quantity
+
+
+class _Bucket:
+    """Running aggregates for one symbol at one resolution."""
+
+    __slots__ = ("start", "end", "covered_from", "levels",
+                 "open", "high", "low", "close", "volume", "underlying", "flushed")
+
+    def __init__(self, start, end, covered_from):
+        self.start = start
+        self.end = end
+        # Time-weighted averages are taken over the part of the bucket we saw a book for
+        self.covered_from = covered_from
+        self.levels = {}     # (side, price) -> _LevelStats
+        self.open = self.high = self.low = self.close = None
+        self.volume = 0
+        self.underlying = None
+        # Rows already written by flush() and nothing folded in since
+        self.flushed = False
+
+
+class RollupBuilder:
+    """Maintain per-bucket book and trade aggregates incrementally as updates arrive.
+
+    For every bucket and price level it keeps the max, time-weighted average and
+    last quantity per side; for trades it keeps OHLC of last_price, summed
+    last_size and the last underlying price. Closed buckets are returned as rows:
+
+        book:  (symbol, resolution, bucket, side, price, max, avg, last)
+        trade: (symbol, resolution, bucket, open, high, low, close, volume, underlying)
+
+    Buckets written by flush(before) stay open, so a late update still lands
+    in the whole bucket, which is written again when it closes rather than
+    replaced by a partial one.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS.values()):
+        self.resolutions_ms = [r * 1000 for r in resolutions]
+        self._buckets = {}   # (symbol, resolution_ms) -> _Bucket
+        self._books = {}     # symbol -> {(side, price): quantity}
+        # Newest update timestamp folded in: the feed's clock, for flushing quiet symbols' buckets
+        self.newest = None
+        self._lock = threading.Lock()
+
+    def _bucket_for(self, symbol, resolution_ms, timestamp, closed):
+        """Current bucket covering timestamp, closing the previous one if needed."""
+        key = (symbol, resolution_ms)
+        bucket = self._buckets.get(key)
+        if bucket is not None and timestamp < bucket.end:
+            bucket.flushed = False
+            return bucket
+
+        if bucket is not None and not bucket.flushed:
+            self._close(symbol, resolution_ms, bucket, closed)
+
+        start = timestamp - timestamp % resolution_ms
+        book = self._books.get(symbol)
+        # Before the first book for a symbol there is nothing to average over
+        new_bucket = _Bucket(start, start + resolution_ms, start if book else timestamp)
+        # The book carries over into the new bucket
+        for level, quantity in (book or {}).items():
+            if quantity:
+                new_bucket.levels[level] = _LevelStats(quantity, start)
+        if bucket is not None:
+            new_bucket.underlying = bucket.underlying
+        self._buckets[key] = new_bucket
+        return new_bucket
+
+    def _close(self, symbol, resolution_ms, bucket, closed):
+        book_rows, trade_rows = closed
+        span = max(bucket.end - bucket.covered_from, 1)
+        resolution = resolution_ms // 1000
+        for (side, price), stats in bucket.levels.items():
+            # Left unchanged, so a flushed bucket can keep aggregating
+            weighted = stats.weighted + stats.quantity * (bucket.end - stats.since)
+            if stats.max:
+                book_rows.append((
+                    symbol, resolution, bucket.start, side, price,
+                    stats.max, weighted / span, stats.quantity,
+                ))
+        if bucket.close is not None or bucket.volume:
+            trade_rows.append((
+                symbol, resolution, bucket.start,
+                bucket.open, bucket.high, bucket.low, bucket.close, bucket.volume, bucket.underlying,
+            ))
+
+    def add_book(self, symbol, timestamp, bids=None, asks=None):
+        """Fold a book update in; returns (book_rows, trade_rows) for buckets it closed."""
+        closed = ([], [])
+        with self._lock:
+            self._advance(timestamp)
+            book = self._books.setdefault(symbol, {})
+            new_book = dict(book)
+            if bids is not None:
+                for level in [l for l in new_book if l[0] == "BID"]:
+                    del new_book[level]
+                new_book.update((("BID", p), q) for p, q in bids)
+            if asks is not None:
+                for level in [l for l in new_book if l[0] == "ASK"]:
+                    del new_book[level]
+                new_book.update((("ASK", p), q) for p, q in asks)
+
+            for resolution_ms in self.resolutions_ms:
+                bucket = self._bucket_for(symbol, resolution_ms, timestamp, closed)
+                levels = bucket.levels
+                # Levels that changed or disappeared
+                for level, stats in levels.items():
+                    quantity = new_book.get(level, 0)
+                    if quantity != stats.quantity:
+                        # Out-of-order updates never count negative time
+                        now = max(timestamp, stats.since)
+                        stats.weighted += stats.quantity * (now - stats.since)
+                        stats.quantity = quantity
+                        stats.since = now
+                        if quantity > stats.max:
+                            stats.max = quantity
+                # Levels new to this bucket
+                for level, quantity in new_book.items():
+                    if quantity and level not in levels:
+                        levels[level] = _LevelStats(quantity, max(timestamp, bucket.start))
+
+            self._books[symbol] = new_book
+        return closed
+
+    def add_trade(self, symbol, timestamp, last_price=None, last_size=None, underlying_price=None):
+        """Fold a level-one update in; returns (book_rows, trade_rows) for buckets it closed."""
+        closed = ([], [])
+        with self._lock:
+            self._advance(timestamp)
+            for resolution_ms in self.resolutions_ms:
+                bucket = self._bucket_for(symbol, resolution_ms, timestamp, closed)
+                if last_price is not None:
+                    if bucket.open is None:
+                        bucket.open = bucket.high = bucket.low = last_price
+                    bucket.high = max(bucket.high, last_price)
+                    bucket.low = min(bucket.low, last_price)
+                    bucket.close = last_price
+                if last_size:
+                    bucket.volume += last_size
+                if underlying_price is not None:
+                    bucket.underlying = underlying_price
+        return closed
+
+    def _advance(self, timestamp):
+        if self.newest is None or timestamp > self.newest:
+            self.newest = timestamp
+
+    def flush(self, before=None):
+        """Rows of buckets that ended before `before` (ms), or close all open buckets when None.
+
+        With before, the buckets are kept (marked flushed) in case an update
+        for them is still on its way.
+        """
+        closed = ([], [])
+        with self._lock:
+            for key, bucket in list(self._buckets.items()):
+                if before is not None and bucket.end > before:
+                    continue
+                symbol, resolution_ms = key
+                if not bucket.flushed:
+                    self._close(symbol, resolution_ms, bucket, closed)
+                if before is None:
+                    del self._buckets[key]
+                else:
+                    bucket.flushed = True
+        return closed
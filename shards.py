@@ -0,0 +1,33 @@
+# shards.py
+"""Hash partitioning of symbols across recording processes (STREAM_SHARDS > 1).
+
+The stream process keeps the one Schwab connection and routes every update
+to the shard worker owning its symbol. Each worker records into its own
+data directory, <DATA_DIR>/shard-<k>-of-<n>, holding the usual day files and
+manifest, so everything that reads a data directory works on a shard as is.
+With a single shard the data directory itself is used.
+"""
+import os
+import zlib
+
+STREAM_SHARDS = max(1, int(os.getenv("STREAM_SHARDS", "1")))
+# Messages waiting for one shard worker before the stream starts dropping its updates
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "20000"))
+
+
+def shard_of(symbol, shards=STREAM_SHARDS):
+    """Shard recording symbol; stable across processes and runs, unlike hash()."""
+    if shards <= 1:
+        return 0
+    return zlib.crc32(symbol.encode()) % shards
+
+
+def shard_dir(data_dir, shard, shards=STREAM_SHARDS):
+    """Data directory of one shard."""
+    if shards <= 1:
+        return data_dir
+    return os.path.join(data_dir, f"shard-{shard}-of-{shards}")
+
+
+def shard_dirs(data_dir, shards=STREAM_SHARDS):
+    return [shard_dir(data_dir, shard, shards) for shard in range(shards)]
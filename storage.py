@@ -0,0 +1,1188 @@
+# storage.py
+import itertools
+import os
+import threading
+
+from livebook import BookCache
+from rollup import RollupBuilder
+from tape import PROFILE_BUCKET_MS, TradeTape
+
+# "full" writes every level of every OPTIONS_BOOK message.
+# "delta" writes only added/changed/removed levels, plus a full keyframe every
+# KEYFRAME_EVERY updates or KEYFRAME_SECONDS per symbol.
+BOOK_STORAGE = os.getenv("BOOK_STORAGE", "full").lower()
+KEYFRAME_EVERY = int(os.getenv("KEYFRAME_EVERY", "200"))
+KEYFRAME_SECONDS = float(os.getenv("KEYFRAME_SECONDS", "60"))
+
+# Day-file schema versions, kept in PRAGMA user_version
+LEGACY_SCHEMA = 0    # TEXT symbol/side, REAL price, AUTOINCREMENT ids
+COMPACT_SCHEMA = 1   # symbol dictionary, integer price ticks, 0/1 side, WITHOUT ROWID
+SCHEMA_VERSION = COMPACT_SCHEMA
+
+# Compact schema stores prices as integer cents
+PRICE_SCALE = 100
+SIDES = ("BID", "ASK")
+SIDE_CODES = {"BID": 0, "ASK": 1}
+
+
+def create_rollup_tables(cursor, symbol_column, side_column, price_column):
+    """Time-bucketed book and trade aggregates (see rollup.py), one set per resolution."""
+    symbol_name = symbol_column.split()[0]
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS book_rollup (
+        {symbol_column},
+        resolution INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        {side_column},
+        {price_column},
+        max_quantity INTEGER,
+        avg_quantity REAL,
+        last_quantity INTEGER,
+        PRIMARY KEY ({symbol_name}, resolution, bucket, side, price)
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS trade_rollup (
+        {symbol_column},
+        resolution INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        open REAL,
+        high REAL,
+        low REAL,
+        close REAL,
+        volume REAL,
+        underlying_price REAL,
+        PRIMARY KEY ({symbol_name}, resolution, bucket)
+    ) WITHOUT ROWID
+    ''')
+
+
+def create_trade_tables(cursor, symbol_column, side_column, price_column, bid, ask):
+    """Trade prints and per-minute volume at price, kept from level-one updates (see tape.py).
+
+    bid and ask are the SQL literals the schema stores the two sides as.
+    """
+    symbol_name = symbol_column.split()[0]
+    # side is the book side a print traded against, NULL inside the spread
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS trades (
+        {symbol_column},
+        timestamp INTEGER NOT NULL,
+        {price_column},
+        size REAL,
+        {side_column},
+        PRIMARY KEY ({symbol_name}, timestamp)
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS volume_profile (
+        {symbol_column},
+        bucket INTEGER NOT NULL,
+        {price_column},
+        volume REAL,
+        bid_volume REAL,
+        ask_volume REAL,
+        trades INTEGER,
+        PRIMARY KEY ({symbol_name}, bucket, price)
+    ) WITHOUT ROWID
+    ''')
+
+    # Each print is added to the profile as it is inserted. Prints go in with INSERT OR IGNORE,
+    # so one written again (a replayed capture, a restarted stream) adds nothing twice.
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trades_volume_profile AFTER INSERT ON trades
+    BEGIN
+        INSERT INTO volume_profile
+        ({symbol_name}, bucket, price, volume, bid_volume, ask_volume, trades)
+        VALUES (
+            NEW.{symbol_name}, NEW.timestamp - NEW.timestamp % {PROFILE_BUCKET_MS}, NEW.price, NEW.size,
+            CASE WHEN NEW.side = {bid} THEN NEW.size ELSE 0 END,
+            CASE WHEN NEW.side = {ask} THEN NEW.size ELSE 0 END,
+            1
+        )
+        ON CONFLICT ({symbol_name}, bucket, price) DO UPDATE SET
+            volume = volume + excluded.volume,
+            bid_volume = bid_volume + excluded.bid_volume,
+            ask_volume = ask_volume + excluded.ask_volume,
+            trades = trades + excluded.trades;
+    END
+    ''')
+
+
+class LegacySchema:
+    """Original layout: one row per level with the symbol and side spelled out."""
+
+    version = LEGACY_SCHEMA
+    book_table = "options_book_data"
+    delta_table = "options_book_delta"
+    level_one_table = "level_one_data"
+    symbol_column = "symbol"
+
+    book_insert_sql = '''
+        INSERT INTO options_book_data
+        (symbol, timestamp, price, quantity, side)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    delta_insert_sql = '''
+        INSERT INTO options_book_delta
+        (symbol, timestamp, price, quantity, side, keyframe)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    level_one_insert_sql = '''
+        INSERT INTO level_one_data
+        (symbol, timestamp, last_price, last_size, underlying_price)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    book_rollup_insert_sql = '''
+        INSERT OR REPLACE INTO book_rollup
+        (symbol, resolution, bucket, side, price, max_quantity, avg_quantity, last_quantity)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    trade_rollup_insert_sql = '''
+        INSERT OR REPLACE INTO trade_rollup
+        (symbol, resolution, bucket, open, high, low, close, volume, underlying_price)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    trade_insert_sql = '''
+        INSERT OR IGNORE INTO trades
+        (symbol, timestamp, price, size, side)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+
+    def create(self, cursor):
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS options_book_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT,
+            timestamp INTEGER,
+            price REAL,
+            quantity INTEGER,
+            side TEXT
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS level_one_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT,
+            timestamp INTEGER,
+            last_price REAL,
+            last_size REAL,
+            underlying_price REAL
+        )
+        ''')
+
+        # Delta-encoded book: keyframe=1 rows are a full book, keyframe=0 rows are
+        # changes since the previous update (a NULL quantity means the level was removed)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS options_book_delta (
+            symbol TEXT,
+            timestamp INTEGER,
+            price REAL,
+            quantity INTEGER,
+            side TEXT,
+            keyframe INTEGER
+        )
+        ''')
+
+        # Create indices for faster querying
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_symbol_ts ON options_book_data (symbol, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_level_one_symbol_ts ON level_one_data (symbol, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_delta_symbol_ts ON options_book_delta (symbol, timestamp)')
+
+        create_rollup_tables(cursor, "symbol TEXT", "side TEXT", "price REAL")
+        create_trade_tables(cursor, "symbol TEXT", "side TEXT", "price REAL", "'BID'", "'ASK'")
+
+    def symbol_key(self, conn, symbol):
+        return symbol
+
+    def symbol_keys(self, conn, symbols):
+        return {symbol: symbol for symbol in symbols}
+
+    def list_symbols(self, conn, table):
+        return [row[0] for row in conn.execute(f"SELECT DISTINCT symbol FROM {table}")]
+
+    @staticmethod
+    def decode_level(price, side):
+        return price, side
+
+
+class CompactSchema:
+    """Normalized layout clustered on (symbol_id, timestamp, side, price)."""
+
+    version = COMPACT_SCHEMA
+    book_table = "book"
+    delta_table = "book_delta"
+    level_one_table = "level_one"
+    symbol_column = "symbol_id"
+
+    symbol_insert_sql = 'INSERT OR IGNORE INTO symbols (symbol_id, symbol) VALUES (?, ?)'
+    book_insert_sql = '''
+        INSERT OR REPLACE INTO book
+        (symbol_id, timestamp, price, quantity, side)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    delta_insert_sql = '''
+        INSERT OR REPLACE INTO book_delta
+        (symbol_id, timestamp, price, quantity, side, keyframe)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    level_one_insert_sql = '''
+        INSERT OR REPLACE INTO level_one
+        (symbol_id, timestamp, last_price, last_size, underlying_price)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    book_rollup_insert_sql = '''
+        INSERT OR REPLACE INTO book_rollup
+        (symbol_id, resolution, bucket, side, price, max_quantity, avg_quantity, last_quantity)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    trade_rollup_insert_sql = '''
+        INSERT OR REPLACE INTO trade_rollup
+        (symbol_id, resolution, bucket, open, high, low, close, volume, underlying_price)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    trade_insert_sql = '''
+        INSERT OR IGNORE INTO trades
+        (symbol_id, timestamp, price, size, side)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+
+    def create(self, cursor):
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS symbols (
+            symbol_id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL UNIQUE
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS book (
+            symbol_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            side INTEGER NOT NULL,
+            price INTEGER NOT NULL,
+            quantity INTEGER,
+            PRIMARY KEY (symbol_id, timestamp, side, price)
+        ) WITHOUT ROWID
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS book_delta (
+            symbol_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            side INTEGER NOT NULL,
+            price INTEGER NOT NULL,
+            quantity INTEGER,
+            keyframe INTEGER NOT NULL,
+            PRIMARY KEY (symbol_id, timestamp, side, price)
+        ) WITHOUT ROWID
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS level_one (
+            symbol_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            last_price REAL,
+            last_size REAL,
+            underlying_price REAL,
+            PRIMARY KEY (symbol_id, timestamp)
+        ) WITHOUT ROWID
+        ''')
+
+        create_rollup_tables(cursor, "symbol_id INTEGER NOT NULL", "side INTEGER NOT NULL", "price INTEGER NOT NULL")
+        create_trade_tables(cursor, "symbol_id INTEGER NOT NULL", "side INTEGER", "price INTEGER NOT NULL",
+                            SIDE_CODES["BID"], SIDE_CODES["ASK"])
+
+    def symbol_key(self, conn, symbol):
+        row = conn.execute("SELECT symbol_id FROM symbols WHERE symbol = ?", (symbol,)).fetchone()
+        return row[0] if row else None
+
+    def symbol_keys(self, conn, symbols):
+        """{symbol: symbol_id} of the given symbols that are in the dictionary, in one query."""
+        symbols = list(symbols)
+        placeholders = ",".join("?" * len(symbols))
+        return {
+            symbol: key for key, symbol in
+            conn.execute(f"SELECT symbol_id, symbol FROM symbols WHERE symbol IN ({placeholders})", symbols)
+        }
+
+    def list_symbols(self, conn, table):
+        return [row[0] for row in conn.execute("SELECT symbol FROM symbols ORDER BY symbol_id")]
+
+    @staticmethod
+    def decode_level(price, side):
+        return price / PRICE_SCALE, SIDES[side]
+
+
+SCHEMAS = {LEGACY_SCHEMA: LegacySchema(), COMPACT_SCHEMA: CompactSchema()}
+
+
+def schema_for(conn):
+    """Detect the layout of a day file from PRAGMA user_version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    return SCHEMAS.get(version, SCHEMAS[LEGACY_SCHEMA])
+
+
+def ensure_schema(conn):
+    """Create the day-file tables if needed and return the file's schema.
+
+    New files get SCHEMA_VERSION; files that already hold legacy tables keep
+    their layout so a running day is never split across two.
+    """
+    cursor = conn.cursor()
+    has_legacy = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'options_book_data'"
+    ).fetchone() is not None
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    if version == LEGACY_SCHEMA and not has_legacy:
+        version = SCHEMA_VERSION
+        cursor.execute(f"PRAGMA user_version = {version}")
+    schema = SCHEMAS.get(version, SCHEMAS[LEGACY_SCHEMA])
+    schema.create(cursor)
+    conn.commit()
+    return schema
+
+
+class DeltaEncoder:
+    """Turn full OPTIONS_BOOK updates into delta levels, emitting periodic keyframes.
+
+    Keeps the previously written book per symbol. An update that changes nothing
+    produces no levels. Removed levels get quantity None, so levels that arrive
+    with quantity 0 are stored as they are, as in full mode.
+    """
+
+    def __init__(self, keyframe_every=KEYFRAME_EVERY, keyframe_seconds=KEYFRAME_SECONDS):
+        self.keyframe_every = keyframe_every
+        # Measured against book timestamps (ms), so re-encoding old files behaves like live ingest
+        self.keyframe_ms = keyframe_seconds * 1000
+        self._books = BookCache()
+        self._since_keyframe = {}   # symbol -> (updates since keyframe, keyframe timestamp)
+        self._lock = threading.Lock()
+
+    def encode(self, symbol, timestamp, bids=None, asks=None):
+        """Return (is_keyframe, levels) for one update (bids/asks None = side not in update)."""
+        with self._lock:
+            changes = self._books.apply_book(symbol, timestamp, bids, asks, removed=None)
+            count, keyframe_ts = self._since_keyframe.get(symbol, (None, None))
+
+            if count is None or count + 1 >= self.keyframe_every or timestamp - keyframe_ts >= self.keyframe_ms:
+                self._since_keyframe[symbol] = (0, timestamp)
+                return True, self._books.get(symbol)["levels"]
+
+            self._since_keyframe[symbol] = (count + 1, keyframe_ts)
+            return False, changes
+
+
+class BookRecorder:
+    """Turn parsed stream updates into (sql, rows) batches for one day file.
+
+    Rows come out in the file's schema and the configured storage mode, ready
+    for BatchWriter.put.
+    """
+
+    def __init__(self, schema, mode=BOOK_STORAGE, keyframe_every=KEYFRAME_EVERY, keyframe_seconds=KEYFRAME_SECONDS,
+                 rollups=True, trades=True):
+        self.schema = schema
+        self.mode = mode
+        self.delta = DeltaEncoder(keyframe_every, keyframe_seconds) if mode == "delta" else None
+        # Rollup tables are maintained from the same updates as they are written
+        self.rollups = RollupBuilder() if rollups else None
+        # So are the trade prints and volume profile
+        self.tape = TradeTape() if trades else None
+        self.symbol_ids = {}
+        self.last_timestamps = {}
+        self.last_level_one_timestamps = {}
+        self._lock = threading.Lock()
+
+    def load_symbols(self, conn):
+        """Pick up symbol ids already assigned in an existing compact day file."""
+        if self.schema.version == COMPACT_SCHEMA:
+            with self._lock:
+                for symbol_id, symbol in conn.execute("SELECT symbol_id, symbol FROM symbols"):
+                    self.symbol_ids[symbol] = symbol_id
+
+    def _symbol_key(self, symbol, batches):
+        if self.schema.version != COMPACT_SCHEMA:
+            return symbol
+        with self._lock:
+            symbol_id = self.symbol_ids.get(symbol)
+            if symbol_id is None:
+                symbol_id = self.symbol_ids[symbol] = len(self.symbol_ids) + 1
+                batches.append((self.schema.symbol_insert_sql, [(symbol_id, symbol)]))
+        return symbol_id
+
+    def _encode_level(self, key, timestamp, price, quantity, side, *extra):
+        if self.schema.version == COMPACT_SCHEMA:
+            return (key, timestamp, round(price * PRICE_SCALE), quantity, SIDE_CODES[side], *extra)
+        return (key, timestamp, price, quantity, side, *extra)
+
+    def _rollup_batches(self, closed, batches):
+        book_rows, trade_rows = closed
+        compact = self.schema.version == COMPACT_SCHEMA
+        if book_rows:
+            batches.append((self.schema.book_rollup_insert_sql, [
+                (self._symbol_key(symbol, batches), resolution, bucket,
+                 SIDE_CODES[side] if compact else side,
+                 round(price * PRICE_SCALE) if compact else price,
+                 max_quantity, avg_quantity, last_quantity)
+                for symbol, resolution, bucket, side, price, max_quantity, avg_quantity, last_quantity in book_rows
+            ]))
+        if trade_rows:
+            batches.append((self.schema.trade_rollup_insert_sql, [
+                (self._symbol_key(row[0], batches), *row[1:]) for row in trade_rows
+            ]))
+
+    def flush_rollups(self, before=None, lag=None):
+        """Batches for rollup buckets that ended before `before` (ms), or all of them when None.
+
+        lag (ms) measures before from the newest update recorded instead, so
+        a feed running behind the wall clock doesn't have its buckets cut short.
+        """
+        batches = []
+        if self.rollups is not None:
+            if lag is not None:
+                if self.rollups.newest is None:
+                    return batches
+                before = self.rollups.newest - lag
+            self._rollup_batches(self.rollups.flush(before), batches)
+        return batches
+
+    def book(self, symbol, timestamp, bids=None, asks=None):
+        """Batches for one OPTIONS_BOOK update given as [(price, quantity)] per side."""
+        batches = []
+        key = self._symbol_key(symbol, batches)
+
+        if self.schema.version == COMPACT_SCHEMA:
+            # The clustered key allows one book per (symbol, timestamp)
+            with self._lock:
+                last = self.last_timestamps.get(symbol)
+                if last is not None and timestamp <= last:
+                    timestamp = last + 1
+                self.last_timestamps[symbol] = timestamp
+
+        if self.delta is not None:
+            keyframe, levels = self.delta.encode(symbol, timestamp, bids, asks)
+            rows = [
+                self._encode_level(key, timestamp, l["price"], l["quantity"], l["side"], 1 if keyframe else 0)
+                for l in levels
+            ]
+            batches.append((self.schema.delta_insert_sql, rows))
+        else:
+            rows = [self._encode_level(key, timestamp, p, q, "BID") for p, q in bids or ()]
+            rows.extend(self._encode_level(key, timestamp, p, q, "ASK") for p, q in asks or ())
+            batches.append((self.schema.book_insert_sql, rows))
+
+        if self.rollups is not None:
+            self._rollup_batches(self.rollups.add_book(symbol, timestamp, bids, asks), batches)
+        if self.tape is not None:
+            self.tape.add_book(symbol, bids, asks)
+        return batches
+
+    def level_one(self, symbol, timestamp, last_price, last_size, underlying_price):
+        """Batches for one LEVELONE_OPTIONS update."""
+        batches = []
+        key = self._symbol_key(symbol, batches)
+
+        if self.schema.version == COMPACT_SCHEMA:
+            # One row per (symbol, timestamp) here too: a second update in the same ms must not replace the first
+            with self._lock:
+                last = self.last_level_one_timestamps.get(symbol)
+                if last is not None and timestamp <= last:
+                    timestamp = last + 1
+                self.last_level_one_timestamps[symbol] = timestamp
+
+        batches.append((self.schema.level_one_insert_sql, [(key, timestamp, last_price, last_size, underlying_price)]))
+
+        if self.rollups is not None:
+            self._rollup_batches(self.rollups.add_trade(symbol, timestamp, last_price, last_size, underlying_price), batches)
+        if self.tape is not None:
+            trade = self.tape.add_level_one(symbol, timestamp, last_price, last_size)
+            if trade is not None:
+                self._trade_batches(key, trade, batches)
+        return batches
+
+    def _trade_batches(self, key, trade, batches):
+        """The print; the trades_volume_profile trigger adds it to the volume profile."""
+        timestamp, price, size, side = trade
+        if self.schema.version == COMPACT_SCHEMA:
+            price = round(price * PRICE_SCALE)
+            code = SIDE_CODES.get(side)
+        else:
+            code = side
+        batches.append((self.schema.trade_insert_sql, [(key, timestamp, price, size, code)]))
+
+
+def uses_delta(conn, schema=None):
+    """True if this day file holds its book in the delta table."""
+    schema = schema or schema_for(conn)
+    try:
+        return conn.execute(f"SELECT 1 FROM {schema.delta_table} LIMIT 1").fetchone() is not None
+    except Exception:
+        # Older day files don't have the table at all
+        return False
+
+
+def level_order(level):
+    """Sort key for response levels: bids high-to-low, then asks low-to-high, on every schema."""
+    return (0, -level["price"]) if level["side"] == "BID" else (1, level["price"])
+
+
+def sorted_levels(book):
+    """Levels of a {(side, price): quantity} book, bids high-to-low then asks low-to-high."""
+    bids = sorted(((p, q) for (side, p), q in book.items() if side == "BID"), reverse=True)
+    asks = sorted((p, q) for (side, p), q in book.items() if side == "ASK")
+    return (
+        [{"price": p, "quantity": q, "side": "BID"} for p, q in bids] +
+        [{"price": p, "quantity": q, "side": "ASK"} for p, q in asks]
+    )
+
+
+def list_symbols(conn):
+    schema = schema_for(conn)
+    table = schema.delta_table if uses_delta(conn, schema) else schema.book_table
+    return schema.list_symbols(conn, table)
+
+
+def symbol_time_ranges(conn):
+    """{symbol: (first timestamp, last timestamp)} of the books stored in a day file."""
+    schema = schema_for(conn)
+    table = schema.delta_table if uses_delta(conn, schema) else schema.book_table
+    ranges = {}
+    for symbol in schema.list_symbols(conn, table):
+        key = schema.symbol_key(conn, symbol)
+        # Two index seeks per symbol rather than a scan of the whole table
+        first = conn.execute(
+            f"SELECT MIN(timestamp) FROM {table} WHERE {schema.symbol_column} = ?", (key,)
+        ).fetchone()[0]
+        last = conn.execute(
+            f"SELECT MAX(timestamp) FROM {table} WHERE {schema.symbol_column} = ?", (key,)
+        ).fetchone()[0]
+        if first is not None:
+            ranges[symbol] = (first, last)
+    return ranges
+
+
+def count_snapshots(conn, symbol, since=None):
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None:
+        return 0
+    table = schema.delta_table if uses_delta(conn, schema) else schema.book_table
+    return conn.execute(
+        f"SELECT COUNT(DISTINCT timestamp) FROM {table} WHERE {schema.symbol_column} = ? AND timestamp > ?",
+        (key, -1 if since is None else since)
+    ).fetchone()[0]
+
+
+def iter_book_snapshots(conn, symbol, since=None):
+    """Yield (timestamp, levels) for every stored book of symbol, oldest first.
+
+    With since (ms), only books newer than it are yielded. Works on every schema
+    and storage format; delta files are replayed from keyframes.
+    """
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None:
+        return
+    decode = schema.decode_level
+    since = -1 if since is None else since
+
+    if not uses_delta(conn, schema):
+        rows = conn.execute(
+            f"""
+            SELECT timestamp, price, quantity, side
+            FROM {schema.book_table}
+            WHERE {schema.symbol_column} = ? AND timestamp > ?
+            ORDER BY timestamp
+            """,
+            (key, since)
+        )
+        group_ts = None
+        group_levels = []
+        for ts, price, quantity, side in rows:
+            if ts != group_ts:
+                if group_ts is not None:
+                    # Compact files come back in (side, price) key order, legacy ones as inserted
+                    group_levels.sort(key=level_order)
+                    yield group_ts, group_levels
+                group_ts = ts
+                group_levels = []
+            price, side = decode(price, side)
+            group_levels.append({"price": price, "quantity": quantity, "side": side})
+        if group_ts is not None:
+            group_levels.sort(key=level_order)
+            yield group_ts, group_levels
+        return
+
+    # Replay from the newest keyframe at or before the cursor
+    start = conn.execute(
+        f"""
+        SELECT MAX(timestamp) FROM {schema.delta_table}
+        WHERE {schema.symbol_column} = ? AND keyframe = 1 AND timestamp <= ?
+        """,
+        (key, since)
+    ).fetchone()[0]
+    rows = conn.execute(
+        f"""
+        SELECT timestamp, price, quantity, side, keyframe
+        FROM {schema.delta_table}
+        WHERE {schema.symbol_column} = ? AND timestamp >= ?
+        ORDER BY timestamp
+        """,
+        (key, -1 if start is None else start)
+    )
+    for ts, book in replay_deltas(rows, decode):
+        if ts > since:
+            yield ts, sorted_levels(book)
+
+
+def replay_deltas(rows, decode=LegacySchema.decode_level):
+    """Rebuild books from ordered (timestamp, price, quantity, side, keyframe) rows.
+
+    Yields (timestamp, {(side, price): quantity}) once per timestamp; the dict is
+    reused between yields.
+    """
+    book = {}
+    group_ts = None
+    group_reset = False
+    for ts, price, quantity, side, keyframe in rows:
+        if ts != group_ts:
+            if group_ts is not None:
+                yield group_ts, book
+            group_ts = ts
+            group_reset = False
+        if keyframe and not group_reset:
+            # A keyframe replaces everything before it
+            book = {}
+            group_reset = True
+        price, side = decode(price, side)
+        if quantity is None:
+            book.pop((side, price), None)
+        else:
+            book[(side, price)] = quantity
+    if group_ts is not None:
+        yield group_ts, book
+
+
+def latest_book(conn, symbol):
+    """(timestamp, levels) of the newest stored book for symbol, or None."""
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None:
+        return None
+    decode = schema.decode_level
+
+    if not uses_delta(conn, schema):
+        row = conn.execute(
+            f"SELECT MAX(timestamp) FROM {schema.book_table} WHERE {schema.symbol_column} = ?", (key,)
+        ).fetchone()
+        if not row or not row[0]:
+            return None
+        latest_timestamp = row[0]
+        rows = conn.execute(
+            f"""
+            SELECT price, quantity, side
+            FROM {schema.book_table}
+            WHERE {schema.symbol_column} = ? AND timestamp = ?
+            """,
+            (key, latest_timestamp)
+        )
+        levels = []
+        for price, quantity, side in rows:
+            price, side = decode(price, side)
+            levels.append({"price": price, "quantity": quantity, "side": side})
+        levels.sort(key=level_order)
+        return latest_timestamp, levels
+
+    # Replay from the newest keyframe
+    row = conn.execute(
+        f"SELECT MAX(timestamp) FROM {schema.delta_table} WHERE {schema.symbol_column} = ? AND keyframe = 1",
+        (key,)
+    ).fetchone()
+    if not row or row[0] is None:
+        return None
+    rows = conn.execute(
+        f"""
+        SELECT timestamp, price, quantity, side, keyframe
+        FROM {schema.delta_table}
+        WHERE {schema.symbol_column} = ? AND timestamp >= ?
+        ORDER BY timestamp
+        """,
+        (key, row[0])
+    )
+    latest = None
+    for latest in replay_deltas(rows, decode):
+        pass
+    return latest[0], sorted_levels(latest[1])
+
+
+def iter_level_one(conn, symbol, since=None):
+    """Yield (timestamp, last_price, last_size, underlying_price) for symbol, oldest first.
+
+    With since (ms), rows start at the latest one at or before it, so an as-of
+    join over newer books still finds its first match.
+    """
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None:
+        return iter(())
+    start = -1
+    if since is not None:
+        start = conn.execute(
+            f"SELECT MAX(timestamp) FROM {schema.level_one_table} WHERE {schema.symbol_column} = ? AND timestamp <= ?",
+            (key, since)
+        ).fetchone()[0]
+        if start is None:
+            start = -1
+    return conn.execute(
+        f"""
+        SELECT timestamp, last_price, last_size, underlying_price
+        FROM {schema.level_one_table}
+        WHERE {schema.symbol_column} = ? AND timestamp >= ?
+        ORDER BY timestamp
+        """,
+        (key, start)
+    )
+
+
+def latest_level_one(conn, symbol):
+    """Newest (timestamp, last_price, last_size, underlying_price) row for symbol, or None."""
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None:
+        return None
+    return conn.execute(
+        f"""
+        SELECT timestamp, last_price, last_size, underlying_price
+        FROM {schema.level_one_table}
+        WHERE {schema.symbol_column} = ?
+        ORDER BY timestamp DESC
+        LIMIT 1
+        """,
+        (key,)
+    ).fetchone()
+
+
+def _wanted_keys(keys):
+    """A CTE listing the symbol keys, to drive one indexed lookup per symbol."""
+    return "wanted(key) AS (VALUES " + ",".join(["(?)"] * len(keys)) + ")"
+
+
+def latest_books(conn, symbols):
+    """{symbol: (timestamp, levels)} of the newest stored book of each symbol that has one.
+
+    One query for all of them: each symbol's latest timestamp is an index seek,
+    where a window function over symbol IN (...) would read every stored row.
+    """
+    schema = schema_for(conn)
+    keys = schema.symbol_keys(conn, symbols)
+    if not keys:
+        return {}
+    names = {key: symbol for symbol, key in keys.items()}
+    decode = schema.decode_level
+    col = schema.symbol_column
+    params = list(names)
+
+    if not uses_delta(conn, schema):
+        rows = conn.execute(
+            f"""
+            WITH {_wanted_keys(params)},
+            latest AS (
+                SELECT key, (SELECT MAX(timestamp) FROM {schema.book_table} WHERE {col} = wanted.key) AS ts
+                FROM wanted
+            )
+            SELECT b.{col}, b.timestamp, b.price, b.quantity, b.side
+            FROM latest JOIN {schema.book_table} b ON b.{col} = latest.key AND b.timestamp = latest.ts
+            """,
+            params
+        )
+        books = {}
+        for key, ts, price, quantity, side in rows:
+            price, side = decode(price, side)
+            books.setdefault(names[key], (ts, []))[1].append({"price": price, "quantity": quantity, "side": side})
+        for _, levels in books.values():
+            levels.sort(key=level_order)
+        return books
+
+    # Replay each symbol from its newest keyframe
+    rows = conn.execute(
+        f"""
+        WITH {_wanted_keys(params)},
+        start AS (
+            SELECT key, (
+                SELECT MAX(timestamp) FROM {schema.delta_table} WHERE {col} = wanted.key AND keyframe = 1
+            ) AS ts
+            FROM wanted
+        )
+        SELECT d.{col}, d.timestamp, d.price, d.quantity, d.side, d.keyframe
+        FROM start JOIN {schema.delta_table} d ON d.{col} = start.key AND d.timestamp >= start.ts
+        ORDER BY d.{col}, d.timestamp
+        """,
+        params
+    )
+    books = {}
+    for key, group in itertools.groupby(rows, key=lambda row: row[0]):
+        latest = None
+        for latest in replay_deltas((row[1:] for row in group), decode):
+            pass
+        if latest is not None:
+            books[names[key]] = (latest[0], sorted_levels(latest[1]))
+    return books
+
+
+def latest_level_ones(conn, symbols):
+    """{symbol: (timestamp, last_price, last_size, underlying_price)} of the newest row of each symbol, in one query."""
+    schema = schema_for(conn)
+    keys = schema.symbol_keys(conn, symbols)
+    if not keys:
+        return {}
+    names = {key: symbol for symbol, key in keys.items()}
+    col = schema.symbol_column
+    params = list(names)
+    rows = conn.execute(
+        f"""
+        WITH {_wanted_keys(params)}
+        SELECT l.{col}, l.timestamp, l.last_price, l.last_size, l.underlying_price
+        FROM wanted JOIN {schema.level_one_table} l ON l.{col} = wanted.key
+        AND l.timestamp = (SELECT MAX(timestamp) FROM {schema.level_one_table} WHERE {col} = wanted.key)
+        """,
+        params
+    )
+    return {names[row[0]]: row[1:] for row in rows}
+
+
+def has_rollups(conn, symbol, resolution):
+    """True if the rollup tables cover symbol's whole history at resolution (seconds).
+
+    A day file that was already being recorded when rollups were introduced
+    only has them from that point on, so it counts as not covered.
+    """
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None:
+        return False
+    try:
+        first_bucket = conn.execute(
+            f"SELECT MIN(bucket) FROM book_rollup WHERE {schema.symbol_column} = ? AND resolution = ?",
+            (key, resolution)
+        ).fetchone()[0]
+    except Exception:
+        # Day files written before rollups existed
+        return False
+    if first_bucket is None:
+        return False
+    table = schema.delta_table if uses_delta(conn, schema) else schema.book_table
+    first_book = conn.execute(
+        f"SELECT MIN(timestamp) FROM {table} WHERE {schema.symbol_column} = ? AND timestamp > 0",
+        (key,)
+    ).fetchone()[0]
+    return first_book is None or first_bucket <= first_book
+
+
+def count_rollup_buckets(conn, symbol, resolution):
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None or not has_rollups(conn, symbol, resolution):
+        return 0
+    return conn.execute(
+        f"SELECT COUNT(DISTINCT bucket) FROM book_rollup WHERE {schema.symbol_column} = ? AND resolution = ?",
+        (key, resolution)
+    ).fetchone()[0]
+
+
+def history_version(conn, symbol, resolution=None):
+    """Cheap fingerprint of a symbol's stored history: the file plus its newest timestamps.
+
+    It changes whenever a book, level-one row or (with resolution) rollup bucket is added.
+    """
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    if key is None:
+        return (path, None)
+    table = schema.delta_table if uses_delta(conn, schema) else schema.book_table
+    version = [path, schema.version]
+    for sql in (
+        f"SELECT MAX(timestamp) FROM {table} WHERE {schema.symbol_column} = ?",
+        f"SELECT MAX(timestamp) FROM {schema.level_one_table} WHERE {schema.symbol_column} = ?",
+    ):
+        version.append(conn.execute(sql, (key,)).fetchone()[0])
+    if resolution and has_rollups(conn, symbol, resolution):
+        for table in ("book_rollup", "trade_rollup"):
+            version.append(conn.execute(
+                f"SELECT MAX(bucket) FROM {table} WHERE {schema.symbol_column} = ? AND resolution = ?",
+                (key, resolution)
+            ).fetchone()[0])
+    return tuple(version)
+
+
+def _rollup_snapshot(bucket, levels, trade):
+    return {
+        "timestamp": bucket,
+        "levels": levels,
+        "last_price": trade[4] if trade else None,
+        "last_size": (trade[5] or None) if trade else None,
+        "underlying_price": trade[6] if trade else None,
+    }
+
+
+def iter_rollup_snapshots(conn, symbol, resolution, agg="max", since=None):
+    """Yield history snapshots for symbol at a rollup resolution (seconds), oldest first.
+
+    Level quantities are the bucket's max, time-weighted avg or last quantity;
+    last_price is the bucket close and last_size the summed trade size. Day files
+    without stored rollups are rolled up on the fly from the raw book.
+    """
+    column = {"max": "max_quantity", "avg": "avg_quantity", "last": "last_quantity"}[agg]
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None:
+        return
+    since = -1 if since is None else since
+
+    if has_rollups(conn, symbol, resolution):
+        decode = schema.decode_level
+        book_rows = conn.execute(
+            f"""
+            SELECT bucket, price, {column}, side
+            FROM book_rollup
+            WHERE {schema.symbol_column} = ? AND resolution = ? AND bucket > ?
+            ORDER BY bucket
+            """,
+            (key, resolution, since)
+        )
+        trade_rows = conn.execute(
+            f"""
+            SELECT bucket, open, high, low, close, volume, underlying_price
+            FROM trade_rollup
+            WHERE {schema.symbol_column} = ? AND resolution = ? AND bucket > ?
+            ORDER BY bucket
+            """,
+            (key, resolution, since)
+        )
+    else:
+        book_rows, trade_rows = _rollup_on_the_fly(conn, symbol, resolution, column)
+        book_rows = (row for row in book_rows if row[0] > since)
+        decode = LegacySchema.decode_level
+
+    next_trade = next(trade_rows, None)
+    group_bucket = None
+    group_levels = []
+
+    def trade_for(bucket):
+        # Merge join on bucket; trades only in buckets without book rows are skipped
+        nonlocal next_trade
+        while next_trade is not None and next_trade[0] < bucket:
+            next_trade = next(trade_rows, None)
+        if next_trade is not None and next_trade[0] == bucket:
+            return next_trade
+        return None
+
+    for bucket, price, quantity, side in book_rows:
+        if bucket != group_bucket:
+            if group_bucket is not None and group_levels:
+                group_levels.sort(key=level_order)
+                yield _rollup_snapshot(group_bucket, group_levels, trade_for(group_bucket))
+            group_bucket = bucket
+            group_levels = []
+        if quantity:
+            price, side = decode(price, side)
+            if agg == "avg":
+                quantity = round(quantity, 2)
+            group_levels.append({"price": price, "quantity": quantity, "side": side})
+    if group_bucket is not None and group_levels:
+        group_levels.sort(key=level_order)
+        yield _rollup_snapshot(group_bucket, group_levels, trade_for(group_bucket))
+
+
+def _rollup_on_the_fly(conn, symbol, resolution, column):
+    """Roll up a symbol's raw book and level-one data in memory for one resolution."""
+    builder = RollupBuilder([resolution])
+    book_rows = []
+    trade_rows = []
+    index = {"max_quantity": 5, "avg_quantity": 6, "last_quantity": 7}[column]
+
+    def collect(closed):
+        book_rows.extend((r[2], r[4], r[index], r[3]) for r in closed[0])
+        trade_rows.extend(r[2:] for r in closed[1])
+
+    level_one = iter_level_one(conn, symbol)
+    next_level_one = next(level_one, None)
+    for ts, levels in iter_book_snapshots(conn, symbol):
+        # Feed trades and books in timestamp order
+        while next_level_one is not None and next_level_one[0] <= ts:
+            collect(builder.add_trade(symbol, *next_level_one))
+            next_level_one = next(level_one, None)
+        bids = [(l["price"], l["quantity"]) for l in levels if l["side"] == "BID"] or None
+        asks = [(l["price"], l["quantity"]) for l in levels if l["side"] == "ASK"] or None
+        collect(builder.add_book(symbol, ts, bids, asks))
+    while next_level_one is not None:
+        collect(builder.add_trade(symbol, *next_level_one))
+        next_level_one = next(level_one, None)
+    collect(builder.flush())
+
+    book_rows.sort(key=lambda r: r[0])
+    trade_rows.sort(key=lambda r: r[0])
+    return iter(book_rows), iter(trade_rows)
+
+
+def _decode_print(schema, price, side):
+    """A stored print's price and book side (None inside the spread)."""
+    price, decoded = schema.decode_level(price, 0 if side is None else side)
+    return price, decoded if side is not None else None
+
+
+def has_trades(conn, symbol):
+    """True if the trades and volume_profile tables hold every print of symbol in this day file.
+
+    Day files recorded before the tables existed, or only partly, count as
+    not covered: their prints are rebuilt from the raw data instead.
+    """
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None:
+        return False
+    try:
+        first_trade = conn.execute(
+            f"SELECT MIN(timestamp) FROM trades WHERE {schema.symbol_column} = ?", (key,)
+        ).fetchone()[0]
+    except Exception:
+        # Day files written before trades were kept
+        return False
+    # Any print older than the first stored trade was recorded without them
+    earlier_print = conn.execute(
+        f"""
+        SELECT 1 FROM {schema.level_one_table}
+        WHERE {schema.symbol_column} = ? AND timestamp < ? AND last_price IS NOT NULL AND last_size > 0
+        LIMIT 1
+        """,
+        (key, first_trade if first_trade is not None else 2 ** 62)
+    ).fetchone()
+    return earlier_print is None
+
+
+def _trades_on_the_fly(conn, symbol):
+    """(timestamp, price, size, side) prints of symbol rebuilt from its raw book and level-one data."""
+    tape = TradeTape()
+    prints = []
+    level_one = iter_level_one(conn, symbol)
+    next_level_one = next(level_one, None)
+
+    def add(timestamp, last_price, last_size, underlying_price):
+        trade = tape.add_level_one(symbol, timestamp, last_price, last_size)
+        if trade is not None:
+            prints.append(trade)
+
+    for ts, levels in iter_book_snapshots(conn, symbol):
+        # Prints are classified against the book as it stood when they arrived
+        while next_level_one is not None and next_level_one[0] <= ts:
+            add(*next_level_one)
+            next_level_one = next(level_one, None)
+        bids = [(l["price"], l["quantity"]) for l in levels if l["side"] == "BID"] or None
+        asks = [(l["price"], l["quantity"]) for l in levels if l["side"] == "ASK"] or None
+        tape.add_book(symbol, bids, asks)
+    while next_level_one is not None:
+        add(*next_level_one)
+        next_level_one = next(level_one, None)
+    return prints
+
+
+def recent_trades(conn, symbol, start=None, end=None, limit=None):
+    """Newest-first (timestamp, price, size, side) prints of symbol within [start, end] ms, at most limit."""
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    if key is None:
+        return []
+    start = -1 if start is None else start
+    end = 2 ** 62 if end is None else end
+
+    if not has_trades(conn, symbol):
+        prints = [p for p in reversed(_trades_on_the_fly(conn, symbol)) if start <= p[0] <= end]
+        return prints[:limit] if limit else prints
+
+    rows = conn.execute(
+        f"""
+        SELECT timestamp, price, size, side
+        FROM trades
+        WHERE {schema.symbol_column} = ? AND timestamp BETWEEN ? AND ?
+        ORDER BY timestamp DESC
+        LIMIT ?
+        """,
+        (key, start, end, limit or -1)
+    )
+    trades = []
+    for ts, price, size, side in rows:
+        price, side = _decode_print(schema, price, side)
+        trades.append((ts, price, size, side))
+    return trades
+
+
+def volume_profile(conn, symbol, start=None, end=None):
+    """{price: [volume, bid_volume, ask_volume, trades]} of symbol's prints within [start, end] ms.
+
+    Profile buckets wholly inside the window are summed from volume_profile;
+    only the prints in the partial buckets at its edges are read from trades,
+    so the cost follows the window's length in minutes, not its trade count.
+    """
+    schema = schema_for(conn)
+    key = schema.symbol_key(conn, symbol)
+    levels = {}
+    if key is None:
+        return levels
+    start = -1 if start is None else start
+    end = 2 ** 62 if end is None else end
+
+    def add(price, volume, bid_volume, ask_volume, trades):
+        level = levels.get(price)
+        if level is None:
+            levels[price] = [volume, bid_volume, ask_volume, trades]
+        else:
+            level[0] += volume
+            level[1] += bid_volume
+            level[2] += ask_volume
+            level[3] += trades
+
+    def add_print(price, size, side):
+        add(price, size, size if side == "BID" else 0, size if side == "ASK" else 0, 1)
+
+    if not has_trades(conn, symbol):
+        for ts, price, size, side in _trades_on_the_fly(conn, symbol):
+            if start <= ts <= end:
+                add_print(price, size, side)
+        return levels
+
+    # Buckets [first, stop) lie wholly inside [start, end]
+    first = -(-start // PROFILE_BUCKET_MS) * PROFILE_BUCKET_MS
+    stop = (end + 1) // PROFILE_BUCKET_MS * PROFILE_BUCKET_MS
+    if first < stop:
+        for price, *sums in conn.execute(
+            f"""
+            SELECT price, SUM(volume), SUM(bid_volume), SUM(ask_volume), SUM(trades)
+            FROM volume_profile
+            WHERE {schema.symbol_column} = ? AND bucket >= ? AND bucket < ?
+            GROUP BY price
+            """,
+            (key, first, stop)
+        ):
+            add(_decode_print(schema, price, None)[0], *sums)
+        edges = [(start, first - 1), (stop, end)]
+    else:
+        edges = [(start, end)]
+
+    for lo, hi in edges:
+        if lo > hi:
+            continue
+        for price, size, side in conn.execute(
+            f"""
+            SELECT price, size, side FROM trades
+            WHERE {schema.symbol_column} = ? AND timestamp BETWEEN ? AND ?
+            """,
+            (key, lo, hi)
+        ):
+            price, side = _decode_print(schema, price, side)
+            add_print(price, size, side)
+    return levels
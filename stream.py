@@ -5,14 +5,19 @@ import sqlite3
 import dotenv
 import os
 import threading
-import requests
-from datetime import datetime, timedelta
-import schwabdev
+import queue
+from writer import BatchWriter
+from manifest import DayManifest, day_file_name, make_entry, session_date
+from replay import CaptureLog
+from logs import get_logger
+from metrics import Registry
+from shards import shard_dir, shard_of
+import storage
+
+log = get_logger("stream")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
-# Ensure data directory exists
-os.makedirs(DATA_DIR, exist_ok=True)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, 'data'))
 
 # Load environment variables
 try:
@@ -22,18 +27,26 @@ try:
 except:
     appKey = None
     appSecret = None
-    print("Failed to load environment variables. ")
+    log.warning("Failed to load environment variables.")
 
-try:
-    client = schwabdev.Client(appKey, appSecret)
-    streamer = client.stream
-    print("Connected to Schwab API")
-except Exception as e:
-    print(f"Failed to connect to Schwab API: {e}")
+# STREAM_OFFLINE=1 skips the Schwab client, for feeding the handler from replay.py
+STREAM_OFFLINE = os.getenv("STREAM_OFFLINE", "").lower() in ("1", "true", "yes")
+# Raw messages are also appended to this gzip log when set (replay it with replay.py)
+STREAM_CAPTURE = os.getenv("STREAM_CAPTURE")
 
-today_date = datetime.now().strftime('%y%m%d')
-# Use full path for the database file
-db_filename = os.path.join(DATA_DIR, f'options_data_{today_date}.db')
+# Created by connect() when the stream starts, so importing this module stays offline
+client = None
+streamer = None
+
+today_date = session_date()
+# Full path of the day file being written (set by use_data_dir); it moves to the next day's file at rollover
+db_filename = None
+# Index of day files, kept current for the API's cross-day queries
+day_manifest = None
+# Turns parsed updates into rows for the day file's schema and storage mode (set by use_data_dir)
+recorder = None
+# How often the live day file's manifest entry is rewritten (seconds)
+MANIFEST_INTERVAL = float(os.getenv("MANIFEST_INTERVAL", "10"))
 
 # Thread-local storage for database connections
 local = threading.local()
@@ -43,55 +56,108 @@ active_symbols = set()
 active_symbols_lock = threading.Lock()
 # Track when we last subscribed to each symbol
 symbol_subscription_times = {}
+# Symbols kept subscribed whatever the API asks, so the streamer is never left idle
+pinned_symbols = set()
+
+# Guards the switch to a new day file against writes from the streamer thread
+day_lock = threading.RLock()
+# symbol -> [first, last] timestamp written to the current day file
+day_extent = {}
 
-# API URL for the FastAPI service
+# Optional multiprocessing queue that carries live book events to the API process
+event_queue = None
+events_dropped = 0
+
+# With shards, one multiprocessing queue per shard worker; this process then only routes updates
+shard_queues = None
+# Seconds a full shard queue may hold up the stream callback before an update is dropped
+SHARD_PUT_TIMEOUT = float(os.getenv("SHARD_PUT_TIMEOUT", "0.5"))
+
+# API URL for the FastAPI service, polled for symbols only when stream.py runs on its own
 API_URL = "http://localhost:8080"  # Update this if your API runs on a different host/port
 
-def get_db_connection():
-    """Get a database connection for the current thread"""
-    if not hasattr(local, 'conn'):
-        local.conn = sqlite3.connect(db_filename)
+# Fields requested per subscription
+BOOK_FIELDS = "0,1,2,3,4,5,6,7,8"
+LEVEL_ONE_FIELDS = "0,1,2,3,4,18,35"
+# Most keys sent in one subscription request
+SUBSCRIBE_BATCH = 100
+
+def get_db_connection(path=None):
+    """Get a database connection to path (the current day file by default) for the current thread"""
+    path = path or db_filename
+    if getattr(local, 'path', None) != path:
+        if hasattr(local, 'conn'):
+            local.conn.close()
+        local.path = path
+        local.conn = sqlite3.connect(path)
         local.cursor = local.conn.cursor()
+
+        # WAL lets the API read while the writer thread commits
+        local.cursor.execute('PRAGMA journal_mode=WAL')
+        local.cursor.execute('PRAGMA synchronous=NORMAL')
         
-        # Create tables if they don't exist
-        local.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS options_book_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            symbol TEXT,
-            timestamp INTEGER,
-            price REAL,
-            quantity INTEGER,
-            side TEXT
-        )
-        ''')
-
-        local.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS level_one_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            symbol TEXT,
-            timestamp INTEGER,
-            last_price REAL,
-            last_size REAL,
-            underlying_price REAL
-        )
-        ''')
-        
-        # Create indices for faster querying
-        local.cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_symbol_ts ON options_book_data (symbol, timestamp)')
-        local.cursor.execute('CREATE INDEX IF NOT EXISTS idx_level_one_symbol_ts ON level_one_data (symbol, timestamp)')
-        
-        local.conn.commit()
+        # Create tables if they don't exist; existing files keep their schema version
+        local.schema = storage.ensure_schema(local.conn)
     
     return local.conn, local.cursor
 
-# Initialize the main thread's connection
-conn, cursor = get_db_connection()
+def connect():
+    """Create the Schwab client and its streamer (token handling and network calls happen here)"""
+    global client, streamer
+    try:
+        import schwabdev
+        client = schwabdev.Client(appKey, appSecret)
+        streamer = client.stream
+        log.info("Connected to Schwab API")
+    except Exception as e:
+        log.error("Failed to connect to Schwab API, not streaming: %s", e)
+    return streamer
+
+def use_data_dir(path):
+    """Record into today's day file in path; called before anything is written (main, a shard worker, replay)"""
+    global DATA_DIR, db_filename, day_manifest, recorder
+    os.makedirs(path, exist_ok=True)
+    DATA_DIR = path
+    db_filename = os.path.join(path, day_file_name(today_date))
+    day_manifest = DayManifest(path)
+    conn, _ = get_db_connection()
+    recorder = storage.BookRecorder(local.schema)
+    recorder.load_symbols(conn)
+    # Pick up where an earlier run of today left off
+    day_extent.clear()
+    day_extent.update({symbol: list(r) for symbol, r in storage.symbol_time_ranges(conn).items()})
+
+# All inserts go through a single writer thread; the handler only parses and queues rows
+writer = BatchWriter(lambda: get_db_connection()[0])
+
+# This process's metrics; the API serves them on /metrics
+metrics = Registry()
+# How often rendered metrics are sent to the API (seconds)
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "5"))
+handler_seconds = metrics.histogram("stream_handler_seconds", "Time to parse and queue one stream message")
+updates_total = metrics.counter("stream_updates_total", "Updates received", ("service", "symbol"))
+rows_total = metrics.counter("stream_rows_total", "Rows queued for the writer", ("service", "symbol"))
+handler_errors_total = metrics.counter("stream_handler_errors_total", "Messages the handler failed on")
+shard_messages_total = metrics.counter("stream_shard_messages_total", "Messages routed to a shard worker", ("to_shard",))
+shard_dropped_total = metrics.counter("stream_shard_dropped_total", "Messages dropped with a shard worker's queue full",
+                                      ("to_shard",))
+metrics.register(writer.commit_seconds)
+metrics.gauge("writer_queue_depth", "Batches waiting for the writer thread", collect=writer.queue_depth)
+metrics.counter("writer_rows_total", "Rows committed", collect=lambda: writer.get_stats()["written_rows"])
+metrics.counter("writer_dropped_rows_total", "Rows dropped with the writer queue full",
+                collect=lambda: writer.get_stats()["dropped_rows"])
+metrics.counter("stream_events_dropped_total", "Live book events the API queue had no room for",
+                collect=lambda: events_dropped)
+metrics.gauge("sqlite_file_bytes", "Size of the day file being written, WAL included", ("file",),
+              collect=lambda: {(os.path.basename(db_filename),): file_bytes(db_filename)} if db_filename else None)
+
+def file_bytes(path):
+    """Size of a SQLite file plus its WAL"""
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
 
 def my_handler(message):
+    started = time.perf_counter()
     try:
-        # Get thread-local connection
-        conn, cursor = get_db_connection()
-        
         data = json.loads(message)
         if "data" not in data:
             return
@@ -122,16 +188,23 @@ def my_handler(message):
                     
                     # Only save data if we have new bid/ask information
                     if bid_data or ask_data:
+                        rows = []
                         if bid_data:  # Bid data
-                            process_book_side(bid_data, symbol, book_timestamp, "BID", cursor)
+                            process_book_side(bid_data, symbol, book_timestamp, "BID", rows)
+                        bid_count = len(rows)
                         if ask_data:  # Ask data
-                            process_book_side(ask_data, symbol, book_timestamp, "ASK", cursor)
-                        print(f"Processed OPTIONS_BOOK for {symbol} with {len(bid_data) + len(ask_data)} levels at timestamp {book_timestamp}")
+                            process_book_side(ask_data, symbol, book_timestamp, "ASK", rows)
+                        bids = [(r[2], r[3]) for r in rows[:bid_count]] if bid_data else None
+                        asks = [(r[2], r[3]) for r in rows[bid_count:]] if ask_data else None
+                        queued = write_book(symbol, book_timestamp, bids, asks)
+                        publish_event(("book", symbol, book_timestamp, bids, asks))
+                        updates_total.inc(service, symbol)
+                        rows_total.inc(service, symbol, amount=queued)
+                        log.debug("Processed OPTIONS_BOOK for %s with %d levels at timestamp %s",
+                                  symbol, len(bid_data) + len(ask_data), book_timestamp)
 
                 elif service == "LEVELONE_OPTIONS":
-                    # Debug: log raw content and field values
-                    print(f"Raw LEVELONE_OPTIONS content for {symbol}: {content}")
-                    print(f"Extracted last_price(4): {content.get('4')}, last_size(18): {content.get('18')}, underlying_price(35): {content.get('35')}")
+                    log.debug("Raw LEVELONE_OPTIONS content for %s: %s", symbol, content)
                     # Get level one data fields
                     last_price = content.get("4")      # Last price
                     last_size = content.get("18")      # Last size
@@ -142,133 +215,424 @@ def my_handler(message):
 
                     # Only insert if we have meaningful data
                     if any([last_price is not None, last_size is not None, underlying_price is not None]):
-                        cursor.execute('''
-                            INSERT INTO level_one_data 
-                            (symbol, timestamp, last_price, last_size, underlying_price)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (symbol, options_timestamp, last_price, last_size, underlying_price))
-
-                        print(f"Inserted LEVELONE_OPTIONS: {symbol} - Last: {last_price}, Size: {last_size}, Underlying: {underlying_price}")
+                        queued = write_level_one(symbol, options_timestamp, last_price, last_size, underlying_price)
+                        publish_event(("level_one", symbol, options_timestamp, last_price, last_size, underlying_price))
+                        updates_total.inc(service, symbol)
+                        rows_total.inc(service, symbol, amount=queued)
+                        log.debug("Queued LEVELONE_OPTIONS: %s - Last: %s, Size: %s, Underlying: %s",
+                                  symbol, last_price, last_size, underlying_price)
                     else:
-                        print(f"No LEVELONE_OPTIONS data to insert for {symbol}")
+                        log.debug("No LEVELONE_OPTIONS data to insert for %s", symbol)
+
+    except Exception as e:
+        handler_errors_total.inc()
+        log.error("Error processing message: %s; message: %.500s", e, message)
+    finally:
+        handler_seconds.observe(time.perf_counter() - started)
+
+def route_message(message):
+    """Stream handler with shards: pass each symbol's updates on to the worker recording it.
+
+    A message whose symbols all belong to one shard is forwarded as received;
+    others are split into one message per shard. Parsing is all this process
+    does, the workers do the rest of my_handler and the writing.
+    """
+    started = time.perf_counter()
+    try:
+        data = json.loads(message)
+        if not data.get("data"):
+            return
 
-        conn.commit()
+        parts = {}
+        for item in data["data"]:
+            by_shard = {}
+            for content in item.get("content") or ():
+                symbol = content.get("key")
+                if symbol:
+                    by_shard.setdefault(shard_of(symbol, len(shard_queues)), []).append(content)
+            for shard, contents in by_shard.items():
+                parts.setdefault(shard, []).append({**item, "content": contents})
+
+        if len(parts) == 1:
+            (shard,) = parts
+            send_to_shard(shard, ("message", message))
+        else:
+            for shard, items in parts.items():
+                send_to_shard(shard, ("message", json.dumps({"data": items})))
 
     except Exception as e:
-        print(f"Error processing message: {e}")
-        print(f"Problematic message: {message}")
+        handler_errors_total.inc()
+        log.error("Error routing message: %s; message: %.500s", e, message)
+    finally:
+        handler_seconds.observe(time.perf_counter() - started)
+
+def send_to_shard(shard, item):
+    """Queue an item for a shard worker, dropping it if the queue stays full past SHARD_PUT_TIMEOUT"""
+    try:
+        shard_queues[shard].put(item, timeout=SHARD_PUT_TIMEOUT)
+        shard_messages_total.inc(str(shard))
+    except queue.Full:
+        shard_dropped_total.inc(str(shard))
+
+def write_book(symbol, timestamp, bids, asks):
+    """Queue a book update in the day file's schema and storage format; returns the rows queued"""
+    queued = 0
+    with day_lock:
+        for sql, rows in recorder.book(symbol, timestamp, bids, asks):
+            writer.put(sql, rows)
+            queued += len(rows)
+        note_extent(symbol, timestamp)
+    return queued
+
+def write_level_one(symbol, timestamp, last_price, last_size, underlying_price):
+    """Queue a level-one update for the current day file; returns the rows queued"""
+    queued = 0
+    with day_lock:
+        for sql, rows in recorder.level_one(symbol, timestamp, last_price, last_size, underlying_price):
+            writer.put(sql, rows)
+            queued += len(rows)
+    return queued
+
+def note_extent(symbol, timestamp):
+    """Track the time range written per symbol, for the manifest"""
+    extent = day_extent.get(symbol)
+    if extent is None:
+        day_extent[symbol] = [timestamp, timestamp]
+    elif timestamp > extent[1]:
+        extent[1] = timestamp
+    elif timestamp < extent[0]:
+        extent[0] = timestamp
 
-def process_book_side(side_data, symbol, timestamp, side_type, cursor):
+def flush_rollups(before=None, lag=None):
+    """Queue the rollup buckets that closed before `before` ms, or `lag` ms before the newest update (all of them if neither)"""
+    with day_lock:
+        for sql, rows in recorder.flush_rollups(before=before, lag=lag):
+            writer.put(sql, rows)
+
+def save_day_entry(live=True):
+    """Write the current day file's symbols and time range to the manifest"""
+    with day_lock:
+        path = db_filename
+        ranges = {symbol: tuple(extent) for symbol, extent in day_extent.items()}
+    try:
+        day_manifest.update({os.path.basename(path): make_entry(path, ranges, live)})
+    except OSError as e:
+        log.error("Error updating day file manifest: %s", e)
+
+def roll_day_file(date):
+    """Start recording into date's day file.
+
+    Open rollup buckets are closed into the old file, the writer switches
+    files after committing everything queued before the switch, and the old
+    file's manifest entry is finalized.
+    """
+    global today_date, db_filename, recorder, day_extent
+    path = os.path.join(DATA_DIR, day_file_name(date))
+    conn, _ = get_db_connection(path)
+    new_recorder = storage.BookRecorder(local.schema)
+    new_recorder.load_symbols(conn)
+    extent = {symbol: list(r) for symbol, r in storage.symbol_time_ranges(conn).items()}
+
+    with day_lock:
+        for sql, rows in recorder.flush_rollups():
+            writer.put(sql, rows)
+        writer.rotate(lambda: get_db_connection(path)[0])
+        old_path, old_extent = db_filename, day_extent
+        today_date, db_filename, recorder, day_extent = date, path, new_recorder, extent
+
+    log.info("Rolled over from %s to %s", old_path, path)
+    ranges = {symbol: tuple(r) for symbol, r in old_extent.items()}
+    try:
+        day_manifest.update({os.path.basename(old_path): make_entry(old_path, ranges)})
+    except OSError as e:
+        log.error("Error updating day file manifest: %s", e)
+    save_day_entry()
+
+def publish_event(event):
+    """Hand a parsed update to the API's live book cache without ever blocking the handler"""
+    global events_dropped
+    if event_queue is None:
+        return
+    try:
+        event_queue.put_nowait(event)
+    except queue.Full:
+        events_dropped += 1
+
+def process_book_side(side_data, symbol, timestamp, side_type, rows):
+    """Append one (symbol, timestamp, price, quantity, side) row per price level"""
     for price_level in side_data:
         price = price_level.get("0")
         quantity = price_level.get("1")
         if price is not None and quantity is not None:
-            cursor.execute('''
-                INSERT INTO options_book_data 
-                (symbol, timestamp, price, quantity, side)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (symbol, timestamp, price, quantity, side_type))
+            rows.append((symbol, timestamp, price, quantity, side_type))
 
 def fetch_active_symbols():
     """Fetch the active symbols list from the API"""
     try:
+        # Only needed when polling, so it's left out of the API's import
+        import requests
         response = requests.get(f"{API_URL}/active_symbols")
         if response.status_code == 200:
             data = response.json()
-            new_symbols = []
-            
+            listed = set(data.get("symbols", []))
+
+            # Mirror the API's list: new symbols are added, ones it dropped are unsubscribed
             with active_symbols_lock:
-                # Check for new symbols
-                for symbol in data.get("symbols", []):
-                    if symbol not in active_symbols:
-                        new_symbols.append(symbol)
-                        active_symbols.add(symbol)
-                        # Create initial empty data for this symbol
-                        create_empty_data_for_symbol(symbol)
-                
-            if new_symbols:
-                print(f"Added new symbols: {new_symbols}")
-                
+                gone = [s for s in active_symbols if s not in listed]
+            handle_commands([("subscribe", list(listed)), ("unsubscribe", gone)])
+
             return active_symbols
         else:
-            print(f"Failed to fetch active symbols, status code: {response.status_code}")
+            log.warning("Failed to fetch active symbols, status code: %s", response.status_code)
             return set()
     except Exception as e:
-        print(f"Error fetching active symbols: {e}")
+        log.warning("Error fetching active symbols: %s", e)
         return set()
 
+def send_subscriptions(symbols, command):
+    """Send one multi-key OPTIONS_BOOK and LEVELONE_OPTIONS request per batch of symbols"""
+    symbols = list(symbols)
+    for i in range(0, len(symbols), SUBSCRIBE_BATCH):
+        keys = symbols[i:i + SUBSCRIBE_BATCH]
+        streamer.send([
+            streamer.options_book(keys, BOOK_FIELDS, command=command),
+            streamer.level_one_options(keys, LEVEL_ONE_FIELDS, command=command),
+        ])
+
 def subscribe_to_symbols(symbols):
-    """Subscribe to the given symbols"""
-    current_time = time.time()
-    
-    for symbol in symbols:
-        try:
-            # Check if we need to subscribe
-            if (symbol not in symbol_subscription_times):
-                
-                print(f"Subscribing to OPTIONS_BOOK and LEVELONE_OPTIONS for {symbol}")
-                streamer.send(streamer.options_book(symbol, "0,1,2,3,4,5,6,7,8"))
-                streamer.send(streamer.level_one_options(symbol, "0,1,2,3,4,18,35"))
-                
-                # Update subscription time
-                symbol_subscription_times[symbol] = current_time
-                
-                # Small delay to avoid overwhelming the API
-                time.sleep(0.1)
-        except Exception as e:
-            print(f"Error subscribing to {symbol}: {e}")
+    """Subscribe to the given symbols not already subscribed, in batched requests"""
+    new_symbols = [s for s in symbols if s not in symbol_subscription_times]
+    if not new_symbols:
+        return
+    try:
+        log.info("Subscribing to OPTIONS_BOOK and LEVELONE_OPTIONS for %d symbols: %s", len(new_symbols), new_symbols)
+        send_subscriptions(new_symbols, "ADD")
+        current_time = time.time()
+        for symbol in new_symbols:
+            symbol_subscription_times[symbol] = current_time
+    except Exception as e:
+        log.error("Error subscribing to %s: %s", new_symbols, e)
+
+def unsubscribe_from_symbols(symbols):
+    """Stop streaming the given symbols, in batched requests"""
+    symbols = [s for s in symbols if s in symbol_subscription_times and s not in pinned_symbols]
+    if not symbols:
+        return
+    try:
+        log.info("Unsubscribing from OPTIONS_BOOK and LEVELONE_OPTIONS for %d symbols: %s", len(symbols), symbols)
+        send_subscriptions(symbols, "UNSUBS")
+        for symbol in symbols:
+            symbol_subscription_times.pop(symbol, None)
+    except Exception as e:
+        log.error("Error unsubscribing from %s: %s", symbols, e)
+
+def handle_commands(commands):
+    """Apply ("subscribe" | "unsubscribe", [symbols]) commands sent by the API process.
+
+    Commands that arrived together are coalesced, so each direction costs one
+    batched request no matter how many symbols it carries.
+    """
+    wanted = {}
+    for command in commands:
+        action, symbols = command
+        if action not in ("subscribe", "unsubscribe"):
+            log.warning("Unknown stream command: %s", command)
+            continue
+        for symbol in symbols:
+            # The latest command for a symbol wins
+            wanted[symbol] = action == "subscribe"
+
+    with active_symbols_lock:
+        added = [s for s, subscribe in wanted.items() if subscribe and s not in active_symbols]
+        removed = [s for s, subscribe in wanted.items() if not subscribe and s in active_symbols and s not in pinned_symbols]
+        for symbol in added:
+            active_symbols.add(symbol)
+            # Create initial empty data for this symbol
+            create_empty_data_for_symbol(symbol)
+        active_symbols.difference_update(removed)
+
+    if added:
+        subscribe_to_symbols(added)
+    if removed:
+        unsubscribe_from_symbols(removed)
 
 def create_empty_data_for_symbol(symbol):
     """Create empty initial data for a symbol to ensure it appears in the database"""
-    conn, cursor = get_db_connection()
-    
+    if shard_queues is not None:
+        # The worker recording symbol writes it
+        send_to_shard(shard_of(symbol, len(shard_queues)), ("placeholder", symbol))
+        return
     current_timestamp = int(time.time() * 1000)
     
     try:
-        # Insert a placeholder bid and ask level
-        cursor.execute('''
-            INSERT INTO options_book_data 
-            (symbol, timestamp, price, quantity, side)
-            VALUES (?, ?, 0, 0, 'BID')
-        ''', (symbol, current_timestamp))
-        
-        cursor.execute('''
-            INSERT INTO options_book_data 
-            (symbol, timestamp, price, quantity, side)
-            VALUES (?, ?, 0, 0, 'ASK')
-        ''', (symbol, current_timestamp))
+        # Queue a placeholder bid and ask level
+        write_book(symbol, current_timestamp, [(0, 0)], [(0, 0)])
         
-        # Insert placeholder level one data
-        cursor.execute('''
-            INSERT INTO level_one_data 
-            (symbol, timestamp, last_price, last_size, underlying_price)
-            VALUES (?, ?, NULL, NULL, NULL)
-        ''', (symbol, current_timestamp))
+        # Queue placeholder level one data
+        write_level_one(symbol, current_timestamp, None, None, None)
         
-        conn.commit()
-        print(f"Created initial empty data for {symbol}")
+        log.debug("Created initial empty data for %s", symbol)
     except Exception as e:
-        print(f"Error creating empty data for {symbol}: {e}")
+        log.error("Error creating empty data for %s: %s", symbol, e)
+
+def session_symbol(date):
+    """The SPY 0DTE contract kept subscribed during date's session"""
+    return f"SPY   {date}C00500000"  # Using 500 strike price
+
+def pin_session_symbol(date):
+    """Pin date's session symbol and release the previous one"""
+    symbol = session_symbol(date)
+    with active_symbols_lock:
+        previous = [s for s in pinned_symbols if s != symbol]
+        pinned_symbols.difference_update(previous)
+        pinned_symbols.add(symbol)
+        if symbol not in active_symbols:
+            active_symbols.add(symbol)
+            create_empty_data_for_symbol(symbol)
+    return symbol, previous
+
+def maintain_day_file(current_time, timers):
+    """Periodic upkeep of the day file being recorded; timers holds when each task last ran.
+
+    Closes rollup buckets of symbols that have gone quiet, moves to a new
+    session's day file and keeps the live file's manifest entry current.
+    """
+    # Allow a second of feed time for late updates; message timestamps, not the wall clock, decide
+    if current_time - timers.setdefault("rollups", current_time) > 1:
+        flush_rollups(lag=1000)
+        timers["rollups"] = current_time
+
+    # A new session starts a new day file
+    session = session_date()
+    if session != today_date:
+        roll_day_file(session)
+
+    # Keep the live file's manifest entry current for cross-day queries
+    if current_time - timers.setdefault("manifest", current_time) > MANIFEST_INTERVAL:
+        save_day_entry()
+        timers["manifest"] = current_time
+
+def publish_metrics(source, current_time, timers):
+    """Hand this process's metrics to the API for /metrics every METRICS_INTERVAL seconds"""
+    if event_queue is not None and current_time - timers.setdefault("metrics", current_time) > METRICS_INTERVAL:
+        publish_event(("metrics", source, metrics.render()))
+        timers["metrics"] = current_time
+
+def record_shard(shard, shards, messages, book_events=None):
+    """Run a shard worker: record what the stream routes to it into the shard's own data directory.
+
+    messages carries ("message", raw) for the shard's symbols and
+    ("placeholder", symbol) for ones just subscribed; None stops the worker
+    once everything before it is written.
+    """
+    global event_queue
+    event_queue = book_events
+    use_data_dir(shard_dir(DATA_DIR, shard, shards))
+    metrics.labels["shard"] = shard
+    source = f"stream-shard-{shard}"
+    timers = {}
+
+    try:
+        writer.start()
+        day_manifest.refresh(skip={os.path.basename(db_filename)})
+        save_day_entry()
+        log.info("Shard %d of %d recording into %s", shard, shards, DATA_DIR)
+
+        stats_report_time = time.time()
+        while True:
+            try:
+                item = messages.get(timeout=0.1)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                kind, payload = item
+                if kind == "message":
+                    my_handler(payload)
+                elif kind == "placeholder":
+                    create_empty_data_for_symbol(payload)
+
+            current_time = time.time()
+            maintain_day_file(current_time, timers)
+            publish_metrics(source, current_time, timers)
+
+            # Report writer throughput and backpressure once a minute
+            if current_time - stats_report_time > 60:
+                log.info("Shard %d writer stats: %s", shard, writer.get_stats())
+                stats_report_time = current_time
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        flush_rollups()
+        writer.stop()
+        save_day_entry(live=False)
+        log.info("Shard %d stopped, writer stats: %s", shard, writer.get_stats())
+        if hasattr(local, 'conn'):
+            local.conn.close()
+
+def main(book_events=None, commands=None, shards=None):
+    """Run the stream.
+
+    book_events is an optional queue the API reads live book updates from, and
+    commands an optional queue of subscription commands from the API, where
+    ("stop", None) shuts the stream down cleanly. Without
+    commands, the API's /active_symbols endpoint is polled instead. shards is
+    an optional list of shard worker queues (see record_shard): this process
+    then keeps the connection and subscriptions and routes updates to them.
+    """
+    global event_queue, shard_queues
+    event_queue = book_events
+    shard_queues = shards
+    recording = shards is None
+    capture = None
+    timers = {}
+
+    if recording:
+        # Open today's day file first, so the API has it to read while the client connects
+        use_data_dir(DATA_DIR)
+    if streamer is None and not STREAM_OFFLINE:
+        connect()
+    if streamer is None:
+        # Nothing to stream from: exit rather than fail on the missing streamer (connect() logged why)
+        if STREAM_OFFLINE:
+            log.error("STREAM_OFFLINE is set, not streaming (feed recorded messages with replay.py)")
+        if hasattr(local, 'conn'):
+            local.conn.close()
+        return
 
-def main():
     # Run in Schwab API mode
     try:
+        handler = my_handler
+        if recording:
+            # Start the writer before the streamer so no message finds it missing
+            writer.start()
+        else:
+            handler = route_message
+            log.info("Routing updates to %d shard workers", len(shards))
+
         # Start the streamer
-        streamer.start(my_handler)
+        if STREAM_CAPTURE:
+            capture = CaptureLog(STREAM_CAPTURE)
+            handler = capture.wrap(handler)
+            log.info("Capturing raw stream messages to %s", STREAM_CAPTURE)
+        streamer.start(handler)
         
+        if recording:
+            # Index day files recorded while the stream was not running
+            day_manifest.refresh(skip={os.path.basename(db_filename)})
+            save_day_entry()
+
         # Initial symbol to subscribe to.
         # If we dont subscribe to any symbol within 90 seconds, the API will disconnect us.
-        today = datetime.now()
-        date_str = today.strftime('%y%m%d')
-        initial_symbol = f"SPY   {date_str}C00500000"  # Using 500 strike price
-        
-        with active_symbols_lock:
-            active_symbols.add(initial_symbol)
-            create_empty_data_for_symbol(initial_symbol)
+        pinned_date = today_date
+        initial_symbol, _ = pin_session_symbol(pinned_date)
         
         def update_subscriptions():
-            # Fetch active symbols from API
-            api_symbols = fetch_active_symbols()
+            # Fetch active symbols from API when it isn't sending us commands
+            if commands is None:
+                fetch_active_symbols()
             
             # Get current symbols with thread safety
             with active_symbols_lock:
@@ -286,26 +650,72 @@ def main():
         
         # Refresh subscriptions periodically to pick up new symbols
         symbols_check_time = time.time()
+        stats_report_time = time.time()
         
-        print(f"Stream running. Press Ctrl+C to stop.")
+        log.info("Stream running. Press Ctrl+C to stop.")
         while True:
-            time.sleep(0.1)
+            if commands is not None:
+                # Subscription commands are applied as soon as they arrive, in batches
+                pending = []
+                try:
+                    pending.append(commands.get(timeout=0.1))
+                    while True:
+                        pending.append(commands.get_nowait())
+                except queue.Empty:
+                    pass
+                # ("stop", None) from the API ends the stream, writing out what is queued first
+                stopping = any(command[0] == "stop" for command in pending)
+                pending = [command for command in pending if command[0] != "stop"]
+                if pending:
+                    handle_commands(pending)
+                if stopping:
+                    log.info("Stopping stream...")
+                    break
+            else:
+                time.sleep(0.1)
             
             current_time = time.time()
             
             # Check for new symbols every 5 seconds
-            if current_time - symbols_check_time > 5:
+            if commands is None and current_time - symbols_check_time > 5:
                 update_subscriptions()
                 symbols_check_time = current_time
 
+            # Shard workers look after their own day files
+            if recording:
+                maintain_day_file(current_time, timers)
+
+            # A new session pins its own contract
+            session = session_date()
+            if session != pinned_date:
+                initial_symbol, previous = pin_session_symbol(session)
+                subscribe_to_symbols([initial_symbol])
+                handle_commands([("unsubscribe", previous)])
+                pinned_date = session
+
+            publish_metrics("stream", current_time, timers)
+
+            # Report writer throughput and backpressure once a minute
+            if recording and current_time - stats_report_time > 60:
+                log.info("Writer stats: %s, book events dropped: %d", writer.get_stats(), events_dropped)
+                stats_report_time = current_time
     
     except KeyboardInterrupt:
-        print("Stopping stream...")
+        log.info("Stopping stream...")
     finally:
         streamer.stop()
+        if capture is not None:
+            capture.close()
+            log.info("Captured %d messages", capture.messages)
+        if recording:
+            # Write the partial rollup buckets, then flush everything still queued before closing the connection
+            flush_rollups()
+            writer.stop()
+            save_day_entry(live=False)
+            log.info("Writer stats: %s", writer.get_stats())
         if hasattr(local, 'conn'):
             local.conn.close()
-        print("Stream stopped and database connection closed.")
+        log.info("Stream stopped and database connection closed.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
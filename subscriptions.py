@@ -0,0 +1,106 @@
+# subscriptions.py
+import os
+import threading
+import time
+
+# Unsubscribe a symbol nobody holds once it has not been requested for this long
+SUBSCRIPTION_TTL = float(os.getenv("SUBSCRIPTION_TTL", "300"))
+# Most symbols streamed at once; least recently used idle symbols are evicted beyond it
+MAX_SYMBOLS = int(os.getenv("MAX_SYMBOLS", "100"))
+
+
+class SubscriptionManager:
+    """Decide which symbols the stream should be subscribed to.
+
+    Long-lived viewers (WebSocket clients) hold a reference to each symbol they
+    watch; polling requests only refresh a symbol's last-seen time. A symbol is
+    dropped when nobody holds it and it has been idle past ttl, or, when the
+    max_symbols budget is reached, the least recently used unheld symbol is
+    evicted to make room. Held symbols are never evicted.
+
+    Methods return (added, removed) symbol lists for the caller to forward to
+    the stream process.
+    """
+
+    def __init__(self, ttl=SUBSCRIPTION_TTL, max_symbols=MAX_SYMBOLS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_symbols = max_symbols
+        self._clock = clock
+        self._holders = {}    # symbol -> set of holder ids
+        self._last_seen = {}  # symbol -> clock time; insertion order is LRU order
+        self._lock = threading.Lock()
+        self.stats = {"added": 0, "expired": 0, "evicted": 0, "over_budget": 0}
+
+    def _seen(self, symbol):
+        # Move to the most recently used end
+        self._last_seen.pop(symbol, None)
+        self._last_seen[symbol] = self._clock()
+
+    def _admit(self, symbol):
+        """Start tracking symbol, evicting LRU idle symbols over budget. Returns (added, removed)."""
+        removed = []
+        while len(self._last_seen) >= self.max_symbols:
+            victim = next((s for s in self._last_seen if not self._holders.get(s)), None)
+            if victim is None:
+                # Everything is being viewed; go over budget rather than cut off a viewer
+                self.stats["over_budget"] += 1
+                break
+            self._forget(victim)
+            removed.append(victim)
+            self.stats["evicted"] += 1
+        self._seen(symbol)
+        self.stats["added"] += 1
+        return [symbol], removed
+
+    def _forget(self, symbol):
+        self._last_seen.pop(symbol, None)
+        self._holders.pop(symbol, None)
+
+    def touch(self, symbol):
+        """A polling request for symbol: subscribe if needed and refresh its idle timer."""
+        with self._lock:
+            if symbol in self._last_seen:
+                self._seen(symbol)
+                return [], []
+            return self._admit(symbol)
+
+    def acquire(self, symbol, holder):
+        """holder (any hashable id) starts viewing symbol."""
+        with self._lock:
+            self._holders.setdefault(symbol, set()).add(holder)
+            if symbol in self._last_seen:
+                self._seen(symbol)
+                return [], []
+            return self._admit(symbol)
+
+    def release(self, symbol, holder):
+        """holder stops viewing symbol. It stays subscribed until it idles out or is evicted."""
+        with self._lock:
+            holders = self._holders.get(symbol)
+            if holders is not None:
+                holders.discard(holder)
+                if not holders:
+                    del self._holders[symbol]
+                if symbol in self._last_seen:
+                    self._seen(symbol)
+
+    def expire(self):
+        """Drop unheld symbols idle for longer than ttl. Returns (added, removed)."""
+        cutoff = self._clock() - self.ttl
+        with self._lock:
+            removed = [
+                s for s, seen in self._last_seen.items()
+                if seen < cutoff and not self._holders.get(s)
+            ]
+            for symbol in removed:
+                self._forget(symbol)
+            self.stats["expired"] += len(removed)
+        return [], removed
+
+    def symbols(self):
+        with self._lock:
+            return list(self._last_seen)
+
+    def holder_count(self, symbol):
+        with self._lock:
+            return len(self._holders.get(symbol, ()))
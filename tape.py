@@ -0,0 +1,75 @@
+# tape.py
+import threading
+
+# Width of the volume_profile buckets; a window's whole buckets are summed, its partial ones read from trades
+PROFILE_BUCKET_MS = 60_000
+
+
+class TradeTape:
+    """Turn level-one updates into trade prints, classified against the latest book.
+
+    A print is a level-one update with a positive last_size (as trade_rollup
+    counts volume), at the update's last_price or, when the update leaves it
+    out, the last one seen for the symbol. Its side is the book side it traded
+    against: "ASK" at or above the best ask (a buyer lifting the offer), "BID"
+    at or below the best bid, None inside the spread or before any book.
+    Prints of a symbol get strictly increasing timestamps, like stored books.
+    """
+
+    def __init__(self):
+        self._touch = {}         # symbol -> [best bid, best ask]
+        self._last_price = {}
+        self._last_timestamp = {}
+        self._lock = threading.Lock()
+
+    def add_book(self, symbol, bids=None, asks=None):
+        """Track the touch from a book update given as [(price, quantity)] per side (None = side not in update)."""
+        with self._lock:
+            touch = self._touch.setdefault(symbol, [None, None])
+            if bids is not None:
+                touch[0] = max((p for p, q in bids if q), default=None)
+            if asks is not None:
+                touch[1] = min((p for p, q in asks if q), default=None)
+
+    def add_level_one(self, symbol, timestamp, last_price=None, last_size=None):
+        """(timestamp, price, size, side) if the update is a print, otherwise None."""
+        with self._lock:
+            if last_price is not None:
+                self._last_price[symbol] = last_price
+            price = self._last_price.get(symbol)
+            if not last_size or last_size <= 0 or price is None:
+                return None
+
+            last = self._last_timestamp.get(symbol)
+            if last is not None and timestamp <= last:
+                timestamp = last + 1
+            self._last_timestamp[symbol] = timestamp
+
+            bid, ask = self._touch.get(symbol, (None, None))
+            side = None
+            if ask is not None and price >= ask:
+                side = "ASK"
+            elif bid is not None and price <= bid:
+                side = "BID"
+            return timestamp, price, last_size, side
+
+
+def profile_bucket(timestamp):
+    return timestamp - timestamp % PROFILE_BUCKET_MS
+
+
+def summarize_profile(levels):
+    """Totals, VWAP and point of control of {price: [volume, bid_volume, ask_volume, trades]}."""
+    volume = sum(v[0] for v in levels.values())
+    turnover = sum(price * v[0] for price, v in levels.items())
+    poc = max(levels.items(), key=lambda item: (item[1][0], item[0]))[0] if levels else None
+    return {
+        "volume": volume,
+        "trades": sum(v[3] for v in levels.values()),
+        "vwap": round(turnover / volume, 4) if volume else None,
+        "poc": poc,
+        "levels": [
+            {"price": price, "volume": v[0], "bid_volume": v[1], "ask_volume": v[2], "trades": v[3]}
+            for price, v in sorted(levels.items())
+        ],
+    }
@@ -0,0 +1,93 @@
+# tests/test_rollup.py
+import random
+
+import pytest
+
+from rollup import RollupBuilder
+
+START = 1_700_000_000_000
+
+
+def test_bucket_closes_on_the_next_one():
+    builder = RollupBuilder([1])
+    assert builder.add_book("SPY", START, [(1.0, 10)], [(1.1, 4)]) == ([], [])
+    assert builder.add_book("SPY", START + 500, [(1.0, 20)], [(1.1, 4)]) == ([], [])
+    assert builder.add_trade("SPY", START + 600, 1.05, 2, 500.0) == ([], [])
+    assert builder.add_trade("SPY", START + 700, 1.02, 1, 501.0) == ([], [])
+
+    book_rows, trade_rows = builder.add_book("SPY", START + 1000, [(1.0, 5)], None)
+    assert sorted(book_rows) == [
+        # max, time-weighted avg and last quantity over the bucket
+        ("SPY", 1, START, "ASK", 1.1, 4, 4.0, 4),
+        ("SPY", 1, START, "BID", 1.0, 20, 15.0, 20),
+    ]
+    assert trade_rows == [("SPY", 1, START, 1.05, 1.05, 1.02, 1.02, 3, 501.0)]
+
+
+def test_levels_carry_into_the_next_bucket():
+    builder = RollupBuilder([1])
+    builder.add_book("SPY", START + 500, [(1.0, 10)], None)
+    builder.add_book("SPY", START + 1000, None, [(1.1, 2)])
+    book_rows, _ = builder.flush()
+    assert sorted(book_rows) == [
+        ("SPY", 1, START + 1000, "ASK", 1.1, 2, 2.0, 2),
+        ("SPY", 1, START + 1000, "BID", 1.0, 10, 10.0, 10),
+    ]
+
+
+def test_removed_levels_average_down():
+    builder = RollupBuilder([1])
+    builder.add_book("SPY", START, [(1.0, 10)], [])
+    builder.add_book("SPY", START + 250, [], [])
+    book_rows, _ = builder.flush()
+    assert book_rows == [("SPY", 1, START, "BID", 1.0, 10, 2.5, 0)]
+
+
+def feed(seed, updates=500):
+    rnd = random.Random(seed)
+    ts = START
+    for _ in range(updates):
+        ts += rnd.choice((3, 200, 900, 4000))
+        symbol = rnd.choice(("SPY", "QQQ"))
+        if rnd.random() < 0.3:
+            yield "trade", (symbol, ts, round(rnd.uniform(1, 2), 2), rnd.choice((0, 1, 5)), 500.0)
+        else:
+            bids = [(round(1 + k * 0.05, 2), rnd.randint(0, 9)) for k in rnd.sample(range(10), 3)]
+            yield "book", (symbol, ts, bids, [(2.0, rnd.randint(1, 9))])
+
+
+def run(updates, flush_every=None):
+    """Every stored row, flushing with a 1 s lag every flush_every updates (rows written later replace earlier ones)."""
+    builder = RollupBuilder()
+    stored = {}
+
+    def keep(closed):
+        book_rows, trade_rows = closed
+        for row in book_rows:
+            stored[("book",) + row[:5]] = row
+        for row in trade_rows:
+            stored[("trade",) + row[:3]] = row
+
+    for index, (kind, args) in enumerate(updates):
+        keep(builder.add_book(*args) if kind == "book" else builder.add_trade(*args))
+        if flush_every and index % flush_every == 0:
+            keep(builder.flush(builder.newest - 1000))
+    keep(builder.flush())
+    return stored
+
+
+@pytest.mark.parametrize("flush_every", [1, 7, 50])
+def test_flushing_never_writes_partial_buckets(flush_every):
+    updates = list(feed(seed=flush_every))
+    assert run(updates, flush_every) == run(updates)
+
+
+def test_late_update_rewrites_the_whole_flushed_bucket():
+    builder = RollupBuilder([1])
+    builder.add_trade("SPY", START, 1.0, 1)
+    assert builder.flush(START + 1000) == ([], [("SPY", 1, START, 1.0, 1.0, 1.0, 1.0, 1, None)])
+    # Flushed rows aren't written again until something new lands in them
+    assert builder.flush(START + 1000) == ([], [])
+    builder.add_trade("SPY", START + 500, 1.2, 2)
+    assert builder.flush(START + 1000) == ([], [("SPY", 1, START, 1.0, 1.2, 1.0, 1.2, 3, None)])
+    assert builder.flush() == ([], [])
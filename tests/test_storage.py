@@ -0,0 +1,163 @@
+# tests/test_storage.py
+import random
+import sqlite3
+
+import pytest
+
+import storage
+
+SYMBOLS = ("SPY   250423C00500000", "QQQ   250423P00400000")
+START = 1_700_000_000_000
+
+
+def make_conn(version):
+    conn = sqlite3.connect(":memory:")
+    if version == storage.LEGACY_SCHEMA:
+        # ensure_schema only keeps the legacy layout for files that already have its tables
+        storage.LegacySchema().create(conn.cursor())
+    storage.ensure_schema(conn)
+    return conn
+
+
+def make_feed(seed=1, updates=400):
+    """Two-sided book updates with distinct timestamps per symbol, some levels at quantity 0."""
+    rnd = random.Random(seed)
+    ts = START
+    feed = []
+    for _ in range(updates):
+        ts += rnd.choice((1, 250, 1500))
+        bids = [(round(1 + k * 0.05, 2), rnd.choice((0, 1, 5, 10))) for k in rnd.sample(range(20), rnd.randint(1, 8))]
+        asks = [(round(2 + k * 0.05, 2), rnd.choice((0, 3, 7))) for k in rnd.sample(range(20), rnd.randint(1, 8))]
+        feed.append((rnd.choice(SYMBOLS), ts, bids, asks))
+    return feed
+
+
+def record(conn, batches):
+    for sql, rows in batches:
+        conn.executemany(sql, rows)
+    conn.commit()
+
+
+def store(version, mode, feed, **kwargs):
+    conn = make_conn(version)
+    recorder = storage.BookRecorder(storage.schema_for(conn), mode, keyframe_every=7, **kwargs)
+    for symbol, ts, bids, asks in feed:
+        record(conn, recorder.book(symbol, ts, bids, asks))
+    record(conn, recorder.flush_rollups())
+    return conn
+
+
+def expected_levels(bids, asks):
+    levels = [{"price": p, "quantity": q, "side": "BID"} for p, q in bids]
+    levels += [{"price": p, "quantity": q, "side": "ASK"} for p, q in asks]
+    return sorted(levels, key=storage.level_order)
+
+
+def snapshots(conn, symbol, since=None):
+    return list(storage.iter_book_snapshots(conn, symbol, since))
+
+
+SCHEMAS = [storage.LEGACY_SCHEMA, storage.COMPACT_SCHEMA]
+MODES = ["full", "delta"]
+
+
+@pytest.mark.parametrize("version", SCHEMAS)
+@pytest.mark.parametrize("mode", MODES)
+def test_books_round_trip(version, mode):
+    feed = make_feed()
+    conn = store(version, mode, feed)
+    for symbol in SYMBOLS:
+        written = [(ts, expected_levels(bids, asks)) for s, ts, bids, asks in feed if s == symbol]
+        assert snapshots(conn, symbol) == written
+
+
+@pytest.mark.parametrize("version", SCHEMAS)
+def test_delta_reads_back_like_full(version):
+    feed = make_feed(seed=2)
+    full = store(version, "full", feed)
+    delta = store(version, "delta", feed)
+    assert storage.uses_delta(delta) and not storage.uses_delta(full)
+    for symbol in SYMBOLS:
+        assert snapshots(delta, symbol) == snapshots(full, symbol)
+        assert storage.latest_book(delta, symbol) == storage.latest_book(full, symbol)
+    assert storage.latest_books(delta, SYMBOLS) == storage.latest_books(full, SYMBOLS)
+
+
+def test_schemas_read_back_alike():
+    feed = make_feed(seed=3)
+    for mode in MODES:
+        legacy = store(storage.LEGACY_SCHEMA, mode, feed)
+        compact = store(storage.COMPACT_SCHEMA, mode, feed)
+        for symbol in SYMBOLS:
+            assert snapshots(legacy, symbol) == snapshots(compact, symbol)
+            for resolution in (1, 60):
+                assert (list(storage.iter_rollup_snapshots(legacy, symbol, resolution))
+                        == list(storage.iter_rollup_snapshots(compact, symbol, resolution)))
+
+
+@pytest.mark.parametrize("version", SCHEMAS)
+@pytest.mark.parametrize("mode", MODES)
+def test_since_cursor(version, mode):
+    feed = make_feed(seed=4)
+    conn = store(version, mode, feed)
+    symbol = SYMBOLS[0]
+    every = snapshots(conn, symbol)
+    # Cursors that fall between keyframes replay from the one before them
+    for index in (0, 5, 13, len(every) - 1):
+        cursor = every[index][0]
+        assert snapshots(conn, symbol, since=cursor) == every[index + 1:]
+        assert storage.count_snapshots(conn, symbol, since=cursor) == len(every) - index - 1
+
+
+@pytest.mark.parametrize("version", SCHEMAS)
+def test_history_version_moves_with_new_books(version):
+    conn = make_conn(version)
+    recorder = storage.BookRecorder(storage.schema_for(conn), "full")
+    record(conn, recorder.book("SPY", START, [(1.0, 1)], [(1.1, 1)]))
+    first = storage.history_version(conn, "SPY")
+    assert storage.history_version(conn, "SPY") == first
+    record(conn, recorder.book("SPY", START + 1, [(1.0, 2)], [(1.1, 1)]))
+    assert storage.history_version(conn, "SPY") != first
+
+
+def test_compact_keeps_updates_in_the_same_ms():
+    conn = make_conn(storage.COMPACT_SCHEMA)
+    recorder = storage.BookRecorder(storage.schema_for(conn), "full", rollups=False, trades=False)
+    record(conn, recorder.book("SPY", START, [(1.0, 1)], [(1.1, 1)]))
+    record(conn, recorder.book("SPY", START, [(1.0, 2)], [(1.1, 1)]))
+    record(conn, recorder.level_one("SPY", START, 1.05, 1, 500.0))
+    record(conn, recorder.level_one("SPY", START, 1.06, 2, 500.0))
+    assert [ts for ts, _ in snapshots(conn, "SPY")] == [START, START + 1]
+    assert [row[0] for row in storage.iter_level_one(conn, "SPY")] == [START, START + 1]
+
+
+@pytest.mark.parametrize("version", SCHEMAS)
+def test_stored_rollups_match_on_the_fly(version):
+    feed = make_feed(seed=5)
+    stored = store(version, "full", feed)
+    raw = store(version, "full", feed, rollups=False)
+    for symbol in SYMBOLS:
+        assert storage.has_rollups(stored, symbol, 1) and not storage.has_rollups(raw, symbol, 1)
+        for agg in ("max", "avg", "last"):
+            assert (list(storage.iter_rollup_snapshots(stored, symbol, 1, agg))
+                    == list(storage.iter_rollup_snapshots(raw, symbol, 1, agg)))
+
+
+@pytest.mark.parametrize("version", SCHEMAS)
+def test_prints_written_twice_count_once(version):
+    conn = make_conn(version)
+
+    def ingest():
+        recorder = storage.BookRecorder(storage.schema_for(conn), "full", rollups=False)
+        record(conn, recorder.book("SPY", START, [(1.0, 5)], [(1.1, 5)]))
+        for i, (price, size) in enumerate([(1.1, 2), (1.0, 3), (1.05, 1), (1.1, 4)]):
+            record(conn, recorder.level_one("SPY", START + 30_000 * (i + 1), price, size, 500.0))
+
+    ingest()
+    once = storage.volume_profile(conn, "SPY")
+    ingest()
+    assert storage.volume_profile(conn, "SPY") == once
+    assert len(storage.recent_trades(conn, "SPY")) == 4
+    assert once == {1.1: [6, 0, 6, 2], 1.0: [3, 3, 0, 1], 1.05: [1, 0, 0, 1]}
+    # Whole profile buckets and the prints at a window's edges sum alike
+    assert storage.volume_profile(conn, "SPY", START + 45_000, START + 130_000) == {1.0: [3, 3, 0, 1], 1.05: [1, 0, 0, 1], 1.1: [4, 0, 4, 1]}
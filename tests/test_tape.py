@@ -0,0 +1,57 @@
+# tests/test_tape.py
+from tape import PROFILE_BUCKET_MS, TradeTape, profile_bucket, summarize_profile
+
+START = 1_700_000_000_000
+
+
+def test_prints_take_the_side_they_hit():
+    tape = TradeTape()
+    tape.add_book("SPY", [(1.0, 5), (0.95, 2)], [(1.1, 3), (1.15, 1)])
+    assert tape.add_level_one("SPY", START, 1.1, 2) == (START, 1.1, 2, "ASK")
+    assert tape.add_level_one("SPY", START + 1, 1.2, 1) == (START + 1, 1.2, 1, "ASK")
+    assert tape.add_level_one("SPY", START + 2, 1.0, 4) == (START + 2, 1.0, 4, "BID")
+    assert tape.add_level_one("SPY", START + 3, 1.05, 1) == (START + 3, 1.05, 1, None)
+
+
+def test_empty_levels_dont_make_the_touch():
+    tape = TradeTape()
+    tape.add_book("SPY", [(1.0, 0), (0.95, 2)], [(1.1, 0), (1.15, 1)])
+    assert tape.add_level_one("SPY", START, 1.0, 1)[3] is None
+    # A one-sided update leaves the other side's touch alone
+    tape.add_book("SPY", None, [(1.05, 1)])
+    assert tape.add_level_one("SPY", START + 1, 0.95, 1)[3] == "BID"
+    assert tape.add_level_one("SPY", START + 2, 1.05, 1)[3] == "ASK"
+
+
+def test_only_sized_updates_are_prints():
+    tape = TradeTape()
+    assert tape.add_level_one("SPY", START, None, 5) is None        # no price seen yet
+    assert tape.add_level_one("SPY", START + 1, 1.0, None) is None
+    assert tape.add_level_one("SPY", START + 2, 1.0, 0) is None
+    # The last price seen is used when the update leaves it out
+    assert tape.add_level_one("SPY", START + 3, None, 2) == (START + 3, 1.0, 2, None)
+
+
+def test_timestamps_strictly_increase_per_symbol():
+    tape = TradeTape()
+    assert tape.add_level_one("SPY", START, 1.0, 1)[0] == START
+    assert tape.add_level_one("SPY", START, 1.0, 1)[0] == START + 1
+    assert tape.add_level_one("SPY", START - 5, 1.0, 1)[0] == START + 2
+    assert tape.add_level_one("QQQ", START, 1.0, 1)[0] == START
+
+
+def test_profile_bucket():
+    bucket = START - START % PROFILE_BUCKET_MS
+    assert profile_bucket(START) == bucket
+    assert profile_bucket(bucket + PROFILE_BUCKET_MS - 1) == bucket
+    assert profile_bucket(bucket + PROFILE_BUCKET_MS) == bucket + PROFILE_BUCKET_MS
+
+
+def test_summarize_profile():
+    summary = summarize_profile({1.0: [3, 3, 0, 1], 1.1: [6, 0, 6, 2], 1.05: [1, 0, 0, 1]})
+    assert summary["volume"] == 10
+    assert summary["trades"] == 4
+    assert summary["vwap"] == round((3 * 1.0 + 6 * 1.1 + 1.05) / 10, 4)
+    assert summary["poc"] == 1.1
+    assert [level["price"] for level in summary["levels"]] == [1.0, 1.05, 1.1]
+    assert summarize_profile({}) == {"volume": 0, "trades": 0, "vwap": None, "poc": None, "levels": []}
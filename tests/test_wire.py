@@ -0,0 +1,78 @@
+# tests/test_wire.py
+import pytest
+
+from wire import ColumnChunk, decode_columnar, encode_columnar, join_columnar, wants_columnar
+
+SNAPSHOTS = [
+    {
+        "timestamp": 1_700_000_000_000,
+        "levels": [
+            {"price": 1.25, "quantity": 10, "side": "BID"},
+            {"price": 1.2, "quantity": 0, "side": "BID"},
+            {"price": 1.3, "quantity": 4, "side": "ASK"},
+            {"price": 1.35, "quantity": 0, "side": "ASK"},
+        ],
+        "last_price": 1.27,
+        "last_size": 3.0,
+        "underlying_price": 501.5,
+    },
+    # A snapshot without levels or level-one fields
+    {"timestamp": 1_700_000_000_250, "levels": [], "last_price": None, "last_size": None, "underlying_price": None},
+    {
+        "timestamp": 1_700_000_001_000,
+        "levels": [{"price": 0.05, "quantity": 250, "side": "ASK"}],
+        "last_price": 0.05,
+        "last_size": None,
+        "underlying_price": 499.0,
+    },
+]
+
+
+def test_round_trip():
+    symbol, cursor, snapshots = decode_columnar(encode_columnar("SPY   250423C00500000", SNAPSHOTS))
+    assert symbol == "SPY   250423C00500000"
+    assert cursor == SNAPSHOTS[-1]["timestamp"]
+    assert snapshots == SNAPSHOTS
+
+
+@pytest.mark.parametrize("symbol", ["", "Q", "ÄÖ option"])
+def test_sections_stay_aligned(symbol):
+    body = encode_columnar(symbol, SNAPSHOTS[:1], cursor=None)
+    assert len(body) % 8 == 0
+    decoded_symbol, cursor, snapshots = decode_columnar(body)
+    assert (decoded_symbol, snapshots) == (symbol, SNAPSHOTS[:1])
+    assert cursor == SNAPSHOTS[0]["timestamp"]
+
+
+def test_empty_body_keeps_the_cursor():
+    assert decode_columnar(encode_columnar("SPY", [], cursor=1234)) == ("SPY", 1234, [])
+    assert decode_columnar(encode_columnar("SPY", [])) == ("SPY", None, [])
+
+
+def test_chunks_join_like_one_encode():
+    chunks = []
+    for snapshot in SNAPSHOTS:
+        chunk = ColumnChunk()
+        chunk.append(snapshot)
+        chunks.append(chunk)
+    assert join_columnar("SPY", chunks + [ColumnChunk()]) == encode_columnar("SPY", SNAPSHOTS)
+
+
+def test_tail():
+    chunk = ColumnChunk()
+    for snapshot in SNAPSHOTS:
+        chunk.append(snapshot)
+    for index in range(len(SNAPSHOTS)):
+        assert decode_columnar(join_columnar("SPY", [chunk.tail(index)]))[2] == SNAPSHOTS[index:]
+
+
+def test_quantities_are_float32():
+    snapshot = dict(SNAPSHOTS[0], levels=[{"price": 1.0, "quantity": 16_777_217, "side": "BID"}])
+    quantity = decode_columnar(encode_columnar("SPY", [snapshot]))[2][0]["levels"][0]["quantity"]
+    assert quantity == 16_777_216
+
+
+def test_wants_columnar():
+    assert wants_columnar("application/vnd.depth.columnar, application/json;q=0.9")
+    assert not wants_columnar("application/json")
+    assert not wants_columnar(None)
@@ -0,0 +1,183 @@
+# wire.py
+"""Binary columnar encoding of depth snapshots, sent when a client asks for it via Accept.
+
+Layout (little-endian, every section starts on an 8-byte boundary):
+
+    header    magic "DPC1", u32 snapshot count n, u32 level count m,
+              u32 price scale, u32 symbol byte length, u32 reserved,
+              f64 cursor (NaN if none)                                  32 bytes
+    symbol    UTF-8
+    f64[n]    timestamps (ms)
+    f64[n]    last_price        (NaN = null)
+    f64[n]    last_size         (NaN = null)
+    f64[n]    underlying_price  (NaN = null)
+    u32[n+1]  level offsets: snapshot i owns levels offsets[i]..offsets[i+1]
+    i32[m]    prices in ticks (price * price scale)
+    f32[m]    signed quantities: positive = BID, negative = ASK (-0.0 for an empty ask)
+
+A browser can view each column in place with a typed array; nothing is
+allocated per level.
+"""
+import math
+import struct
+import sys
+from array import array
+
+from storage import PRICE_SCALE
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.depth.columnar"
+
+MAGIC = b"DPC1"
+_HEADER = struct.Struct("<4sIIIIId")
+
+
+def wants_columnar(accept):
+    """True if an Accept header asks for the columnar format."""
+    return COLUMNAR_MEDIA_TYPE in (accept or "")
+
+
+def _padded(data):
+    return data + b"\0" * (-len(data) % 8)
+
+
+class ColumnChunk:
+    """Columns for a run of consecutive snapshots; level offsets are local to the chunk."""
+
+    __slots__ = ("timestamps", "last_prices", "last_sizes", "underlying_prices", "offsets", "prices", "quantities")
+
+    def __init__(self):
+        self.timestamps = array("d")
+        self.last_prices = array("d")
+        self.last_sizes = array("d")
+        self.underlying_prices = array("d")
+        self.offsets = array("I", [0])
+        self.prices = array("i")
+        self.quantities = array("f")
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, snapshot):
+        """Add one snapshot dict (as served by /historical_full)."""
+        self.timestamps.append(snapshot["timestamp"])
+        for column, field in ((self.last_prices, "last_price"), (self.last_sizes, "last_size"),
+                              (self.underlying_prices, "underlying_price")):
+            value = snapshot.get(field)
+            column.append(math.nan if value is None else value)
+        prices = self.prices
+        quantities = self.quantities
+        for level in snapshot["levels"]:
+            prices.append(round(level["price"] * PRICE_SCALE))
+            quantity = float(level["quantity"])
+            # -0.0 keeps the side of an empty ask level
+            quantities.append(quantity if level["side"] == "BID" else -quantity)
+        self.offsets.append(len(prices))
+
+    def tail(self, index):
+        """A new chunk holding snapshots index.. of this one."""
+        if index <= 0:
+            return self
+        chunk = ColumnChunk()
+        first = self.offsets[index]
+        chunk.timestamps = self.timestamps[index:]
+        chunk.last_prices = self.last_prices[index:]
+        chunk.last_sizes = self.last_sizes[index:]
+        chunk.underlying_prices = self.underlying_prices[index:]
+        chunk.offsets = array("I", (o - first for o in self.offsets[index:]))
+        chunk.prices = self.prices[first:]
+        chunk.quantities = self.quantities[first:]
+        return chunk
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (
+            self.timestamps, self.last_prices, self.last_sizes, self.underlying_prices,
+            self.offsets, self.prices, self.quantities,
+        ))
+
+
+def join_columnar(symbol, chunks, cursor=None):
+    """Concatenate ColumnChunks into one columnar body. cursor defaults to the newest timestamp."""
+    timestamps = array("d")
+    last_prices = array("d")
+    last_sizes = array("d")
+    underlying_prices = array("d")
+    offsets = array("I", [0])
+    prices = array("i")
+    quantities = array("f")
+
+    for chunk in chunks:
+        if not len(chunk):
+            continue
+        base = len(prices)
+        timestamps.extend(chunk.timestamps)
+        last_prices.extend(chunk.last_prices)
+        last_sizes.extend(chunk.last_sizes)
+        underlying_prices.extend(chunk.underlying_prices)
+        if base:
+            offsets.extend(o + base for o in chunk.offsets[1:])
+        else:
+            offsets.extend(chunk.offsets[1:])
+        prices.extend(chunk.prices)
+        quantities.extend(chunk.quantities)
+        cursor = chunk.timestamps[-1]
+
+    columns = (timestamps, last_prices, last_sizes, underlying_prices, offsets, prices, quantities)
+    if sys.byteorder != "little":
+        for column in columns:
+            column.byteswap()
+
+    symbol_bytes = symbol.encode("utf-8")
+    header = _HEADER.pack(
+        MAGIC, len(timestamps), len(prices), PRICE_SCALE, len(symbol_bytes), 0,
+        math.nan if cursor is None else cursor,
+    )
+    return b"".join([header, _padded(symbol_bytes)] + [_padded(column.tobytes()) for column in columns])
+
+
+def encode_columnar(symbol, snapshots, cursor=None):
+    """Encode snapshot dicts (as served by /historical_full) into the columnar layout."""
+    chunk = ColumnChunk()
+    for snapshot in snapshots:
+        chunk.append(snapshot)
+    return join_columnar(symbol, [chunk], cursor)
+
+
+def decode_columnar(body):
+    """(symbol, cursor, snapshots) of a columnar body; the inverse of encode_columnar.
+
+    Quantities come back as float32, as a browser reads them.
+    """
+    magic, n, m, price_scale, symbol_length, _, cursor = _HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ValueError(f"Unknown depth format {magic!r}")
+    offset = _HEADER.size
+    symbol = bytes(body[offset:offset + symbol_length]).decode("utf-8")
+    offset += symbol_length + (-symbol_length % 8)
+
+    def column(typecode, length):
+        nonlocal offset
+        values = array(typecode)
+        values.frombytes(bytes(body[offset:offset + length * values.itemsize]))
+        if sys.byteorder != "little":
+            values.byteswap()
+        offset += length * values.itemsize + (-(length * values.itemsize) % 8)
+        return values
+
+    timestamps = column("d", n)
+    fields = [column("d", n) for _ in ("last_price", "last_size", "underlying_price")]
+    offsets = column("I", n + 1)
+    prices = column("i", m)
+    quantities = column("f", m)
+
+    snapshots = []
+    for i in range(n):
+        snapshot = {"timestamp": timestamps[i]}
+        for name, values in zip(("last_price", "last_size", "underlying_price"), fields):
+            snapshot[name] = None if math.isnan(values[i]) else values[i]
+        snapshot["levels"] = [
+            {"price": prices[k] / price_scale, "quantity": abs(quantities[k]),
+             "side": "BID" if math.copysign(1, quantities[k]) > 0 else "ASK"}
+            for k in range(offsets[i], offsets[i + 1])
+        ]
+        snapshots.append(snapshot)
+    return symbol, None if math.isnan(cursor) else cursor, snapshots
@@ -0,0 +1,184 @@
+# writer.py
+import queue
+import threading
+import time
+
+from logs import get_logger
+from metrics import Histogram
+
+log = get_logger("writer")
+
+
+class BatchWriter:
+    """Drain queued rows into SQLite from a dedicated thread, grouping commits.
+
+    The streamer's callback thread only parses messages and calls put(); all
+    executemany/commit work (and therefore every fsync) happens here.
+    """
+
+    def __init__(self, connect, max_queue=50000, batch_rows=5000, flush_interval=0.05, put_timeout=0.5):
+        # connect() is called on the writer thread and must return a sqlite3 connection
+        self._connect = connect
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+
+        # Registered with the owning process's metrics
+        self.commit_seconds = Histogram("writer_commit_seconds", "Time to write and commit one batch")
+
+        # Backpressure / throughput counters
+        self.stats = {
+            "enqueued_rows": 0,
+            "written_rows": 0,
+            "commits": 0,
+            "blocked_puts": 0,   # put() found the queue full and had to wait
+            "dropped_rows": 0,   # queue stayed full past put_timeout
+            "max_queue_depth": 0,
+            "errors": 0,
+            "rotations": 0,
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, sql, rows):
+        """Queue rows for a statement. Returns False if the rows had to be dropped."""
+        if not rows:
+            return True
+        item = (sql, rows)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self.stats["blocked_puts"] += 1
+            try:
+                self._queue.put(item, timeout=self.put_timeout)
+            except queue.Full:
+                with self._stats_lock:
+                    self.stats["dropped_rows"] += len(rows)
+                return False
+
+        with self._stats_lock:
+            self.stats["enqueued_rows"] += len(rows)
+            depth = self._queue.qsize()
+            if depth > self.stats["max_queue_depth"]:
+                self.stats["max_queue_depth"] = depth
+        return True
+
+    def rotate(self, connect):
+        """Switch to connect()'s database once every row queued so far is committed to the current one."""
+        # Never dropped: rows put after this must not land in the old file
+        self._queue.put((None, connect))
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
+
+    def stop(self, timeout=10):
+        """Stop the writer thread after flushing everything still queued.
+
+        Waits as long as the queue keeps draining. If it stalls for timeout
+        seconds, the rows still queued are logged and counted as dropped.
+        """
+        self._stop_event.set()
+        if not self._thread:
+            return
+        depth = self._queue.qsize()
+        while True:
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                break
+            remaining = self._queue.qsize()
+            if remaining >= depth:
+                self._drop_queued()
+                break
+            depth = remaining
+        self._thread = None
+
+    def _drop_queued(self):
+        """Take the rows the writer thread never got to off the queue and count them as dropped."""
+        dropped = 0
+        while True:
+            try:
+                sql, rows = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if sql is not None:
+                dropped += len(rows)
+        with self._stats_lock:
+            self.stats["dropped_rows"] += dropped
+        log.error("Writer did not drain its queue on stop; dropped %d queued rows", dropped)
+
+    def _run(self):
+        conn = self._connect()
+        pending = {}
+        pending_rows = 0
+        last_commit = time.monotonic()
+
+        while True:
+            stopping = self._stop_event.is_set()
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_commit))
+            try:
+                sql, rows = self._queue.get(timeout=timeout if not stopping else 0.01)
+                if sql is None:
+                    # Rollover marker: finish the old file, continue in the new one
+                    self._flush(conn, pending, pending_rows)
+                    pending = {}
+                    pending_rows = 0
+                    last_commit = time.monotonic()
+                    conn.close()
+                    self._connect = rows
+                    conn = self._connect()
+                    with self._stats_lock:
+                        self.stats["rotations"] += 1
+                    continue
+                pending.setdefault(sql, []).extend(rows)
+                pending_rows += len(rows)
+            except queue.Empty:
+                if stopping:
+                    # Queue is drained; write whatever is left and exit
+                    self._flush(conn, pending, pending_rows)
+                    conn.close()
+                    return
+
+            if pending_rows >= self.batch_rows or time.monotonic() - last_commit >= self.flush_interval:
+                self._flush(conn, pending, pending_rows)
+                pending = {}
+                pending_rows = 0
+                last_commit = time.monotonic()
+
+    def _flush(self, conn, pending, pending_rows):
+        if not pending_rows:
+            return
+        started = time.perf_counter()
+        try:
+            cursor = conn.cursor()
+            for sql, rows in pending.items():
+                cursor.executemany(sql, rows)
+            conn.commit()
+            self.commit_seconds.observe(time.perf_counter() - started)
+            with self._stats_lock:
+                self.stats["written_rows"] += pending_rows
+                self.stats["commits"] += 1
+        except Exception as e:
+            with self._stats_lock:
+                self.stats["errors"] += 1
+            log.error("Error writing batch of %d rows: %s", pending_rows, e)
+            try:
+                conn.rollback()
+            except Exception:
+                pass